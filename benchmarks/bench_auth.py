@@ -0,0 +1,97 @@
+"""Authenticated request throughput with and without the token cache.
+
+firebase_admin.auth.verify_id_token is replaced by a local RS256 verifier
+over a generated key set, so no network is needed. Like the SDK, the stub
+loads the signing key's PEM and checks the signature on every call.
+
+Usage: python benchmarks/bench_auth.py [requests]
+"""
+import base64
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+os.environ.setdefault('MONGO_URI', 'mongodb://localhost:27017')
+
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import padding, rsa
+from firebase_admin import auth
+from flask import Flask, jsonify
+
+from src.server.utils import auth as auth_utils
+
+def b64url(data):
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode()
+
+def b64url_decode(data):
+    return base64.urlsafe_b64decode(data + '=' * (-len(data) % 4))
+
+def make_key_set(count=3):
+    keys = {}
+    for i in range(count):
+        private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        public_pem = private_key.public_key().public_bytes(
+            serialization.Encoding.PEM, serialization.PublicFormat.SubjectPublicKeyInfo)
+        keys[f"kid-{i}"] = (private_key, public_pem)
+    return keys
+
+def sign(keys, kid, claims):
+    header = b64url(json.dumps({'alg': 'RS256', 'kid': kid}).encode())
+    payload = b64url(json.dumps(claims).encode())
+    signature = keys[kid][0].sign(f"{header}.{payload}".encode(), padding.PKCS1v15(), hashes.SHA256())
+    return f"{header}.{payload}.{b64url(signature)}"
+
+def stub_verifier(keys):
+    def verify_id_token(token, *args, **kwargs):
+        header, payload, signature = token.split('.')
+        kid = json.loads(b64url_decode(header))['kid']
+        public_key = serialization.load_pem_public_key(keys[kid][1])
+        public_key.verify(b64url_decode(signature), f"{header}.{payload}".encode(),
+                          padding.PKCS1v15(), hashes.SHA256())
+        claims = json.loads(b64url_decode(payload))
+        if claims['exp'] <= time.time():
+            raise ValueError('Token expired')
+        return claims
+    return verify_id_token
+
+def make_app():
+    app = Flask(__name__)
+
+    @app.route('/samples')
+    @auth_utils.require_auth
+    def samples():
+        return jsonify([])
+
+    return app
+
+def run(client, tokens, requests):
+    start = time.perf_counter()
+    for i in range(requests):
+        response = client.get('/samples', headers={'Authorization': f"Bearer {tokens[i % len(tokens)]}"})
+        assert response.status_code == 200
+    return requests / (time.perf_counter() - start)
+
+def main():
+    requests = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    keys = make_key_set()
+    auth.verify_id_token = stub_verifier(keys)
+    expires = int(time.time()) + 3600
+    # A handful of users, each making several calls per page load
+    tokens = [sign(keys, f"kid-{i % 3}", {'uid': f"user-{i}", 'exp': expires}) for i in range(8)]
+    client = make_app().test_client()
+
+    auth_utils.token_cache = auth_utils.TokenCache(maxsize=0)
+    uncached = run(client, tokens, requests)
+
+    auth_utils.token_cache = auth_utils.TokenCache()
+    cached = run(client, tokens, requests)
+
+    print(f"requests:        {requests}")
+    print(f"without cache:   {uncached:8.0f} req/s")
+    print(f"with cache:      {cached:8.0f} req/s  ({cached / uncached:.1f}x)")
+    print(f"cache stats:     {auth_utils.token_cache.stats()}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+"""Peak RSS of the streaming dataset export from 1k to 1M rows.
+
+Each size runs in a fresh interpreter so ru_maxrss reflects that export
+alone. Documents come from a generator standing in for the Mongo cursor.
+
+Usage: python benchmarks/bench_export.py [--xlsx]
+"""
+import os
+import resource
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+os.environ.setdefault('MONGO_URI', 'mongodb://localhost:27017')
+
+SIZES = (1_000, 10_000, 100_000, 1_000_000)
+
+def fake_cursor(n):
+    for i in range(n):
+        yield {
+            'timestamp': f"2024-{i % 12 + 1:02d}-{i % 28 + 1:02d}T10:15:00.000Z",
+            'chip_id': f"P{i:08d}",
+            'patient_id': f"PT{i % 5000:05d}",
+            'sample_type': 'LC Positive' if i % 3 else 'LC Negative',
+            'batch_number': f"B{i % 40}",
+            'mfg_date': '2023-11-02',
+            'final_volume': 400 + i % 300,
+            'average_co2': round(2 + (i % 30) / 10, 1),
+        }
+
+def run_child(n, export_format):
+    from src.server.utils.export import export_rows, stream_csv, stream_xlsx
+
+    rows = export_rows(fake_cursor(n))
+    stream = stream_xlsx(rows) if export_format == 'xlsx' else stream_csv(rows, compress=True)
+    start = time.perf_counter()
+    first_byte = None
+    total = 0
+    for chunk in stream:
+        if first_byte is None:
+            first_byte = time.perf_counter() - start
+        total += len(chunk)
+    elapsed = time.perf_counter() - start
+    peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f"{n:>9} {peak_mb:>9.1f}MB {total / 1e6:>9.2f}MB {first_byte * 1000:>9.1f}ms {elapsed:>7.2f}s")
+
+def main():
+    export_format = 'xlsx' if '--xlsx' in sys.argv else 'csv'
+    print(f"format: {export_format}")
+    print(f"{'rows':>9} {'peak RSS':>11} {'output':>11} {'1st byte':>11} {'total':>8}")
+    for n in SIZES:
+        subprocess.run([sys.executable, __file__, '--child', str(n), export_format], check=True)
+
+if __name__ == '__main__':
+    if '--child' in sys.argv:
+        index = sys.argv.index('--child')
+        run_child(int(sys.argv[index + 1]), sys.argv[index + 2])
+    else:
+        main()
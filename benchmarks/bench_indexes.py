@@ -0,0 +1,129 @@
+"""Query plans and latency of the hot sample queries before and after the index registry.
+
+Needs a real MongoDB (explain is not available in mongomock). Seeds a scratch
+database, explains and times each hot query with only the _id index, runs
+IndexRegistry.ensure, and repeats. Every query should go from COLLSCAN to
+IXSCAN, and the keyset page should lose its in-memory SORT stage.
+
+Usage: MONGO_URI=mongodb://localhost:27017 python benchmarks/bench_indexes.py [samples] [repeats]
+"""
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+os.environ.setdefault('MONGO_URI', 'mongodb://localhost:27017')
+
+from pymongo import MongoClient
+
+from src.server.utils.indexes import IndexRegistry
+
+STATUSES = ['In Process', 'Ready for Pickup', 'Picked up. Ready for Analysis', 'Complete']
+
+def seed(db, count):
+    now = datetime(2024, 6, 1)
+    samples = []
+    for i in range(count):
+        timestamp = now - timedelta(minutes=i)
+        samples.append({
+            'chip_id': f"C{i:07d}",
+            'patient_id': f"P{i % 5000:05d}",
+            'status': random.choices(STATUSES, weights=[1, 1, 2, 96])[0],
+            'timestamp': timestamp.isoformat() + 'Z',
+            'expected_completion_time': (timestamp + timedelta(hours=2)).isoformat(),
+            'updated_at': timestamp,
+        })
+    db.samples.insert_many(samples)
+    db.analyzed.insert_many([{'chip_id': s['chip_id'], 'timestamp': s['timestamp']} for s in samples[::10]])
+    db.notification_outbox.insert_many([
+        {'status': 'sent' if i % 50 else 'pending', 'next_attempt_at': now} for i in range(count // 10)
+    ])
+
+def hot_queries(db, count):
+    def chip_id():
+        return f"C{random.randrange(count):07d}"
+
+    return {
+        'find_one chip_id': lambda explain: (
+            db.command('explain', {'find': 'samples', 'filter': {'chip_id': chip_id()}, 'limit': 1})
+            if explain else db.samples.find_one({'chip_id': chip_id()})),
+        'update_one chip_id': lambda explain: (
+            db.command('explain', {'update': 'samples', 'updates': [
+                {'q': {'chip_id': chip_id()}, 'u': {'$set': {'notes': 'x'}}}]})
+            if explain else db.samples.update_one({'chip_id': chip_id()}, {'$set': {'notes': 'x'}})),
+        'samples page by status': lambda explain: (
+            db.command('explain', {'aggregate': 'samples', 'pipeline': [
+                {'$match': {'status': {'$in': STATUSES[:3]}}},
+                {'$sort': {'timestamp': -1, 'chip_id': -1}}, {'$limit': 51}], 'cursor': {}})
+            if explain else list(db.samples.aggregate([
+                {'$match': {'status': {'$in': STATUSES[:3]}}},
+                {'$sort': {'timestamp': -1, 'chip_id': -1}}, {'$limit': 51}]))),
+        'in process by due time': lambda explain: (
+            db.command('explain', {'find': 'samples', 'filter': {'status': 'In Process'},
+                                   'projection': {'chip_id': 1, 'expected_completion_time': 1}})
+            if explain else list(db.samples.find({'status': 'In Process'},
+                                                 {'chip_id': 1, 'expected_completion_time': 1}))),
+        'analyzed by timestamp': lambda explain: (
+            db.command('explain', {'find': 'analyzed', 'filter': {}, 'sort': {'timestamp': 1}, 'limit': 100})
+            if explain else list(db.analyzed.find({}).sort('timestamp', 1).limit(100))),
+        'outbox claim': lambda explain: (
+            db.command('explain', {'find': 'notification_outbox',
+                                   'filter': {'status': 'pending', 'next_attempt_at': {'$lte': datetime.now()}}})
+            if explain else db.notification_outbox.find_one(
+                {'status': 'pending', 'next_attempt_at': {'$lte': datetime.now()}})),
+    }
+
+def plan_stages(node):
+    """Every stage name in the winning plan(s) of an explain result"""
+    stages = []
+    if isinstance(node, dict):
+        if 'stage' in node:
+            stages.append(node['stage'])
+        for key, value in node.items():
+            if key != 'rejectedPlans':
+                stages.extend(plan_stages(value))
+    elif isinstance(node, list):
+        for item in node:
+            stages.extend(plan_stages(item))
+    return stages
+
+def measure(queries, repeats):
+    results = {}
+    for name, query in queries.items():
+        stages = plan_stages(query(True))
+        start = time.perf_counter()
+        for _ in range(repeats):
+            query(False)
+        results[name] = ('IXSCAN' if 'IXSCAN' in stages else 'COLLSCAN' if 'COLLSCAN' in stages else '/'.join(stages),
+                         'SORT' in stages, (time.perf_counter() - start) / repeats * 1000)
+    return results
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    client = MongoClient(os.environ['MONGO_URI'])
+    client.drop_database('onebreath_index_benchmark')
+    db = client['onebreath_index_benchmark']
+    try:
+        seed(db, count)
+        queries = hot_queries(db, count)
+        before = measure(queries, repeats)
+        registry = IndexRegistry().ensure({
+            'samples': db.samples, 'analyzed': db.analyzed, 'notification_outbox': db.notification_outbox,
+        })
+        after = measure(queries, repeats)
+
+        print(f"samples: {count}, repeats: {repeats}")
+        print(f"{'query':26} {'before':>22} {'after':>22} {'speedup':>8}")
+        for name in queries:
+            (plan_a, sort_a, ms_a), (plan_b, sort_b, ms_b) = before[name], after[name]
+            print(f"{name:26} {plan_a + (' +SORT' if sort_a else ''):>13} {ms_a:6.2f}ms "
+                  f"{plan_b + (' +SORT' if sort_b else ''):>13} {ms_b:6.2f}ms {ms_a / ms_b:7.1f}x")
+        print(f"drift after ensure: {registry.report()}")
+    finally:
+        client.drop_database('onebreath_index_benchmark')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+"""Write latency and correctness of sample updates under concurrent green threads.
+
+Compares the old read-then-write pattern (find_one + update_one) with the
+atomic mutate() helper (one find_one_and_update returning the pre-image):
+
+  latency      mean time per status update
+  transitions  concurrent status changes on one chip. Every write should see
+               a distinct previous status, which is what the notification
+               email reports. Read-then-write lets two writers both see the
+               same previous value.
+  counter      read-modify-write increments. The naive version loses updates;
+               with the version check and a retry on VersionConflict none are
+               lost.
+
+Uses mongomock with a simulated network round trip (eventlet.sleep around
+every command), so green threads interleave the way they do against a
+remote server. Set BENCH_MONGO_URI to run against a real MongoDB instead.
+
+Usage: python benchmarks/bench_mutations.py [threads] [rtt_ms]
+"""
+import os
+import sys
+import time
+
+import eventlet
+eventlet.monkey_patch()
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+os.environ.setdefault('MONGO_URI', 'mongodb://localhost:27017')
+
+from src.server.utils.mutations import VersionConflict, mutate, sample_update
+
+class RoundTripCollection:
+    """Adds a network round trip to every collection call"""
+
+    def __init__(self, collection, rtt):
+        self.collection = collection
+        self.rtt = rtt
+
+    def __getattr__(self, name):
+        attribute = getattr(self.collection, name)
+        if not callable(attribute):
+            return attribute
+
+        def call(*args, **kwargs):
+            eventlet.sleep(self.rtt / 2)
+            result = attribute(*args, **kwargs)
+            eventlet.sleep(self.rtt / 2)
+            return result
+        return call
+
+def make_collection(rtt):
+    uri = os.environ.get('BENCH_MONGO_URI')
+    if uri:
+        from pymongo import MongoClient
+        collection = MongoClient(uri)['onebreath_mutation_benchmark']['samples']
+        collection.drop()
+        return collection
+    import mongomock
+    return RoundTripCollection(mongomock.MongoClient()['bench']['samples'], rtt)
+
+def read_then_write(collection, chip_id, status):
+    current = collection.find_one({'chip_id': chip_id})
+    collection.update_one({'chip_id': chip_id}, sample_update({'status': status}))
+    return current.get('status')
+
+def atomic(collection, chip_id, status):
+    return mutate(collection, {'chip_id': chip_id}, {'status': status})['status']
+
+def latency(collection, update, count):
+    """Mean ms per update, one at a time"""
+    collection.insert_many([{'chip_id': f"L{i}", 'status': 'In Process', 'version': 1} for i in range(count)])
+    start = time.perf_counter()
+    for i in range(count):
+        update(collection, f"L{i}", 'Complete')
+    elapsed = time.perf_counter() - start
+    collection.delete_many({'chip_id': {'$regex': '^L'}})
+    return elapsed * 1000 / count
+
+def transitions(collection, update, threads):
+    """Returns how many writers reported a previous status another writer also reported"""
+    chip_id = f"T-{update.__name__}"
+    collection.insert_one({'chip_id': chip_id, 'status': 'status-start', 'version': 1})
+    pool = eventlet.GreenPool(threads)
+    seen = list(pool.imap(lambda i: update(collection, chip_id, f"status-{i}"), range(threads)))
+    return len(seen) - len(set(seen))
+
+def naive_increment(collection, chip_id):
+    current = collection.find_one({'chip_id': chip_id})
+    collection.update_one({'chip_id': chip_id}, {'$set': {'count': current['count'] + 1}})
+
+def versioned_increment(collection, chip_id):
+    while True:
+        current = collection.find_one({'chip_id': chip_id}, {'count': 1, 'version': 1})
+        try:
+            mutate(collection, {'chip_id': chip_id}, {'count': current['count'] + 1}, current['version'])
+            return
+        except VersionConflict:
+            eventlet.sleep(0)
+
+def counter(collection, increment, threads):
+    chip_id = f"C-{increment.__name__}"
+    collection.insert_one({'chip_id': chip_id, 'count': 0, 'version': 1})
+    pool = eventlet.GreenPool(threads)
+    for _ in range(threads):
+        pool.spawn(increment, collection, chip_id)
+    pool.waitall()
+    return collection.find_one({'chip_id': chip_id})['count']
+
+def main():
+    threads = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    rtt = (float(sys.argv[2]) if len(sys.argv) > 2 else 2.0) / 1000
+    collection = make_collection(rtt)
+
+    print(f"green threads: {threads}, simulated round trip: {rtt * 1000:.1f}ms")
+    for update in (read_then_write, atomic):
+        mean_ms = latency(collection, update, threads)
+        duplicates = transitions(collection, update, threads)
+        print(f"{update.__name__:16} {mean_ms:7.2f}ms per update  "
+              f"duplicate previous statuses: {duplicates}/{threads}")
+    for increment in (naive_increment, versioned_increment):
+        print(f"{increment.__name__:20} final count {counter(collection, increment, threads)}/{threads}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+"""BSON-to-JSON cost of an analyzed-samples response, old path vs the serialization layer.
+
+  old  decode with default codec options, convert_decimal128 over every
+       document, then Flask's jsonify
+  new  decode with JSON_CODEC_OPTIONS (Decimal128 becomes float inside the
+       driver's decoder), then serialization.json_response
+
+Both start from the raw BSON bytes of a cursor batch, which is what the
+driver receives from the server, so no MongoDB is needed. The bodies are
+compared after parsing to check both paths return the same data.
+
+Usage: python benchmarks/bench_serialization.py [documents] [repeats]
+"""
+import json
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+os.environ.setdefault('MONGO_URI', 'mongodb://localhost:27017')
+
+import bson
+from bson.decimal128 import Decimal128
+from flask import Flask, jsonify
+
+from src.server.utils.helpers import convert_decimal128
+from src.server.utils.serialization import JSON_CODEC_OPTIONS, json_response, orjson
+
+def analyzed_sample(i):
+    timestamp = datetime(2024, 6, 1) - timedelta(minutes=i)
+    decimal = lambda: Decimal128(f"{random.uniform(0, 100):.6f}")
+    return {
+        'chip_id': f"C{i:07d}",
+        'patient_id': f"P{i % 5000:05d}",
+        'sample_type': random.choice(['LC', 'Control', 'Unknown']),
+        'timestamp': timestamp.isoformat() + 'Z',
+        'average_co2': decimal(),
+        'final_volume': decimal(),
+        'pentanal': decimal(), 'decanal': decimal(), '2-butanone': decimal(), '2-hydroxyacetaldehyde': decimal(),
+        '2-hydroxyacetone': decimal(), '4-HHE': decimal(), '4HNE': decimal(),
+        'diagnosis': random.choice(['Positive', 'Negative', 'Pending']),
+        'updated_at': timestamp,
+    }
+
+def old_path(raw):
+    docs = bson.decode_all(raw)
+    return jsonify([convert_decimal128(doc) for doc in docs]).get_data()
+
+def new_path(raw):
+    return json_response(bson.decode_all(raw, JSON_CODEC_OPTIONS)).get_data()
+
+def timed(path, raw, repeats):
+    best = float('inf')
+    for _ in range(repeats):
+        start = time.perf_counter()
+        body = path(raw)
+        best = min(best, time.perf_counter() - start)
+    return best * 1000, body
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10_000
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    random.seed(1)
+    raw = b''.join(bson.encode(analyzed_sample(i)) for i in range(count))
+
+    app = Flask(__name__)
+    with app.app_context():
+        old_ms, old_body = timed(old_path, raw, repeats)
+        new_ms, new_body = timed(new_path, raw, repeats)
+
+    old_docs, new_docs = json.loads(old_body), json.loads(new_body)
+    # jsonify writes datetimes as HTTP dates, the new encoder as ISO 8601
+    for doc in old_docs + new_docs:
+        doc.pop('updated_at')
+    print(f"documents: {count}, BSON: {len(raw) / 1e6:.1f}MB, encoder: {'orjson' if orjson else 'json'}")
+    print(f"old  {old_ms:8.1f}ms  {len(old_body) / 1e6:.1f}MB")
+    print(f"new  {new_ms:8.1f}ms  {len(new_body) / 1e6:.1f}MB  {old_ms / new_ms:.1f}x faster")
+    print(f"same data: {old_docs == new_docs}")
+
+if __name__ == '__main__':
+    main()
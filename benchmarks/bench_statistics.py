@@ -0,0 +1,82 @@
+"""Compare the per-field loop in calculate_statistics with the batched matrix version.
+
+Usage: MONGO_URI=mongodb://localhost python benchmarks/bench_statistics.py
+"""
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+os.environ.setdefault('MONGO_URI', 'mongodb://localhost:27017')
+
+from src.server.utils.helpers import calculate_statistics, calculate_statistics_matrix
+from src.server.utils.statistics import SUMMARY_FIELDS
+
+def legacy_calculate_statistics(samples, fields):
+    """calculate_statistics as it was before the batched rewrite"""
+    stats = {}
+    for field in fields:
+        values = []
+        for sample in samples:
+            try:
+                value = float(sample.get(field, 0))
+                if value >= 0:
+                    values.append(value)
+            except (ValueError, TypeError):
+                continue
+
+        if values:
+            values = np.array(values)
+            q1 = np.percentile(values, 25)
+            q3 = np.percentile(values, 75)
+            iqr = q3 - q1
+            filtered_values = values[(values >= q1 - 1.5 * iqr) & (values <= q3 + 1.5 * iqr)]
+            if len(filtered_values) > 0:
+                stats[field] = {
+                    'mean': float(np.mean(filtered_values)),
+                    'median': float(np.median(filtered_values)),
+                    'range': {
+                        'min': float(min(filtered_values)),
+                        'max': float(max(filtered_values))
+                    },
+                    'sample_count': int(len(filtered_values)),
+                    'original_count': int(len(values)),
+                    'outliers_removed': int(len(values) - len(filtered_values))
+                }
+            else:
+                stats[field] = None
+        else:
+            stats[field] = None
+    return stats
+
+def make_matrix(n, fields, rng):
+    values = rng.lognormal(mean=1.0, sigma=0.8, size=(n, len(fields)))
+    values[rng.random(values.shape) < 0.05] = np.nan
+    return values
+
+def best_of(fn, repeat=3):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+def main():
+    rng = np.random.default_rng(42)
+    fields = SUMMARY_FIELDS
+    print(f"{'samples':>8} {'legacy':>10} {'dicts':>10} {'matrix':>10} {'speedup':>8}")
+    for n in (1_000, 10_000, 100_000):
+        matrix = make_matrix(n, fields, rng)
+        samples = [{field: row[i] for i, field in enumerate(fields) if not np.isnan(row[i])}
+                   for row in matrix]
+
+        legacy = best_of(lambda: legacy_calculate_statistics(samples, fields))
+        dicts = best_of(lambda: calculate_statistics(samples, fields))
+        batched = best_of(lambda: calculate_statistics_matrix(matrix, fields))
+        print(f"{n:>8} {legacy * 1000:>8.1f}ms {dicts * 1000:>8.1f}ms "
+              f"{batched * 1000:>8.1f}ms {legacy / batched:>7.1f}x")
+
+if __name__ == '__main__':
+    main()
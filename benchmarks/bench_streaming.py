@@ -0,0 +1,150 @@
+"""Time to first token for blocking vs streamed (SSE) AI responses.
+
+Starts a local fake OpenAI server that emits `tokens` chunks after
+`latency_ms`, one every `token_ms`, and a Flask app with two routes built
+from the same pieces as /ai/chat:
+
+  blocking  chat.completions.create(...) then jsonify; the first byte is
+            the whole answer
+  stream    stream_completion(...) through sse_response
+
+It reports the time to the first byte, the first token and the full answer
+for each route. It then checks disconnect handling: a client reads one
+delta and hangs up, and the fake server must see its stream cancelled well
+before the last token.
+
+Usage: python benchmarks/bench_streaming.py [tokens] [token_ms] [latency_ms]
+"""
+import json
+import logging
+import os
+import socket
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+os.environ.setdefault('MONGO_URI', 'mongodb://localhost:27017')
+
+from flask import Flask, jsonify
+from openai import OpenAI
+from werkzeug.serving import make_server
+
+from src.server.utils.streaming import sse_response, stream_completion
+
+class FakeOpenAI(BaseHTTPRequestHandler):
+    tokens = 200
+    token_s = 0.01
+    latency_s = 0.5
+    streams = []
+
+    def log_message(self, *args):
+        pass
+
+    def chunk(self, delta, finish_reason=None):
+        return {'id': 'chatcmpl-bench', 'object': 'chat.completion.chunk', 'created': 0, 'model': 'bench',
+                'choices': [{'index': 0, 'delta': delta, 'finish_reason': finish_reason}]}
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        time.sleep(self.latency_s)
+        if not body.get('stream'):
+            time.sleep(self.tokens * self.token_s)
+            payload = json.dumps({
+                'id': 'chatcmpl-bench', 'object': 'chat.completion', 'created': 0, 'model': 'bench',
+                'choices': [{'index': 0, 'finish_reason': 'stop',
+                             'message': {'role': 'assistant', 'content': 'token ' * self.tokens}}],
+            }).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+            return
+
+        record = {'sent': 0, 'cancelled': False}
+        self.streams.append(record)
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.end_headers()
+        try:
+            for _ in range(self.tokens):
+                self.wfile.write(f"data: {json.dumps(self.chunk({'content': 'token '}))}\n\n".encode())
+                self.wfile.flush()
+                record['sent'] += 1
+                time.sleep(self.token_s)
+            self.wfile.write(f"data: {json.dumps(self.chunk({}, 'stop'))}\n\ndata: [DONE]\n\n".encode())
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            record['cancelled'] = True
+
+def make_app(openai_client):
+    app = Flask(__name__)
+    params = dict(model='bench', messages=[{'role': 'user', 'content': 'question'}], max_tokens=750)
+
+    @app.route('/blocking')
+    def blocking():
+        response = openai_client.chat.completions.create(**params)
+        return jsonify({'success': True, 'message': response.choices[0].message.content})
+
+    @app.route('/stream')
+    def stream():
+        return sse_response(stream_completion(
+            lambda: openai_client.chat.completions.create(stream=True, **params), 'message'))
+
+    return app
+
+def serve(server):
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server.server_address[1]
+
+def measure(port, path, hang_up_after_first_token=False):
+    """Returns (first byte, first token, complete) in ms"""
+    sock = socket.create_connection(('127.0.0.1', port))
+    start = time.perf_counter()
+    sock.sendall(f"GET {path} HTTP/1.1\r\nHost: bench\r\nConnection: close\r\n\r\n".encode())
+    reader = sock.makefile('rb')
+    first_byte = first_token = None
+    try:
+        for line in reader:
+            now = (time.perf_counter() - start) * 1000
+            first_byte = first_byte or now
+            if first_token is None and (line.startswith(b'event: delta') or line.startswith(b'{')):
+                first_token = now
+                if hang_up_after_first_token:
+                    return first_byte, first_token, None
+        return first_byte, first_token, (time.perf_counter() - start) * 1000
+    finally:
+        reader.close()
+        sock.close()
+
+def main():
+    FakeOpenAI.tokens = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    FakeOpenAI.token_s = (float(sys.argv[2]) if len(sys.argv) > 2 else 10) / 1000
+    FakeOpenAI.latency_s = (float(sys.argv[3]) if len(sys.argv) > 3 else 500) / 1000
+
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    fake = ThreadingHTTPServer(('127.0.0.1', 0), FakeOpenAI)
+    fake.daemon_threads = True
+    openai_client = OpenAI(api_key='bench', base_url=f"http://127.0.0.1:{serve(fake)}/v1", max_retries=0)
+    port = serve(make_server('127.0.0.1', 0, make_app(openai_client), threaded=True))
+
+    print(f"tokens: {FakeOpenAI.tokens}, {FakeOpenAI.token_s * 1000:.0f}ms/token, "
+          f"{FakeOpenAI.latency_s * 1000:.0f}ms before the first token")
+    print(f"{'route':10} {'first byte':>11} {'first token':>12} {'complete':>10}")
+    for path in ('/blocking', '/stream'):
+        first_byte, first_token, complete = measure(port, path)
+        print(f"{path[1:]:10} {first_byte:9.0f}ms {first_token:10.0f}ms {complete:8.0f}ms")
+
+    FakeOpenAI.streams.clear()
+    measure(port, '/stream', hang_up_after_first_token=True)
+    deadline = time.time() + FakeOpenAI.latency_s + FakeOpenAI.tokens * FakeOpenAI.token_s + 2
+    while time.time() < deadline and not FakeOpenAI.streams[0]['cancelled']:
+        time.sleep(0.05)
+    record = FakeOpenAI.streams[0]
+    print(f"client hang-up: upstream cancelled {record['cancelled']} after {record['sent']}/{FakeOpenAI.tokens} tokens")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,291 @@
+"""Server memory and bytes on the wire for the image upload paths.
+
+Starts a local fake GCS server (OAuth token, resumable and multipart
+uploads, V4 signed PUTs; objects are checksummed, not kept) and a Flask
+app with routes built from the same pieces as the API:
+
+  legacy     /upload_from_memory: base64 data URL in JSON, decoded in memory
+  raw        PUT /upload/<name> with the file as the body, streamed to GCS
+  multipart  POST /upload/<name> with a multipart/form-data body, streamed
+  signed     POST /upload_url, then the client PUTs to the signed URL
+  resumable  POST /upload_url with resumable, then the client PUTs chunks
+
+Request bodies are sent from files on disk, so the traced peak is the
+app's plus what the fake GCS server reads at a time. Each stored object's
+MD5 is checked against the source file. Finally a multipart body cut off
+mid-file must fail without creating an object.
+
+Usage: python benchmarks/bench_uploads.py [size_mb]
+"""
+import base64
+import hashlib
+import http.client
+import json
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+from urllib.parse import parse_qs, urlsplit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+os.environ.setdefault('MONGO_URI', 'mongodb://localhost:27017')
+
+import google_crc32c
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from flask import Flask, jsonify, request
+from google.cloud import storage
+from google.oauth2 import service_account
+from werkzeug.serving import make_server
+
+from src.server.utils.uploads import UploadError, blob_name, signed_upload, stream_upload
+
+BUCKET = 'bench-bucket'
+RESUMABLE_CHUNK_MULTIPLE = 256 * 1024
+
+class FakeGCS(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    objects = {}
+    sessions = {}
+
+    def log_message(self, *args):
+        pass
+
+    def reply(self, status, body=b'', headers=None):
+        if isinstance(body, dict):
+            body = json.dumps(body).encode()
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def body_chunks(self):
+        remaining = int(self.headers.get('Content-Length') or 0)
+        while remaining:
+            chunk = self.rfile.read(min(remaining, 1 << 16))
+            remaining -= len(chunk)
+            yield chunk
+
+    @staticmethod
+    def new_object(name, content_type):
+        return {'name': name, 'content_type': content_type, 'size': 0,
+                'md5': hashlib.md5(), 'crc32c': google_crc32c.Checksum()}
+
+    def add(self, obj, data):
+        obj['size'] += len(data)
+        obj['md5'].update(data)
+        obj['crc32c'].update(data)
+
+    def store(self, obj):
+        self.objects[obj['name']] = obj
+        self.reply(200, {
+            'kind': 'storage#object', 'bucket': BUCKET, 'name': obj['name'], 'size': str(obj['size']),
+            'contentType': obj['content_type'], 'generation': '1',
+            'md5Hash': base64.b64encode(obj['md5'].digest()).decode(),
+            'crc32c': base64.b64encode(obj['crc32c'].digest()).decode(),
+        })
+
+    def do_POST(self):
+        url = urlsplit(self.path)
+        query = parse_qs(url.query)
+        if url.path == '/token':
+            b''.join(self.body_chunks())
+            return self.reply(200, {'access_token': 'bench', 'expires_in': 3600, 'token_type': 'Bearer'})
+
+        upload_type = query.get('uploadType', [''])[0]
+        if upload_type == 'resumable':
+            metadata = json.loads(b''.join(self.body_chunks()) or b'{}')
+            name = query.get('name', [metadata.get('name')])[0]
+            session = uuid.uuid4().hex
+            self.sessions[session] = self.new_object(name, self.headers.get('X-Upload-Content-Type'))
+            location = f"http://{self.headers['Host']}{url.path}?uploadType=resumable&upload_id={session}"
+            return self.reply(200, headers={'Location': location})
+        if upload_type == 'multipart':
+            body = b''.join(self.body_chunks())
+            boundary = self.headers['Content-Type'].split('boundary=')[1].strip('"').encode()
+            metadata_part, media_part = body.split(b'--' + boundary)[1:3]
+            metadata = json.loads(metadata_part.split(b'\r\n\r\n', 1)[1])
+            headers, media = media_part.split(b'\r\n\r\n', 1)
+            obj = self.new_object(metadata['name'], metadata.get('contentType'))
+            self.add(obj, media[:-2])
+            return self.store(obj)
+        self.reply(404)
+
+    def do_PUT(self):
+        url = urlsplit(self.path)
+        query = parse_qs(url.query)
+        if 'upload_id' in query:
+            obj = self.sessions[query['upload_id'][0]]
+            received = 0
+            for chunk in self.body_chunks():
+                self.add(obj, chunk)
+                received += len(chunk)
+            total = self.headers.get('Content-Range', '').rpartition('/')[2]
+            if total.isdigit() and obj['size'] == int(total):
+                return self.store(obj)
+            if received % RESUMABLE_CHUNK_MULTIPLE:
+                # GCS rejects non-final chunks that are not a multiple of 256 KiB
+                obj['size'] = -1
+                return self.reply(400, {'error': f"chunk of {received} bytes is not a multiple of 256 KiB"})
+            return self.reply(308, headers={'Range': f"bytes=0-{obj['size'] - 1}"} if obj['size'] else {})
+        if 'X-Goog-Signature' in query:
+            obj = self.new_object(url.path.split('/', 2)[2], self.headers.get('Content-Type'))
+            for chunk in self.body_chunks():
+                self.add(obj, chunk)
+            return self.store(obj)
+        self.reply(404)
+
+def make_app(bucket):
+    app = Flask(__name__)
+
+    @app.route('/upload_from_memory', methods=['POST'])
+    def upload_from_memory():
+        data = request.get_json()
+        image_data = base64.b64decode(data['source_file_name'].split(",")[1])
+        bucket.blob(data['destination_blob_name']).upload_from_file(BytesIO(image_data))
+        return jsonify({'success': True})
+
+    @app.route('/upload_url', methods=['POST'])
+    def create_upload_url():
+        data = request.get_json()
+        name = blob_name(data.get('destination_blob_name'))
+        return jsonify({'success': True, **signed_upload(bucket.blob(name), data.get('content_type'),
+                                                         size=data.get('size'),
+                                                         resumable=bool(data.get('resumable')))})
+
+    @app.route('/upload/<path:name>', methods=['PUT', 'POST'])
+    def upload_stream(name):
+        try:
+            return jsonify({'success': True, 'size': stream_upload(bucket, name, request)})
+        except UploadError as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
+
+    return app
+
+def serve(server):
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server.server_address[1]
+
+def make_bucket(base):
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    pem = key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                            serialization.NoEncryption()).decode()
+    credentials = service_account.Credentials.from_service_account_info({
+        'type': 'service_account', 'project_id': 'bench', 'private_key_id': 'bench', 'private_key': pem,
+        'client_email': 'bench@bench.iam.gserviceaccount.com', 'client_id': '1', 'token_uri': f"{base}/token",
+    }, scopes=['https://www.googleapis.com/auth/devstorage.read_write'])
+    client = storage.Client(project='bench', credentials=credentials, client_options={'api_endpoint': base})
+    return client.bucket(BUCKET)
+
+def send(url, method, path_or_bytes, headers=None):
+    """Request with the body read from a file; returns (status, parsed body, bytes sent)"""
+    target = urlsplit(url)
+    connection = http.client.HTTPConnection(target.hostname, target.port)
+    headers = dict(headers or {})
+    if isinstance(path_or_bytes, bytes):
+        body, size = path_or_bytes, len(path_or_bytes)
+    else:
+        body, size = open(path_or_bytes, 'rb'), os.path.getsize(path_or_bytes)
+    headers['Content-Length'] = str(size)
+    try:
+        connection.request(method, f"{target.path}?{target.query}" if target.query else target.path,
+                           body=body, headers=headers)
+        response = connection.getresponse()
+        payload = response.read()
+        return response.status, json.loads(payload) if payload else None, size
+    finally:
+        if not isinstance(body, bytes):
+            body.close()
+        connection.close()
+
+def traced(fn):
+    tracemalloc.start()
+    started = time.perf_counter()
+    try:
+        result = fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return result, peak, (time.perf_counter() - started) * 1000
+
+def main():
+    size = int(float(sys.argv[1]) * 1024 * 1024) if len(sys.argv) > 1 else 20 * 1024 * 1024
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    fake = ThreadingHTTPServer(('127.0.0.1', 0), FakeGCS)
+    fake.daemon_threads = True
+    base = f"http://127.0.0.1:{serve(fake)}"
+    app = f"http://127.0.0.1:{serve(make_server('127.0.0.1', 0, make_app(make_bucket(base)), threaded=True))}"
+
+    workdir = tempfile.mkdtemp()
+    source = os.path.join(workdir, 'image.jpg')
+    with open(source, 'wb') as f:
+        f.write(os.urandom(size))
+    with open(source, 'rb') as f:
+        expected = hashlib.md5(f.read()).hexdigest()
+
+    legacy = os.path.join(workdir, 'legacy.json')
+    with open(source, 'rb') as f, open(legacy, 'w') as out:
+        out.write(json.dumps({'destination_blob_name': 'legacy.jpg',
+                              'source_file_name': 'data:image/jpeg;base64,' + base64.b64encode(f.read()).decode()}))
+    boundary = uuid.uuid4().hex
+    multipart = os.path.join(workdir, 'multipart.body')
+    with open(source, 'rb') as f, open(multipart, 'wb') as out:
+        out.write(f"--{boundary}\r\nContent-Disposition: form-data; name=\"note\"\r\n\r\nbench\r\n"
+                  f"--{boundary}\r\nContent-Disposition: form-data; name=\"file\"; filename=\"image.jpg\"\r\n"
+                  f"Content-Type: image/jpeg\r\n\r\n".encode())
+        out.write(f.read())
+        out.write(f"\r\n--{boundary}--\r\n".encode())
+
+    def signed(resumable):
+        def run():
+            request_body = json.dumps({'destination_blob_name': f"{'resumable' if resumable else 'signed'}.jpg",
+                                       'content_type': 'image/jpeg', 'size': size,
+                                       'resumable': resumable}).encode()
+            status, upload, sent = send(f"{app}/upload_url", 'POST', request_body,
+                                        {'Content-Type': 'application/json'})
+            headers = dict(upload['headers'])
+            if resumable:
+                headers['Content-Range'] = f"bytes 0-{size - 1}/{size}"
+            # The browser's PUT goes to GCS, not through the app
+            put_status, _, _ = send(upload['url'], 'PUT', source, headers)
+            return put_status, sent
+        return run
+
+    runs = [
+        ('legacy', 'legacy.jpg', lambda: send(f"{app}/upload_from_memory", 'POST', legacy,
+                                              {'Content-Type': 'application/json'})[::2]),
+        ('raw', 'raw.jpg', lambda: send(f"{app}/upload/raw.jpg", 'PUT', source,
+                                        {'Content-Type': 'image/jpeg'})[::2]),
+        ('multipart', 'multipart.jpg', lambda: send(f"{app}/upload/multipart.jpg", 'POST', multipart,
+                                                    {'Content-Type': f"multipart/form-data; boundary={boundary}"})[::2]),
+        ('signed', 'signed.jpg', signed(False)),
+        ('resumable', 'resumable.jpg', signed(True)),
+    ]
+
+    print(f"file: {size / 1024 / 1024:.1f} MiB")
+    print(f"{'path':10} {'status':>6} {'to app':>12} {'app peak mem':>13} {'time':>8}  stored")
+    for label, name, run in runs:
+        (status, sent), peak, elapsed = traced(run)
+        stored = FakeGCS.objects.get(name)
+        intact = stored is not None and stored['md5'].hexdigest() == expected
+        print(f"{label:10} {status:6} {sent / 1024 / 1024:9.2f}MiB {peak / 1024 / 1024:10.1f}MiB "
+              f"{elapsed:6.0f}ms  {'ok' if intact else 'MISSING OR CORRUPT'}")
+
+    cut = os.path.join(workdir, 'cut.body')
+    with open(multipart, 'rb') as f, open(cut, 'wb') as out:
+        out.write(f.read(size // 2))
+    status, body, _ = send(f"{app}/upload/cut.jpg", 'POST', cut,
+                           {'Content-Type': f"multipart/form-data; boundary={boundary}"})
+    print(f"truncated multipart: {status} {body.get('error')}; object created: {'cut.jpg' in FakeGCS.objects}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+"""Request throughput with 1..N worker processes sharing state through Redis.
+
+A fakeredis TCP server stands in for Redis, so nothing external is needed.
+Each worker is a separate process with its own Flask app, using the real
+RedisBackend for the sample cache and the admin metrics store. The handler
+does a fixed amount of statistics work per request. The benchmark also checks
+that the shared state adds up: every worker's request log ends up in one
+list, and a cache entry written by one worker is read by the others.
+
+Usage: python benchmarks/bench_workers.py [max_workers] [requests_per_worker]
+"""
+import multiprocessing
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+os.environ.setdefault('MONGO_URI', 'mongodb://localhost:27017')
+
+PORT = 6390
+URL = f"redis://127.0.0.1:{PORT}/0"
+
+def serve_fake_redis():
+    from fakeredis import TcpFakeServer
+    server = TcpFakeServer(('127.0.0.1', PORT), server_type='redis')
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def worker(requests, start_at):
+    # Same order as wsgi.py: patch before anything opens sockets or threads
+    import eventlet
+    eventlet.monkey_patch()
+    import numpy as np
+    from flask import Flask, jsonify
+    from src.server.utils.backends import RedisBackend
+    from src.server.utils.cache import CacheManager
+    from src.server.utils.helpers import calculate_statistics_matrix
+    from src.server.routes.admin import MetricsStore
+
+    backend = RedisBackend(URL)
+    cache = CacheManager(backend)
+    metrics = MetricsStore(max_size=1_000_000, backend=backend)
+    values = np.random.default_rng(os.getpid()).lognormal(size=(400, 12))
+    fields = [f"f{i}" for i in range(12)]
+    app = Flask(__name__)
+    loads = []
+
+    @cache.cached_samples(status='benchmark')
+    def load_samples():
+        loads.append(os.getpid())
+        return [{'chip_id': 'shared'}]
+
+    @app.route('/stats')
+    def stats():
+        load_samples()
+        metrics.append('request_logs', {'timestamp': time.time(), 'pid': os.getpid()})
+        return jsonify(calculate_statistics_matrix(values, fields))
+
+    client = app.test_client()
+    client.get('/stats')
+    time.sleep(max(0, start_at - time.time()))
+    start = time.time()
+    for _ in range(requests):
+        assert client.get('/stats').status_code == 200
+    backend.push('bench:results', {'start': start, 'end': time.time(), 'loads': len(loads)}, 1000)
+
+def run(workers, requests):
+    from src.server.utils.backends import RedisBackend
+    backend = RedisBackend(URL)
+    backend.client.flushdb()
+
+    context = multiprocessing.get_context('spawn')
+    # Workers import the app before the common start time, so startup is not measured
+    start_at = time.time() + 5
+    processes = [context.Process(target=worker, args=(requests, start_at)) for _ in range(workers)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+
+    outcomes = backend.range('bench:results')
+    assert len(outcomes) == workers, "a worker failed"
+    elapsed = max(o['end'] for o in outcomes) - min(o['start'] for o in outcomes)
+    cache_loads = sum(o['loads'] for o in outcomes)
+    logged = len(backend.range('metrics:request_logs'))
+    return workers * requests / elapsed, cache_loads, logged
+
+def main():
+    max_workers = int(sys.argv[1]) if len(sys.argv) > 1 else os.cpu_count()
+    requests = int(sys.argv[2]) if len(sys.argv) > 2 else 300
+    serve_fake_redis()
+
+    print(f"cores: {os.cpu_count()}, requests per worker: {requests}")
+    baseline = None
+    for workers in sorted({1, 2, max_workers} | set(range(2, max_workers + 1, 2))):
+        if workers > max_workers:
+            continue
+        throughput, cache_loads, logged = run(workers, requests)
+        baseline = baseline or throughput
+        print(f"workers {workers:2d}: {throughput:8.0f} req/s  ({throughput / baseline:.2f}x)  "
+              f"cache loads: {cache_loads}  requests logged: {logged}/{workers * (requests + 1)}")
+
+if __name__ == '__main__':
+    main()
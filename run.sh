@@ -1,2 +1,2 @@
 #!/bin/bash
-gunicorn --worker-class eventlet -w 1 wsgi:app
\ No newline at end of file
+gunicorn --worker-class eventlet -w ${WEB_CONCURRENCY:-1} wsgi:app
\ No newline at end of file
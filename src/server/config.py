@@ -40,6 +40,10 @@ class Config:
     OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
     ASSISTANT_ID = os.getenv('ASSISTANT_ID')
 
+    # Shared state for multi-worker deployments; unset keeps everything in-process
+    REDIS_URL = os.getenv('REDIS_URL')
+    SOCKETIO_MESSAGE_QUEUE = os.getenv('SOCKETIO_MESSAGE_QUEUE', REDIS_URL)
+
 class ProductionConfig(Config):
     """Production-specific configuration"""
     DEBUG = False
@@ -58,9 +62,6 @@ class ProductionConfig(Config):
     RATELIMIT_STORAGE_URL = os.getenv('REDIS_URL')
     RATELIMIT_STRATEGY = 'fixed-window-elastic-expiry'
     
-    # Socket.IO
-    SOCKETIO_MESSAGE_QUEUE = os.getenv('REDIS_URL')
-    
     # OpenAI optimization
     OPENAI_REQUEST_TIMEOUT = 25
     OPENAI_MAX_RETRIES = 3
\ No newline at end of file
@@ -55,7 +55,9 @@ socketio = SocketIO(
     async_mode='eventlet',  # Changed from 'gevent' to 'eventlet'
     logger=True,
     engineio_logger=True,
-    ping_timeout=60
+    ping_timeout=60,
+    # Fan emits out to every worker's clients when running more than one worker
+    message_queue=Config.SOCKETIO_MESSAGE_QUEUE
 )
 
 # Create application context immediately
@@ -96,10 +98,58 @@ except Exception as e:
     logger.error(f"Failed to initialize services: {str(e)}")
     raise
 
+# Create the indexes the hot queries depend on
+from .utils.indexes import index_registry
+index_registry.ensure({
+    'samples': collection,
+    'analyzed': analyzed_collection,
+    'notification_outbox': db['notification_outbox'],
+    'jobs': db['jobs'],
+    'analysis_cache': db['analysis_cache'],
+    'chat_cache': db['chat_cache'],
+})
+
+# Profile Mongo commands; index lists are fetched in the background
+from .utils.profiler import query_profiler
+query_profiler.start(client, emit=socketio.emit)
+
+# ETags for the polled read endpoints; analyzed samples are written by the
+# analysis pipeline, so that dataset is probed rather than bumped. Its ETags
+# also roll over when the statistics engine's forced rebuild is due. The
+# engine and the analytics snapshot watch that same version, so requests
+# between changes are served without querying the collection
+from .utils.conditional import dataset_versions, compress_response
+from .utils.statistics import statistics_engine
+from .utils.snapshot import snapshot_manager
+dataset_versions.probe('analyzed', analyzed_collection, max_age=statistics_engine.max_age)
+statistics_engine.watch(lambda: dataset_versions.current('analyzed'))
+snapshot_manager.watch(lambda: dataset_versions.current('analyzed'))
+
+# Persist AI analysis results and chat answers so they survive restarts and are shared by workers
+from .utils.cache import analysis_cache, chat_cache
+analysis_cache.bind(db['analysis_cache'])
+chat_cache.bind(db['chat_cache'])
+
+# Email/SMS notifications are queued in Mongo and sent off the request path
+from .utils.notifications import NotificationOutbox
+notification_outbox = NotificationOutbox(db['notification_outbox'], app, mail).start()
+
+# Move samples to "Ready for Pickup" as soon as they are due
+from .tasks.monitor import start_monitoring
+completion_scheduler = start_monitoring(collection, emit=socketio.emit)
+
+# Push sample changes to subscribed dashboards as per-status deltas
+from .tasks.feed import SampleFeed
+sample_feed = SampleFeed(collection, socketio).register_handlers(socketio).start()
+
 # Register routes after successful initialization
-from .routes.api import api
+from .routes.api import api, analysis_job
 app.register_blueprint(api)
 
+# AI analyses run as background jobs; any worker can serve their results from Mongo
+from .tasks.jobs import JobQueue
+job_queue = JobQueue(db['jobs'], emit=socketio.emit).register('ai_analysis', analysis_job).start()
+
 # Add the admin blueprint
 app.register_blueprint(admin_api, url_prefix='/admin')
 
@@ -115,7 +165,7 @@ def add_headers(response):
     response.headers['Access-Control-Allow-Credentials'] = 'true'
     response.headers['Access-Control-Allow-Methods'] = 'GET, POST, PUT, DELETE, OPTIONS'
     response.headers['Access-Control-Allow-Headers'] = 'Content-Type, Authorization'
-    return response
+    return compress_response(response)
 
 # Make sure this is at the end of the file
 if __name__ == '__main__':
@@ -1,11 +1,16 @@
-from flask import Blueprint, jsonify, request, current_app
+from flask import Blueprint, Response, jsonify, request, current_app, g
 from flask_socketio import emit, SocketIO
 from functools import wraps
 import logging
+import time
 from datetime import datetime, timedelta, UTC
-from collections import deque
-import threading
 from firebase_admin import auth
+from ..utils.auth import require_admin, token_cache
+from ..utils.backends import shared_backend
+from ..utils.metrics import RouteMetrics, request_timer_start
+from ..utils.profiler import query_profiler
+from ..utils.indexes import index_registry
+from ..utils.cache import analysis_cache, analysis_flight, chat_cache, chat_flight
 
 # Initialize SocketIO (this should be imported from main.py)
 from ..socket import socketio
@@ -14,33 +19,42 @@ admin_api = Blueprint('admin_api', __name__)
 
 # In-memory storage for logs and metrics
 class MetricsStore:
-    def __init__(self, max_size=1000):
-        self.error_logs = deque(maxlen=max_size)
-        self.request_logs = deque(maxlen=max_size)
-        self.performance_metrics = deque(maxlen=max_size)
-        self.active_connections = 0
-        self.lock = threading.Lock()
+    """Recent logs and counters in the shared backend, so /admin sees every worker"""
 
-metrics_store = MetricsStore()
+    def __init__(self, max_size=1000, backend=None):
+        self.max_size = max_size
+        self.backend = backend or shared_backend
+        self.routes = RouteMetrics(self.backend)
 
-def require_admin(f):
-    @wraps(f)
-    def decorated_function(*args, **kwargs):
-        auth_header = request.headers.get('Authorization', '')
-        if not auth_header.startswith('Bearer '):
-            return jsonify({'error': 'No token provided'}), 401
-        
-        token = auth_header.split('Bearer ')[1]
-        try:
-            decoded_token = auth.verify_id_token(token)
-            if not decoded_token.get('admin', False):
-                return jsonify({'error': 'Unauthorized - Admin access required'}), 403
-            return f(*args, **kwargs)
-        except Exception as e:
-            print(f"Auth error: {str(e)}")
-            return jsonify({'error': 'Invalid token'}), 401
-            
-    return decorated_function
+    def record_request(self, route, status, duration_ms, mongo_ms, bytes_out):
+        self.routes.record(route, status, duration_ms, mongo_ms, bytes_out)
+        self.append('performance_metrics', {
+            'timestamp': datetime.now(UTC).isoformat(),
+            'route': route,
+            'status': status,
+            'duration_ms': round(duration_ms, 3),
+            'mongo_ms': round(mongo_ms, 3),
+            'bytes_out': bytes_out,
+        })
+
+    def append(self, kind, entry):
+        self.backend.push(f"metrics:{kind}", entry, self.max_size)
+
+    def recent(self, kind, since=None):
+        entries = self.backend.range(f"metrics:{kind}")
+        if since is not None:
+            # Timestamps are UTC ISO strings, which sort chronologically
+            entries = [entry for entry in entries if entry['timestamp'] >= since.isoformat()]
+        return entries
+
+    @property
+    def active_connections(self):
+        return int(self.backend.get('metrics:active_connections') or 0)
+
+    def connection_change(self, amount):
+        return self.backend.incr('metrics:active_connections', amount)
+
+metrics_store = MetricsStore()
 
 @admin_api.route('/health', methods=['GET'])
 @require_admin
@@ -56,30 +70,54 @@ def health_check():
 def get_error_logs():
     days = request.args.get('days', 3, type=int)
     cutoff = datetime.now(UTC) - timedelta(days=days)
-    
-    with metrics_store.lock:
-        logs = [log for log in metrics_store.error_logs if log['timestamp'] >= cutoff]
-    
-    return jsonify(logs)
+    return jsonify(metrics_store.recent('error_logs', since=cutoff))
 
 @admin_api.route('/logs/request', methods=['GET'])
 @require_admin
 def get_request_logs():
     days = request.args.get('days', 3, type=int)
     cutoff = datetime.now(UTC) - timedelta(days=days)
-    
-    with metrics_store.lock:
-        logs = [log for log in metrics_store.request_logs if log['timestamp'] >= cutoff]
-    
-    return jsonify(logs)
+    return jsonify(metrics_store.recent('request_logs', since=cutoff))
 
 @admin_api.route('/metrics', methods=['GET'])
 @require_admin
 def get_metrics():
-    with metrics_store.lock:
-        return jsonify({
-            'performance': list(metrics_store.performance_metrics)[-100:],  # Last 100 metrics
-        })
+    return jsonify({
+        'performance': metrics_store.recent('performance_metrics')[-100:],  # Last 100 metrics
+        'routes': metrics_store.routes.summary(),
+        'auth_cache': token_cache.stats(),
+        'analysis_cache': analysis_cache.stats(analysis_flight),
+        'chat_cache': chat_cache.stats(chat_flight),
+        'backend': 'redis' if metrics_store.backend.shared else 'in-process',
+    })
+
+@admin_api.route('/metrics/prometheus', methods=['GET'])
+@require_admin
+def get_prometheus_metrics():
+    return Response(metrics_store.routes.prometheus(), mimetype='text/plain; version=0.0.4')
+
+@admin_api.route('/queries', methods=['GET'])
+@require_admin
+def get_query_profile():
+    limit = request.args.get('limit', 50, type=int)
+    return jsonify(query_profiler.report(limit=limit))
+
+@admin_api.route('/indexes', methods=['GET'])
+@require_admin
+def get_index_report():
+    return jsonify(index_registry.report())
+
+@admin_api.route('/notifications', methods=['GET'])
+@require_admin
+def get_notification_metrics():
+    from ..main import notification_outbox
+    return jsonify(notification_outbox.stats())
+
+@admin_api.route('/jobs', methods=['GET'])
+@require_admin
+def get_job_metrics():
+    from ..main import job_queue
+    return jsonify(job_queue.stats())
 
 # Custom logging handler
 class SocketIOHandler(logging.Handler):
@@ -95,8 +133,7 @@ class SocketIOHandler(logging.Handler):
                     'lineNo': record.lineno,
                 }
                 
-                with metrics_store.lock:
-                    metrics_store.error_logs.append(log_entry)
+                metrics_store.append('error_logs', log_entry)
                 
                 # Emit to all connected admin clients
                 socketio.emit('log_update', log_entry, namespace='/admin')
@@ -115,19 +152,46 @@ def log_request():
             'user_agent': request.user_agent.string,
         }
         
-        with metrics_store.lock:
-            metrics_store.request_logs.append(log_entry)
+        metrics_store.append('request_logs', log_entry)
+        request_timer_start()
+
+def _count_bytes(chunks, sent):
+    try:
+        for chunk in chunks:
+            sent[0] += len(chunk)
+            yield chunk
+    finally:
+        if hasattr(chunks, 'close'):
+            chunks.close()
+
+@admin_api.after_app_request
+def record_request_metrics(response):
+    if 'request_started' not in g:
+        return response
+
+    route = f"{request.method} {request.url_rule.rule if request.url_rule else '<unmatched>'}"
+    # Streamed bodies are counted as they are sent and recorded once the response closes
+    request_g = g._get_current_object()
+    sent = [0] if response.is_streamed else [response.content_length or 0]
+    if response.is_streamed:
+        response.response = _count_bytes(response.response, sent)
+
+    def record():
+        duration_ms = (time.perf_counter() - request_g.request_started) * 1000
+        metrics_store.record_request(route, response.status_code, duration_ms,
+                                     request_g.get('mongo_ms', 0.0), sent[0])
+
+    response.call_on_close(record)
+    return response
 
 # WebSocket events
 @socketio.on('connect', namespace='/admin')
 @require_admin
 def handle_admin_connect():
-    with metrics_store.lock:
-        metrics_store.active_connections += 1
-    emit('connection_update', {'active_connections': metrics_store.active_connections}, broadcast=True)
+    active_connections = metrics_store.connection_change(1)
+    emit('connection_update', {'active_connections': active_connections}, broadcast=True)
 
 @socketio.on('disconnect', namespace='/admin')
 def handle_admin_disconnect():
-    with metrics_store.lock:
-        metrics_store.active_connections -= 1
-    emit('connection_update', {'active_connections': metrics_store.active_connections}, broadcast=True) 
\ No newline at end of file
+    active_connections = metrics_store.connection_change(-1)
+    emit('connection_update', {'active_connections': active_connections}, broadcast=True) 
\ No newline at end of file
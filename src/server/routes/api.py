@@ -1,4 +1,4 @@
-from flask import Blueprint, request, jsonify, Response, make_response, send_file, send_from_directory
+from flask import Blueprint, request, jsonify, Response, make_response, send_file, send_from_directory, stream_with_context
 from werkzeug.utils import secure_filename
 from datetime import datetime, timedelta
 import pytz
@@ -6,20 +6,39 @@ from io import StringIO, BytesIO
 import csv
 import base64
 from firebase_admin import auth
-from bson.decimal128 import Decimal128
-from src.server.utils.helpers import send_email, send_sms, convert_decimal128, backup_database, calculate_statistics
+from src.server.utils.helpers import backup_database, calculate_statistics_matrix
 from src.server.config import Config
 import json
 import time
+import numpy as np
 from functools import wraps
 from functools import lru_cache
 import hashlib
 from concurrent.futures import TimeoutError
 import logging
 from datetime import timezone
-from ..utils.cache import get_cached_analysis, cache_analysis, generate_data_hash
+from ..utils.cache import analysis_cache, analysis_flight, chat_cache, chat_flight
+from ..utils.digest import build_analysis_digest, count_tokens, digest_message
 from ..utils.mongo import get_db_client
+from ..utils.auth import require_auth
+from ..utils.statistics import statistics_engine, summary_cache
+from ..utils.snapshot import snapshot_manager
+from ..utils.comparisons import comparison_store
+from ..utils.pagination import query_samples
+from ..utils.serialization import for_json, json_response
+from ..utils.conditional import conditional, dataset_versions
+from ..utils.streaming import wants_stream, sse_response, stream_completion, stream_cached
+from ..utils.insights import parse_insights, find_section, section_index
+from ..utils.uploads import UploadError, blob_name, signed_upload, stream_upload
+from ..tasks.jobs import JobQueueFull, job_view
+from ..utils.mutations import VersionConflict, mutate, next_version, expected_version, sample_update, stamp
+from ..utils.samples import (SampleValidationError, NOT_ATTEMPTED, DUPLICATE_SAMPLE, build_registration,
+                             build_update, registration_email, status_change_email, bulk_items,
+                             bulk_write_errors)
+from ..utils.export import EXPORT_PROJECTION, BATCH_SIZE, export_rows, stream_csv, stream_xlsx
 import openai
+from pymongo import InsertOne, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
 from ..main import openai_client
 
 
@@ -27,26 +46,20 @@ logger = logging.getLogger(__name__)
 
 api = Blueprint('api', __name__)
 
-def require_auth(f):
-    @wraps(f)
-    def decorated_function(*args, **kwargs):
-        # Skip auth check for OPTIONS requests
-        if request.method == 'OPTIONS':
-            return f(*args, **kwargs)
-            
-        auth_header = request.headers.get('Authorization', '')
-        if not auth_header.startswith('Bearer '):
-            return jsonify({'error': 'No token provided'}), 401
-        
-        token = auth_header.split('Bearer ')[1]
-        try:
-            decoded_token = auth.verify_id_token(token)
-            request.user = decoded_token
-            return f(*args, **kwargs)
-        except Exception as e:
-            return jsonify({'error': 'Invalid token'}), 401
-            
-    return decorated_function
+ANALYSIS_MODEL = "gpt-4o-2024-11-20"
+# Bump when the ai_analysis prompts change so cached results are not reused
+ANALYSIS_PROMPT_VERSION = 2
+# Bump when the ai_chat prompt changes so cached answers are not reused
+CHAT_PROMPT_VERSION = 1
+CHAT_CONTEXT_FIELDS = ('title', 'keyFinding', 'stats', 'analysis')
+ANALYSIS_VOC_FIELDS = [
+    '2-Butanone', 'Pentanal', 'Decanal',
+    '2-hydroxy-acetaldehyde', '2-hydroxy-3-butanone',
+    '4-HHE', '4-HNE'
+]
+
+# Pre-image fields the status change notification needs
+STATUS_CHANGE_PROJECTION = {"_id": 0, "status": 1, "sample_type": 1, "patient_id": 1, "version": 1}
 
 @api.route('/api/auth/signin', methods=['POST'])
 def signin():
@@ -71,6 +84,7 @@ def google_sign_in():
 
 @api.route('/samples', methods=['GET'])
 @require_auth
+@conditional('samples')
 def get_samples():
     client = get_db_client()
     collection = client[Config.DATABASE_NAME][Config.COLLECTION_NAME]
@@ -78,65 +92,47 @@ def get_samples():
     statuses = ["In Process", "Ready for Pickup", 
                 "Picked up. Ready for Analysis", "Complete"]
     
-    pipeline = [
-        {"$match": {"status": {"$in": statuses}}},
-        {"$project": {"_id": 0}},
-        {"$sort": {"timestamp": -1}}
-    ]
-    
-    samples = list(collection.aggregate(pipeline))
-    return [convert_decimal128(sample) for sample in samples]
+    # Full list by default; limit/cursor/fields/format switch to paged or streamed output
+    return query_samples(collection, {"status": {"$in": statuses}})
 
 @api.route('/update_sample', methods=['POST'])
 @require_auth
 def update_sample():
-    from ..main import collection
+    from ..main import collection, completion_scheduler, notification_outbox
     try:
         update_data = request.json
-        chip_id = update_data.get('chip_id')
-        
-        if not chip_id:
-            return jsonify({"success": False, "error": "Chip ID is required"}), 400
-
-        # Get the current sample data
-        current_sample = collection.find_one({"chip_id": chip_id})
-        if not current_sample:
-            return jsonify({"success": False, "error": "Sample not found"}), 404
-
-        # Build update fields
-        update_fields = {}
-        for field in ['status', 'sample_type', 'patient_id', 'timestamp', 'notes']:
-            if field in update_data:
-                update_fields[field] = update_data[field]
-
-        result = collection.update_one(
-            {"chip_id": chip_id},
-            {"$set": update_fields}
-        )
+        chip_id = update_data.get('chip_id') if isinstance(update_data, dict) else None
+        try:
+            chip_id, update_fields = build_update(update_data)
+            version = expected_version(update_data)
+        except ValueError as e:
+            return jsonify({"success": False, "error": str(e)}), 400
 
-        if result.modified_count > 0:
-            # Send notification for status changes
-            if update_data.get('status') and update_data.get('status') != current_sample.get('status'):
-                subject = f"Sample Status Updated: {chip_id}"
-                body = (f"Sample status has been updated:\n\n"
-                       f"Chip ID: {chip_id}\n"
-                       f"Previous Status: {current_sample.get('status', 'N/A')}\n"
-                       f"New Status: {update_data.get('status')}\n"
-                       f"Sample Type: {update_data.get('sample_type', current_sample.get('sample_type', 'N/A'))}\n"
-                       f"Patient ID: {update_data.get('patient_id', current_sample.get('patient_id', 'N/A'))}\n"
-                       f"Update Time: {update_data.get('timestamp', datetime.now(pytz.UTC).strftime('%Y-%m-%d %H:%M:%S UTC'))}")
-                send_email(subject, body)
-            return jsonify({"success": True}), 200
-        
-        return jsonify({
-            "success": False,
-            "error": "Sample not found"
-        }), 404
+        # Write and read the previous values (for the notification) in one atomic call
+        try:
+            current_sample = mutate(collection, {"chip_id": chip_id}, update_fields, version,
+                                    projection=STATUS_CHANGE_PROJECTION)
+        except VersionConflict as e:
+            return jsonify({"success": False, "error": str(e), "version": e.current_version}), 409
+
+        if current_sample is None:
+            return jsonify({
+                "success": False,
+                "error": "Sample not found"
+            }), 404
+
+        if update_fields.get('status', "In Process") != "In Process":
+            completion_scheduler.cancel(chip_id)
+
+        # Send notification for status changes
+        if update_data.get('status') and update_data.get('status') != current_sample.get('status'):
+            notification_outbox.enqueue_email(*status_change_email(chip_id, current_sample, update_data))
+        return jsonify({"success": True, "version": next_version(current_sample)}), 200
 
     except Exception as e:
         error_msg = f"Error updating sample {chip_id}: {str(e)}"
         logger.error(error_msg)
-        send_email("Error in Sample Update", error_msg)
+        notification_outbox.enqueue_email("Error in Sample Update", error_msg)
         return jsonify({
             "success": False,
             "error": str(e)
@@ -154,12 +150,17 @@ def update_patient_info():
         if not chip_id or not patient_info:
             return jsonify({"success": False, "message": "Invalid data."}), 400
         
-        collection.update_one(
-            {"chip_id": chip_id},
-            {"$set": patient_info},
-            upsert=True
-        )
-        return jsonify({"success": True, "message": "Patient information updated successfully."}), 200
+        version = expected_version(data)
+        before = mutate(collection, {"chip_id": chip_id}, patient_info, version, upsert=True)
+        if before is None and version:
+            # Only a new sample (no version, or version 0) is created here
+            return jsonify({"success": False, "message": "No sample found"}), 404
+        return jsonify({"success": True, "message": "Patient information updated successfully.",
+                        "version": next_version(before)}), 200
+    except VersionConflict as e:
+        return jsonify({"success": False, "message": str(e), "version": e.current_version}), 409
+    except ValueError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
     except Exception as e:
         return jsonify({"success": False, "message": str(e)}), 500
 
@@ -180,9 +181,42 @@ def generate_presigned_url():
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@api.route('/upload_url', methods=['POST'])
+@require_auth
+def create_upload_url():
+    """Signed URL for the browser to PUT a file straight to the bucket"""
+    from ..main import bucket
+    try:
+        data = request.get_json() or {}
+        destination_blob_name = blob_name(data.get('destination_blob_name'))
+        upload = signed_upload(bucket.blob(destination_blob_name), data.get('content_type'),
+                               size=data.get('size'), resumable=bool(data.get('resumable')),
+                               origin=request.headers.get('Origin'))
+        return jsonify({"success": True, "destination_blob_name": destination_blob_name, **upload}), 200
+    except UploadError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    except Exception as e:
+        logger.error(f"Error creating upload URL: {str(e)}")
+        return jsonify({"success": False, "error": str(e)}), 500
+
+@api.route('/upload/<path:destination_blob_name>', methods=['PUT', 'POST'])
+@require_auth
+def upload_stream(destination_blob_name):
+    """Fallback for clients that cannot reach the bucket: the body is streamed through to GCS"""
+    from ..main import bucket
+    try:
+        size = stream_upload(bucket, destination_blob_name, request)
+        return jsonify({"success": True, "message": "File uploaded successfully", "size": size}), 200
+    except UploadError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    except Exception as e:
+        logger.error(f"Error streaming upload: {str(e)}")
+        return jsonify({"success": False, "error": str(e)}), 500
+
 @api.route('/upload_from_memory', methods=['POST'])
 @require_auth
 def upload_from_memory():
+    """Legacy base64 data URL upload; new clients use /upload_url or /upload/<name>"""
     from ..main import bucket
     try:
         data = request.get_json()
@@ -204,53 +238,43 @@ def upload_from_memory():
 def download_dataset():
     from ..main import collection
     try:
-        samples = list(collection.find({"status": "Complete"}, {"_id": 0}))
-        
-        output = StringIO()
-        writer = csv.writer(output)
-        
-        # Write headers
-        writer.writerow(['Date', 'Chip ID', 'Patient ID', 'Sample Type', 
-                        'Batch', 'Mfg. Date', 'Final Volume (mL)', 
-                        'Avg. CO2 (%)', 'Error Code'])
-        
-        # Write data
-        for sample in samples:
+        export_format = request.args.get('format', 'csv')
+        if export_format not in ('csv', 'xlsx'):
+            return jsonify({"error": "format must be csv or xlsx"}), 400
+
+        # Rows are written straight from the cursor, one batch at a time
+        samples = collection.find({"status": "Complete"}, EXPORT_PROJECTION).batch_size(BATCH_SIZE)
+        rows = export_rows(samples)
+
+        def generate(chunks):
             try:
-                # Format timestamp
-                timestamp = datetime.fromisoformat(str(sample['timestamp']).replace('Z', '+00:00'))
-                formatted_date = timestamp.strftime('%m/%d/%y')
-                
-                # Format manufacturing date
-                mfg_date = sample.get('mfg_date')
-                if mfg_date:
-                    mfg_date = datetime.fromisoformat(str(mfg_date).replace('Z', '+00:00'))
-                    mfg_date = mfg_date.strftime('%m/%d/%y')
-                
-                writer.writerow([
-                    formatted_date,
-                    sample.get('chip_id', 'N/A'),
-                    sample.get('patient_id', 'N/A'),
-                    sample.get('sample_type', 'N/A'),
-                    sample.get('batch_number', 'N/A'),
-                    mfg_date if mfg_date else 'N/A',
-                    f"{sample.get('final_volume', 'N/A')}",
-                    f"{sample.get('average_co2', 'N/A')}",
-                    sample.get('error', 'N/A')
-                ])
-            except Exception as e:
-                logger.error(f"Error processing sample {sample.get('chip_id')}: {str(e)}")
-                continue
-        
-        output.seek(0)
+                yield from chunks
+            finally:
+                # Also on client disconnect (GeneratorExit), so the server-side cursor is not left open
+                samples.close()
+
+        filename = f'completed_samples_{datetime.now().strftime("%Y%m%d_%H%M%S")}.{export_format}'
+        headers = {
+            'Content-Disposition': f'attachment; filename={filename}',
+            'Access-Control-Allow-Origin': 'https://onebreatpilot.netlify.app',
+            'Access-Control-Allow-Credentials': 'true'
+        }
+
+        if export_format == 'xlsx':
+            return Response(
+                stream_with_context(generate(stream_xlsx(rows))),
+                mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+                headers=headers
+            )
+
+        compress = 'gzip' in request.headers.get('Accept-Encoding', '')
+        if compress:
+            headers['Content-Encoding'] = 'gzip'
+            headers['Vary'] = 'Accept-Encoding'
         return Response(
-            output.getvalue(),
+            stream_with_context(generate(stream_csv(rows, compress=compress))),
             mimetype='text/csv',
-            headers={
-                'Content-Disposition': f'attachment; filename=completed_samples_{datetime.now().strftime("%Y%m%d_%H%M%S")}.csv',
-                'Access-Control-Allow-Origin': 'https://onebreatpilot.netlify.app',
-                'Access-Control-Allow-Credentials': 'true'
-            }
+            headers=headers
         )
     except Exception as e:
         logger.error(f"Error generating CSV: {str(e)}")
@@ -258,14 +282,12 @@ def download_dataset():
 
 @api.route('/completed_samples', methods=['GET'])
 @require_auth
+@conditional('samples')
 def get_completed_samples():
     from ..main import collection
     try:
         print("Fetching completed samples...")
-        all_samples = collection.find({"status": "Complete"}, {"_id": 0})
-        completed_samples = [convert_decimal128(sample) for sample in all_samples]
-        print(f"Found {len(completed_samples)} completed samples")
-        return jsonify(completed_samples), 200
+        return query_samples(collection, {"status": "Complete"}, sort=False)
     except Exception as e:
         print(f"Error fetching completed samples: {str(e)}")
         return jsonify({"error": str(e)}), 500
@@ -280,130 +302,54 @@ def upload_document_metadata():
         if not chip_id or not document_urls:
             return jsonify({"success": False, "message": "Missing chipID or document URLs"}), 400
         
-        sample = collection.find_one({"chip_id": chip_id})
-        if not sample:
+        before = mutate(collection, {"chip_id": chip_id}, {"document_urls": document_urls})
+        if before is None:
             return jsonify({"success": False, "message": "No sample found"}), 404
-
-        update_result = collection.update_one(
-            {"chip_id": chip_id},
-            {"$set": {"document_urls": document_urls}}
-        )
-
-        if update_result.modified_count >= 0:
-            return jsonify({"success": True, "message": "Document URLs added successfully"}), 200
-        return jsonify({"success": False, "message": "Failed to add document URLs"}), 500
+        return jsonify({"success": True, "message": "Document URLs added successfully",
+                        "version": next_version(before)}), 200
 
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 @api.route('/analyzed', methods=['GET'])
 @require_auth
+@conditional('analyzed')
 def get_analyzed_samples():
     try:
         from ..main import analyzed_collection
-        analyzed_samples = list(analyzed_collection.find({}, {'_id': 0}).sort("timestamp", 1))
-        analyzed_samples = [convert_decimal128(sample) for sample in analyzed_samples]
-        return jsonify(analyzed_samples), 200
+        analyzed_samples = list(for_json(analyzed_collection).find({}, {'_id': 0}).sort("timestamp", 1))
+        return json_response(analyzed_samples)
     except Exception as e:
         print(f"Error fetching analyzed samples: {str(e)}")
-        return jsonify([]), 200
-
-# Cache for storing analysis results
-@lru_cache(maxsize=128)
-def get_cached_analysis(data_hash):
-    return None
-
-def generate_data_hash(data):
-    """Generate a hash of the analyzed samples data for cache comparison"""
-    return hashlib.md5(json.dumps(data, sort_keys=True).encode()).hexdigest()
+        # Never let an ETag pin the empty fallback
+        response = jsonify([])
+        response.headers['Cache-Control'] = 'no-store'
+        return response, 200
 
 @api.route('/statistics_summary', methods=['GET', 'OPTIONS'])
 @require_auth
+@conditional('analyzed')
 def statistics_summary():
     if request.method == 'OPTIONS':
         return '', 200
 
     try:
         from ..main import analyzed_collection
-        
-        # Fields to analyze
-        voc_fields = [
-            '2-Butanone', 'Pentanal', '2-hydroxy-acetaldehyde',
-            '2-hydroxy-3-butanone', '4-HHE', '4-HNE', 'Decanal'
-        ]
-        voc_per_liter_fields = [f"{voc}_per_liter" for voc in voc_fields]
-        additional_fields = ['average_co2', 'final_volume']
-        
-        # Fetch and convert samples
-        analyzed_samples = list(analyzed_collection.find({}, {'_id': 0}))
-        if not analyzed_samples:
+
+        # The engine only reads documents added since the last call; the
+        # rendered summary is reused until the collection changes.
+        summary, cached = summary_cache.get(analyzed_collection)
+        if statistics_engine.count == 0:
             return jsonify({
                 "success": False,
                 "error": "No analyzed samples available"
             }), 404
-            
-        # Convert samples and ensure all numeric fields are floats
-        processed_samples = []
-        for sample in analyzed_samples:
-            converted = convert_sample(sample)
-            processed_samples.append(converted)
 
-        data_hash = generate_data_hash(str(processed_samples))  # Convert to string before hashing
-        
-        # Check cache
-        cached_analysis = get_cached_analysis(data_hash)
-        if cached_analysis:
-            return jsonify({
-                "success": True,
-                "insights": cached_analysis,
-                "cached": True,
-                "sampleCount": len(analyzed_samples)
-            }), 200
-
-        # Calculate statistics
-        all_fields = voc_fields + voc_per_liter_fields + additional_fields
-        stats = calculate_statistics(processed_samples, all_fields)
-        
-        # Generate summary
-        summary = "Statistical Analysis Summary:\n\n"
-        
-        # Add VOC statistics
-        summary += "VOC Measurements (nanomoles):\n"
-        for voc in voc_fields:
-            if stats[voc]:
-                summary += f"\n{voc}:\n"
-                summary += f"Mean: {stats[voc]['mean']:.2f}\n"
-                summary += f"Median: {stats[voc]['median']:.2f}\n"
-                summary += f"Range: {stats[voc]['range']['min']:.2f} - {stats[voc]['range']['max']:.2f}\n"
-                summary += f"Sample Count: {stats[voc]['sample_count']}\n"
-        
-        # Add VOC per liter statistics
-        summary += "\nVOC Measurements (nanomoles/liter of breath):\n"
-        for voc in voc_per_liter_fields:
-            if stats[voc]:
-                summary += f"\n{voc.replace('_per_liter', '')}:\n"
-                summary += f"Mean: {stats[voc]['mean']:.2f}\n"
-                summary += f"Median: {stats[voc]['median']:.2f}\n"
-                summary += f"Range: {stats[voc]['range']['min']:.2f} - {stats[voc]['range']['max']:.2f}\n"
-                summary += f"Sample Count: {stats[voc]['sample_count']}\n"
-        
-        # Add additional measurements
-        summary += "\nAdditional Measurements:\n"
-        for field in additional_fields:
-            if stats[field]:
-                summary += f"\n{field}:\n"
-                summary += f"Mean: {stats[field]['mean']:.2f}\n"
-                summary += f"Median: {stats[field]['median']:.2f}\n"
-                summary += f"Range: {stats[field]['range']['min']:.2f} - {stats[field]['range']['max']:.2f}\n"
-                summary += f"Sample Count: {stats[field]['sample_count']}\n"
-        
-        # Cache and return results
-        cache_analysis(data_hash, summary)
         return jsonify({
             "success": True,
             "insights": summary,
-            "cached": False,
-            "sampleCount": len(analyzed_samples)
+            "cached": cached,
+            "sampleCount": statistics_engine.count
         }), 200
 
     except Exception as e:
@@ -413,22 +359,10 @@ def statistics_summary():
             "error": str(e)
         }), 500
 
-def convert_sample(sample):
-    """Convert MongoDB types to JSON-serializable formats"""
-    converted = {}
-    for key, value in sample.items():
-        if isinstance(value, Decimal128):
-            converted[key] = float(value.to_decimal())
-        elif isinstance(value, datetime):
-            converted[key] = value.isoformat()
-        else:
-            converted[key] = value
-    return converted
-
 @api.route('/samples/<chip_id>/pickup', methods=['PUT'])
 @require_auth
 def update_sample_pickup(chip_id):
-    from ..main import collection
+    from ..main import collection, notification_outbox
     try:
         data = request.json
         required_fields = ['status', 'sample_type', 'average_co2', 'final_volume']
@@ -449,20 +383,22 @@ def update_sample_pickup(chip_id):
         if 'error' in data:
             update_data['error'] = data['error']
 
-        update_result = collection.update_one(
-            {"chip_id": chip_id},
-            {"$set": update_data}
-        )
+        try:
+            before = mutate(collection, {"chip_id": chip_id}, update_data, expected_version(data))
+        except ValueError as e:
+            return jsonify({"success": False, "error": str(e)}), 400
+        except VersionConflict as e:
+            return jsonify({"success": False, "error": str(e), "version": e.current_version}), 409
 
-        if update_result.modified_count == 1:
+        if before is not None:
             if data['status'] == "Picked up. Ready for Analysis":
                 subject = f"Sample Picked Up: {chip_id}"
                 body = (f"Sample with chip ID {chip_id} has been picked up.\n"
                        f"Sample Type: {data['sample_type']}\n"
                        f"Final Volume: {data['final_volume']} mL\n"
                        f"Average CO2: {data['average_co2']}%")
-                send_email(subject, body)
-            return jsonify({"success": True}), 200
+                notification_outbox.enqueue_email(subject, body)
+            return jsonify({"success": True, "version": next_version(before)}), 200
             
         return jsonify({
             "success": False,
@@ -479,63 +415,25 @@ def update_sample_pickup(chip_id):
 @api.route('/register_sample', methods=['POST'])
 @require_auth
 def register_sample():
-    from ..main import collection
+    from ..main import collection, completion_scheduler, notification_outbox
     try:
-        data = request.json
-        required_fields = ['chip_id', 'patient_id', 'sample_type', 'status']
-        
-        if not all(field in data for field in required_fields):
-            return jsonify({
-                "success": False,
-                "error": f"Missing required fields. Required: {', '.join(required_fields)}"
-            }), 400
-
-        # Parse timestamp just for expected_completion_time calculation
         try:
-            timestamp_dt = datetime.strptime(data['timestamp'], '%Y-%m-%dT%H:%M:%S.%fZ')
-            timestamp_dt = timestamp_dt.replace(tzinfo=timezone.utc)
-            expected_completion_time = (timestamp_dt + timedelta(hours=2)).isoformat()
-        except ValueError as e:
-            return jsonify({
-                "success": False,
-                "error": f"Invalid timestamp format. Use ISO format. Error: {str(e)}"
-            }), 400
+            new_sample, timestamp_dt = build_registration(request.json)
+        except SampleValidationError as e:
+            return jsonify({"success": False, "error": str(e)}), 400
 
-        # Create new sample document with all required fields
-        new_sample = {
-            "chip_id": data['chip_id'],
-            "patient_id": data['patient_id'],
-            "sample_type": data['sample_type'],
-            "status": data['status'],
-            "timestamp": data['timestamp'],
-            "expected_completion_time": expected_completion_time,
-            "batch_number": data.get('batch_number'),
-            "mfg_date": data.get('mfg_date'),
-            "notes": data.get('notes')
-        }
-
-        # Remove None values to keep the document clean
-        new_sample = {k: v for k, v in new_sample.items() if v is not None}
-
-        result = collection.insert_one(new_sample)
+        try:
+            result = collection.insert_one(stamp(new_sample))
+        except DuplicateKeyError:
+            # chip_id is unique; re-registering a chip is a client error, not a server one
+            return jsonify({"success": False, "error": DUPLICATE_SAMPLE, "chip_id": new_sample['chip_id']}), 409
+        dataset_versions.bump('samples')
         
         if result.inserted_id:
-            # Update email notification to include notes if present
-            subject = f"New Sample Registered: {data['chip_id']}"
-            body = (f"A new sample has been registered:\n\n"
-                   f"Chip ID: {data['chip_id']}\n"
-                   f"Patient ID: {data['patient_id']}\n"
-                   f"Sample Type: {data['sample_type']}\n"
-                   f"Status: {data['status']}\n"
-                   f"Registration Time: {timestamp_dt.strftime('%Y-%m-%d %H:%M:%S UTC')}\n"
-                   f"Expected Completion: {expected_completion_time}")
-            
-            if data.get('notes'):
-                body += f"\n\nNotes: {data['notes']}"
-                
-            body += "\n\nThe sample will be ready for pickup in 2 hours."
-            
-            send_email(subject, body)
+            if new_sample['status'] == "In Process":
+                completion_scheduler.schedule(new_sample['chip_id'], new_sample['expected_completion_time'])
+
+            notification_outbox.enqueue_email(*registration_email(new_sample, timestamp_dt))
             return jsonify({"success": True}), 201
             
         return jsonify({
@@ -546,13 +444,180 @@ def register_sample():
     except Exception as e:
         error_msg = f"Error registering sample: {str(e)}"
         logger.error(error_msg)
-        send_email("Error in Sample Registration", 
+        notification_outbox.enqueue_email("Error in Sample Registration", 
                   f"Failed to register sample with error:\n{error_msg}")
         return jsonify({
             "success": False,
             "error": str(e)
         }), 500
 
+def bulk_response(results):
+    """201 when every item succeeded, 207 when some did, 400 when none did"""
+    succeeded = sum(1 for result in results if result['success'])
+    status = 201 if succeeded == len(results) else 207 if succeeded else 400
+    return jsonify({
+        "success": succeeded == len(results),
+        "succeeded": succeeded,
+        "failed": len(results) - succeeded,
+        "results": results
+    }), status
+
+@api.route('/register_samples', methods=['POST'])
+@require_auth
+def register_samples():
+    """Register a tray of samples with one bulk_write and one summary email"""
+    from ..main import collection, completion_scheduler, notification_outbox
+    try:
+        try:
+            items, ordered = bulk_items(request.json, 'samples')
+        except SampleValidationError as e:
+            return jsonify({"success": False, "error": str(e)}), 400
+
+        results = []
+        inserts = []  # (result index, document, registered_at)
+        for index, data in enumerate(items):
+            chip_id = data.get('chip_id') if isinstance(data, dict) else None
+            results.append({"index": index, "chip_id": chip_id, "success": False})
+            try:
+                document, registered_at = build_registration(data)
+            except SampleValidationError as e:
+                results[index]["error"] = str(e)
+                continue
+            inserts.append((index, stamp(document), registered_at))
+
+        if ordered and any("error" in result for result in results):
+            # Ordered batches stop at the first failure, validation included
+            first_error = next(result["index"] for result in results if "error" in result)
+            inserts = [insert for insert in inserts if insert[0] < first_error]
+
+        errors = {}
+        if inserts:
+            try:
+                collection.bulk_write([InsertOne(document) for _, document, _ in inserts], ordered=ordered)
+            except BulkWriteError as e:
+                errors = bulk_write_errors(e)
+            dataset_versions.bump('samples')
+
+        stopped_at = min(errors) if ordered and errors else None
+        registered = []
+        for position, (index, document, registered_at) in enumerate(inserts):
+            if position in errors:
+                results[index]["error"] = errors[position]
+            elif stopped_at is None or position < stopped_at:
+                results[index]["success"] = True
+                registered.append((document, registered_at))
+                if document['status'] == "In Process":
+                    completion_scheduler.schedule(document['chip_id'], document['expected_completion_time'])
+        for result in results:
+            if not result["success"]:
+                result.setdefault("error", NOT_ATTEMPTED)
+
+        if registered:
+            if len(registered) == 1:
+                notification_outbox.enqueue_email(*registration_email(*registered[0]))
+            else:
+                subject = f"{len(registered)} New Samples Registered"
+                body = "\n\n".join(registration_email(*item)[1] for item in registered)
+                notification_outbox.enqueue_email(subject, body)
+
+        return bulk_response(results)
+
+    except Exception as e:
+        error_msg = f"Error registering samples: {str(e)}"
+        logger.error(error_msg)
+        notification_outbox.enqueue_email("Error in Sample Registration",
+                  f"Failed to register samples with error:\n{error_msg}")
+        return jsonify({
+            "success": False,
+            "error": str(e)
+        }), 500
+
+@api.route('/update_samples', methods=['POST'])
+@require_auth
+def update_samples():
+    """Apply a batch of sample edits with one bulk_write and one summary email"""
+    from ..main import collection, completion_scheduler, notification_outbox
+    try:
+        try:
+            items, ordered = bulk_items(request.json, 'updates')
+        except SampleValidationError as e:
+            return jsonify({"success": False, "error": str(e)}), 400
+
+        results = []
+        updates = []  # (result index, chip_id, fields, request data)
+        for index, data in enumerate(items):
+            chip_id = data.get('chip_id') if isinstance(data, dict) else None
+            results.append({"index": index, "chip_id": chip_id, "success": False})
+            try:
+                chip_id, update_fields = build_update(data)
+            except SampleValidationError as e:
+                results[index]["error"] = str(e)
+                continue
+            updates.append((index, chip_id, update_fields, data))
+
+        if ordered and any("error" in result for result in results):
+            first_error = next(result["index"] for result in results if "error" in result)
+            updates = [update for update in updates if update[0] < first_error]
+
+        # One read for every previous status, used for the notification and the scheduler
+        previous = {}
+        if updates:
+            for sample in collection.find(
+                {"chip_id": {"$in": list({chip_id for _, chip_id, _, _ in updates})}},
+                {"_id": 0, "chip_id": 1, "status": 1, "sample_type": 1, "patient_id": 1}
+            ):
+                previous[sample['chip_id']] = sample
+
+        operations = []
+        for update in updates:
+            index, chip_id, update_fields, _ = update
+            if chip_id not in previous:
+                results[index]["error"] = "Sample not found"
+                if ordered:
+                    break
+                continue
+            operations.append((update, UpdateOne({"chip_id": chip_id}, sample_update(update_fields))))
+
+        errors = {}
+        if operations:
+            try:
+                collection.bulk_write([operation for _, operation in operations], ordered=ordered)
+            except BulkWriteError as e:
+                errors = bulk_write_errors(e)
+            dataset_versions.bump('samples')
+
+        stopped_at = min(errors) if ordered and errors else None
+        changes = []
+        for position, ((index, chip_id, update_fields, data), _) in enumerate(operations):
+            if position in errors:
+                results[index]["error"] = errors[position]
+            elif stopped_at is None or position < stopped_at:
+                results[index]["success"] = True
+                if update_fields.get('status', "In Process") != "In Process":
+                    completion_scheduler.cancel(chip_id)
+                if data.get('status') and data['status'] != previous[chip_id].get('status'):
+                    changes.append(status_change_email(chip_id, previous[chip_id], data))
+        for result in results:
+            if not result["success"]:
+                result.setdefault("error", NOT_ATTEMPTED)
+
+        if len(changes) == 1:
+            notification_outbox.enqueue_email(*changes[0])
+        elif changes:
+            notification_outbox.enqueue_email(f"{len(changes)} Sample Statuses Updated",
+                                              "\n\n".join(body for _, body in changes))
+
+        return bulk_response(results)
+
+    except Exception as e:
+        error_msg = f"Error updating samples: {str(e)}"
+        logger.error(error_msg)
+        notification_outbox.enqueue_email("Error in Sample Update", error_msg)
+        return jsonify({
+            "success": False,
+            "error": str(e)
+        }), 500
+
 @api.after_request
 def add_headers(response):
     origin = request.headers.get('Origin')
@@ -571,23 +636,16 @@ def catch_all(path):
 @api.route('/update_expired_samples', methods=['POST'])
 @require_auth
 def update_expired_samples():
-    from ..main import collection
+    from ..main import completion_scheduler
     try:
-        # Calculate the timestamp for 2 hours ago
-        two_hours_ago = datetime.now(pytz.UTC) - timedelta(hours=2)
-        
-        # Update all expired "In Process" samples
-        result = collection.update_many(
-            {
-                "status": "In Process",
-                "timestamp": {"$lt": two_hours_ago}
-            },
-            {"$set": {"status": "Ready for Pickup"}}
-        )
+        # Reload due times from Mongo and apply anything already overdue,
+        # using the same expected_completion_time rule as the scheduler
+        completion_scheduler.recover()
+        updated_count = completion_scheduler.run_due()
         
         return jsonify({
             "success": True,
-            "updated_count": result.modified_count
+            "updated_count": updated_count
         }), 200
     except Exception as e:
         logger.error(f"Error updating expired samples: {str(e)}")
@@ -596,6 +654,21 @@ def update_expired_samples():
             "error": str(e)
         }), 500
 
+def normalize_question(question):
+    """Case and whitespace differences should not miss the chat cache"""
+    return ' '.join(str(question).split()).casefold()
+
+def chat_fingerprint(guidance, context, question, params):
+    """Canonical hash of everything that shapes an /ai/chat answer"""
+    payload = {
+        'guidance': guidance,
+        'context': {field: context.get(field) for field in CHAT_CONTEXT_FIELDS},
+        'question': normalize_question(question),
+        'params': {key: value for key, value in params.items() if key != 'messages'},
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, separators=(',', ':'),
+                                     default=str).encode()).hexdigest()
+
 @api.route('/ai/chat', methods=['POST'])
 @require_auth
 def ai_chat():
@@ -699,7 +772,7 @@ FORMAT YOUR RESPONSE WITH:
 """
 
         # Get response from OpenAI with enhanced parameters
-        response = openai_client.chat.completions.create(
+        params = dict(
             model="gpt-4-1106-preview",
             messages=[
                 {
@@ -728,11 +801,37 @@ Provide responses that are:
             frequency_penalty=0.1   # Slight penalty to encourage diverse language
         )
 
-        # Extract and return the response
-        message = response.choices[0].message.content
+        cache_key = chat_cache.key(chat_fingerprint(specific_guidance, context, question, params),
+                                   CHAT_PROMPT_VERSION, params['model'])
+        cached_message = chat_cache.get(cache_key)
+        if cached_message and wants_stream():
+            return sse_response(stream_cached('message', cached_message))
+        if cached_message:
+            return jsonify({
+                'success': True,
+                'message': cached_message,
+                'cached': True
+            })
+
+        if wants_stream():
+            return sse_response(stream_completion(
+                lambda: openai_client.chat.completions.create(stream=True, **params),
+                'message',
+                on_complete=lambda text: chat_cache.set(cache_key, text),
+                label='ai_chat'))
+
+        def generate_message():
+            response = openai_client.chat.completions.create(**params)
+            message = response.choices[0].message.content
+            chat_cache.set(cache_key, message)
+            return message
+
+        # Identical questions asked at the same time share one upstream call
+        message, shared = chat_flight.do(cache_key, generate_message)
         return jsonify({
             'success': True,
-            'message': message
+            'message': message,
+            'cached': shared
         })
 
     except Exception as e:
@@ -747,7 +846,6 @@ Provide responses that are:
 def get_stat_details():
     try:
         from ..main import analyzed_collection
-        from ..utils.helpers import calculate_statistics, convert_sample
         
         data = request.json
         section = data.get('section')
@@ -759,35 +857,36 @@ def get_stat_details():
                 'error': 'Section and stat are required'
             }), 400
 
-        # Get raw data for calculations
-        analyzed_samples = list(analyzed_collection.find({}, {'_id': 0}))
-        processed_samples = [convert_sample(sample) for sample in analyzed_samples]
+        snapshot = snapshot_manager.get(analyzed_collection)
+        total = snapshot.size
+        positive_mask = snapshot.positive
+        lung_rads = snapshot.lung_rads
 
         # Process samples based on section type
         if section == "Sample Classification":
-            # Get positive and negative samples
-            positive_samples = [s for s in processed_samples 
-                             if s.get('sample_type') == 'LC Positive' 
-                             or (s.get('lung_RADS', 0) >= 3)]
-            negative_samples = [s for s in processed_samples 
-                              if s.get('sample_type') == 'LC Negative' 
-                              or (s.get('lung_RADS', 0) < 3)]
+            positive_count = int(positive_mask.sum())
 
             if "Lung cancer positive" in stat:
+                histology_counts = snapshot.category_counts(
+                    snapshot.histology, snapshot.histology_categories, positive_mask)
+                stage_counts = snapshot.category_counts(
+                    snapshot.stage, snapshot.stage_categories, positive_mask)
+                complete = positive_mask & snapshot.has_sample_type & snapshot.has_lung_rads
+
                 details = {
                     "description": "Detailed analysis of lung cancer positive samples",
                     "breakdown": [
-                        {"label": "Total Positive Samples", "value": len(positive_samples)},
-                        {"label": "By lung-RADS ≥ 3", "value": len([s for s in positive_samples if s.get('lung_RADS', 0) >= 3])},
-                        {"label": "By LC Positive Label", "value": len([s for s in positive_samples if s.get('sample_type') == 'LC Positive'])},
-                        {"label": "With Histology Data", "value": len([s for s in positive_samples if s.get('cancer_histology')])},
-                        {"label": "With Staging Data", "value": len([s for s in positive_samples if s.get('cancer_stage')])},
+                        {"label": "Total Positive Samples", "value": positive_count},
+                        {"label": "By lung-RADS ≥ 3", "value": int((positive_mask & (lung_rads >= 3)).sum())},
+                        {"label": "By LC Positive Label", "value": int((positive_mask & snapshot.labelled_positive).sum())},
+                        {"label": "With Histology Data", "value": int((positive_mask & (snapshot.histology >= 0)).sum())},
+                        {"label": "With Staging Data", "value": int((positive_mask & (snapshot.stage >= 0)).sum())},
                     ],
                     "trends": [
-                        {"label": "Positive Rate", "value": f"{(len(positive_samples) / len(processed_samples)) * 100:.1f}%"},
-                        {"label": "Average lung-RADS", "value": f"{sum(s.get('lung_RADS', 0) for s in positive_samples) / len(positive_samples):.1f}"},
+                        {"label": "Positive Rate", "value": f"{(positive_count / total) * 100:.1f}%"},
+                        {"label": "Average lung-RADS", "value": f"{lung_rads[positive_mask].sum() / positive_count:.1f}"},
                         {"label": "Detection Method Split", "value": "lung-RADS/Direct Label"},
-                        {"label": "Data Completeness", "value": f"{len([s for s in positive_samples if all(k in s for k in ['sample_type', 'lung_RADS'])])}/{len(positive_samples)}"}
+                        {"label": "Data Completeness", "value": f"{int(complete.sum())}/{positive_count}"}
                     ],
                     "implications": [
                         "Sample distribution indicates representative dataset for lung cancer detection",
@@ -797,23 +896,19 @@ def get_stat_details():
                     ],
                     "relatedMetrics": [
                         {"label": "Histology Distribution", 
-                         "value": ", ".join(f"{h}: {len([s for s in positive_samples if s.get('cancer_histology') == h])}" 
-                                          for h in set(s.get('cancer_histology') for s in positive_samples if s.get('cancer_histology')))},
+                         "value": ", ".join(f"{h}: {n}" for h, n in histology_counts.items())},
                         {"label": "Stage Distribution", 
-                         "value": ", ".join(f"{st}: {len([s for s in positive_samples if s.get('cancer_stage') == st])}" 
-                                          for st in set(s.get('cancer_stage') for s in positive_samples if s.get('cancer_stage')))},
+                         "value": ", ".join(f"{st}: {n}" for st, n in stage_counts.items())},
                         {"label": "lung-RADS Distribution", 
-                         "value": f"3: {len([s for s in positive_samples if s.get('lung_RADS') == 3])}, " +
-                                 f"4: {len([s for s in positive_samples if s.get('lung_RADS') == 4])}"}
+                         "value": f"3: {int((positive_mask & (lung_rads == 3)).sum())}, " +
+                                 f"4: {int((positive_mask & (lung_rads == 4)).sum())}"}
                     ],
                     "visualizationType": "pie"
                 }
             elif "Total samples analyzed" in stat:
-                total = len(processed_samples)
-                positive = len([s for s in processed_samples 
-                              if s.get('sample_type') == 'LC Positive' 
-                              or (s.get('lung_RADS', 0) >= 3)])
+                positive = positive_count
                 negative = total - positive
+                complete = snapshot.has_sample_type & snapshot.has_lung_rads
 
                 details = {
                     "description": "Comprehensive breakdown of sample distribution and classification metrics",
@@ -825,11 +920,11 @@ def get_stat_details():
                     ],
                     "trends": [
                         {"label": "Sample Collection Period", 
-                         "value": f"{min(s.get('timestamp', 'N/A') for s in processed_samples)} to {max(s.get('timestamp', 'N/A') for s in processed_samples)}"},
+                         "value": f"{snapshot.period[0]} to {snapshot.period[1]}"},
                         {"label": "Classification Method", 
                          "value": "lung-RADS ≥ 3 or LC Positive"},
                         {"label": "Data Completeness", 
-                         "value": f"{len([s for s in processed_samples if all(k in s for k in ['sample_type', 'lung_RADS'])])}/{total}"}
+                         "value": f"{int(complete.sum())}/{total}"}
                     ],
                     "implications": [
                         f"Sample size of {total} provides {'adequate' if total >= 20 else 'limited'} statistical power",
@@ -839,13 +934,10 @@ def get_stat_details():
                     ],
                     "relatedMetrics": [
                         {"label": "lung-RADS Distribution", 
-                         "value": f"1: {len([s for s in processed_samples if s.get('lung_RADS') == 1])}, " +
-                                 f"2: {len([s for s in processed_samples if s.get('lung_RADS') == 2])}, " +
-                                 f"3: {len([s for s in processed_samples if s.get('lung_RADS') == 3])}, " +
-                                 f"4: {len([s for s in processed_samples if s.get('lung_RADS') == 4])}"},
+                         "value": ", ".join(f"{score}: {int((lung_rads == score).sum())}" for score in (1, 2, 3, 4))},
                         {"label": "Direct Labels", 
-                         "value": f"Pos: {len([s for s in processed_samples if s.get('sample_type') == 'LC Positive'])}, " +
-                                 f"Neg: {len([s for s in processed_samples if s.get('sample_type') == 'LC Negative'])}"}
+                         "value": f"Pos: {int(snapshot.labelled_positive.sum())}, " +
+                                 f"Neg: {int(snapshot.labelled_negative.sum())}"}
                     ],
                     "visualizationType": "pie"
                 }
@@ -853,9 +945,9 @@ def get_stat_details():
                 details = {
                     "description": f"Analysis of {stat}",
                     "breakdown": [
-                        {"label": "Sample Size", "value": len(processed_samples)},
+                        {"label": "Sample Size", "value": total},
                         {"label": "Data Completeness", 
-                         "value": f"{len([s for s in processed_samples if stat.lower() in {k.lower() for k in s.keys()}])}"}
+                         "value": f"{snapshot.key_counts.get(stat.lower(), 0)}"}
                     ],
                     "implications": [
                         "Consider this metric in context of overall analysis",
@@ -864,42 +956,30 @@ def get_stat_details():
                 }
 
         elif section == "VOC Profile Analysis":
-            # Get positive and negative samples
-            positive_samples = [s for s in processed_samples 
-                             if s.get('sample_type') == 'LC Positive' 
-                             or (s.get('lung_RADS', 0) >= 3)]
-            negative_samples = [s for s in processed_samples 
-                              if s.get('sample_type') == 'LC Negative' 
-                              or (s.get('lung_RADS', 0) < 3)]
-
             # Extract VOC name from stat label
             voc_name = stat.split(" ")[0]  # Assumes format "VOC_NAME average concentration" or similar
             
-            # Calculate detailed statistics
-            pos_values = [float(s.get(voc_name, 0)) for s in positive_samples if voc_name in s]
-            neg_values = [float(s.get(voc_name, 0)) for s in negative_samples if voc_name in s]
-            
-            from scipy import stats
-            import numpy as np
-
-            # Statistical calculations
-            t_stat, p_value = stats.ttest_ind(pos_values, neg_values)
-            effect_size = (np.mean(pos_values) - np.mean(neg_values)) / np.std(pos_values + neg_values)
+            # Precomputed for every VOC field per dataset version
+            comparison = comparison_store.lookup(snapshot, voc_name)
+            pos_mean, neg_mean = comparison['mean_a'], comparison['mean_b']
+            pos_std, neg_std = comparison['std_a'], comparison['std_b']
+            t_stat, p_value = comparison['t_stat'], comparison['p_value']
+            effect_size = comparison['cohens_d']
             
             details = {
                 "description": f"Detailed analysis of {voc_name} concentrations between lung cancer positive and negative samples",
                 "breakdown": [
-                    {"label": "Positive Sample Mean", "value": f"{np.mean(pos_values):.3f}"},
-                    {"label": "Negative Sample Mean", "value": f"{np.mean(neg_values):.3f}"},
-                    {"label": "Positive Sample Std", "value": f"{np.std(pos_values):.3f}"},
-                    {"label": "Negative Sample Std", "value": f"{np.std(neg_values):.3f}"},
-                    {"label": "Sample Size (Pos/Neg)", "value": f"{len(pos_values)}/{len(neg_values)}"}
+                    {"label": "Positive Sample Mean", "value": f"{pos_mean:.3f}"},
+                    {"label": "Negative Sample Mean", "value": f"{neg_mean:.3f}"},
+                    {"label": "Positive Sample Std", "value": f"{pos_std:.3f}"},
+                    {"label": "Negative Sample Std", "value": f"{neg_std:.3f}"},
+                    {"label": "Sample Size (Pos/Neg)", "value": f"{int(comparison['n_a'])}/{int(comparison['n_b'])}"}
                 ],
                 "trends": [
                     {"label": "T-statistic", "value": f"{t_stat:.3f}"},
                     {"label": "P-value", "value": f"{p_value:.3f}"},
                     {"label": "Effect Size (Cohen's d)", "value": f"{effect_size:.3f}"},
-                    {"label": "Concentration Difference", "value": f"{np.mean(pos_values) - np.mean(neg_values):.3f}"}
+                    {"label": "Concentration Difference", "value": f"{pos_mean - neg_mean:.3f}"}
                 ],
                 "implications": [
                     f"The {abs(effect_size):.1f} standard deviation difference indicates " + 
@@ -910,53 +990,58 @@ def get_stat_details():
                     ("Strong evidence" if p_value < 0.01 else
                      "Moderate evidence" if p_value < 0.05 else
                      "Weak evidence") + " of difference between groups",
-                    f"Direction: {'Higher' if np.mean(pos_values) > np.mean(neg_values) else 'Lower'} concentration in positive samples",
+                    f"Direction: {'Higher' if pos_mean > neg_mean else 'Lower'} concentration in positive samples",
                     "Consider these results alongside other VOC markers for comprehensive analysis"
                 ],
                 "relatedMetrics": [
                     {"label": "Positive Sample Range", 
-                     "value": f"{np.min(pos_values):.3f} - {np.max(pos_values):.3f}"},
+                     "value": f"{comparison['min_a']:.3f} - {comparison['max_a']:.3f}"},
                     {"label": "Negative Sample Range", 
-                     "value": f"{np.min(neg_values):.3f} - {np.max(neg_values):.3f}"},
+                     "value": f"{comparison['min_b']:.3f} - {comparison['max_b']:.3f}"},
                     {"label": "Confidence Interval (95%)", 
-                     "value": f"{np.mean(pos_values) - 1.96 * np.std(pos_values):.3f} - {np.mean(pos_values) + 1.96 * np.std(pos_values):.3f}"}
+                     "value": f"{comparison['ci_low_a']:.3f} - {comparison['ci_high_a']:.3f}"}
                 ],
                 "visualizationType": "bar"  # Frontend can use this to render appropriate visualization
             }
 
         elif section == "Quality Assessment":
             if "CO2" in stat:
-                co2_values = [float(s.get('average_co2', 0)) for s in processed_samples if 'average_co2' in s]
+                co2_values = snapshot.column('average_co2')
+                co2_values = co2_values[~np.isnan(co2_values)]
                 optimal_range = (2.0, 5.0)
+                co2_mean, co2_median = co2_values.mean(), np.median(co2_values)
+                within_range = int(((co2_values >= optimal_range[0]) & (co2_values <= optimal_range[1])).sum())
+                quality_rate = within_range / len(co2_values)
+                q1, q3 = np.percentile(co2_values, [25, 75])
                 
                 details = {
                     "description": "Analysis of CO2 levels as a quality control metric for breath samples",
                     "breakdown": [
-                        {"label": "Mean CO2", "value": f"{np.mean(co2_values):.2f}%"},
-                        {"label": "Median CO2", "value": f"{np.median(co2_values):.2f}%"},
-                        {"label": "Std Deviation", "value": f"{np.std(co2_values):.2f}%"},
+                        {"label": "Mean CO2", "value": f"{co2_mean:.2f}%"},
+                        {"label": "Median CO2", "value": f"{co2_median:.2f}%"},
+                        {"label": "Std Deviation", "value": f"{co2_values.std():.2f}%"},
                         {"label": "Within Range", 
-                         "value": f"{len([v for v in co2_values if optimal_range[0] <= v <= optimal_range[1]])} samples"}
+                         "value": f"{within_range} samples"}
                     ],
                     "trends": [
-                        {"label": "Range", "value": f"{min(co2_values):.2f}% - {max(co2_values):.2f}%"},
+                        {"label": "Range", "value": f"{co2_values.min():.2f}% - {co2_values.max():.2f}%"},
                         {"label": "Optimal Range", "value": f"{optimal_range[0]}% - {optimal_range[1]}%"},
                         {"label": "Quality Rate", 
-                         "value": f"{len([v for v in co2_values if optimal_range[0] <= v <= optimal_range[1]]) / len(co2_values) * 100:.1f}%"}
+                         "value": f"{quality_rate * 100:.1f}%"}
                     ],
                     "implications": [
-                        f"{'High' if np.mean(co2_values) > np.median(co2_values) else 'Low'} skewness in CO2 distribution",
-                        f"Quality rate indicates {'excellent' if len([v for v in co2_values if optimal_range[0] <= v <= optimal_range[1]]) / len(co2_values) > 0.9 else 'good' if len([v for v in co2_values if optimal_range[0] <= v <= optimal_range[1]]) / len(co2_values) > 0.8 else 'concerning'} sample collection",
+                        f"{'High' if co2_mean > co2_median else 'Low'} skewness in CO2 distribution",
+                        f"Quality rate indicates {'excellent' if quality_rate > 0.9 else 'good' if quality_rate > 0.8 else 'concerning'} sample collection",
                         "CO2 levels serve as key quality control metric",
                         "Consider impact on VOC concentration reliability"
                     ],
                     "relatedMetrics": [
                         {"label": "Below Range", 
-                         "value": f"{len([v for v in co2_values if v < optimal_range[0]])} samples"},
+                         "value": f"{int((co2_values < optimal_range[0]).sum())} samples"},
                         {"label": "Above Range", 
-                         "value": f"{len([v for v in co2_values if v > optimal_range[1]])} samples"},
+                         "value": f"{int((co2_values > optimal_range[1]).sum())} samples"},
                         {"label": "Interquartile Range", 
-                         "value": f"{np.percentile(co2_values, 25):.2f}% - {np.percentile(co2_values, 75):.2f}%"}
+                         "value": f"{q1:.2f}% - {q3:.2f}%"}
                     ],
                     "visualizationType": "line"
                 }
@@ -966,9 +1051,9 @@ def get_stat_details():
             details = {
                 "description": f"Statistical analysis of {stat}",
                 "breakdown": [
-                    {"label": "Sample Size", "value": len(processed_samples)},
+                    {"label": "Sample Size", "value": total},
                     {"label": "Data Completeness", 
-                     "value": f"{len([s for s in processed_samples if stat.lower() in {k.lower() for k in s.keys()}])}"}
+                     "value": f"{snapshot.key_counts.get(stat.lower(), 0)}"}
                 ],
                 "implications": [
                     "Consider this metric in context of overall analysis",
@@ -988,105 +1073,58 @@ def get_stat_details():
             'error': str(e)
         }), 500
 
-@api.route('/ai_analysis', methods=['GET'])
-@require_auth
-def ai_analysis():
-    try:
-        from ..main import analyzed_collection, openai_client
-        from ..utils.helpers import calculate_statistics
-        
-        # Fetch and preprocess data
-        analyzed_samples = list(analyzed_collection.find({}, {'_id': 0}))
-        if not analyzed_samples:
-            return jsonify({
-                "success": False,
-                "error": "No analyzed samples available"
-            }), 404
+def prepare_analysis(analyzed_collection):
+    """Snapshot the analyzed samples and drop extreme outliers.
 
-        logger.info(f"Total samples from database: {len(analyzed_samples)}")
+    Returns (snapshot, keep, cache_key) where keep masks the samples the
+    analysis covers, or None when there are no analyzed samples.
+    """
+    # Fetch and preprocess data
+    snapshot = snapshot_manager.get(analyzed_collection)
+    if not snapshot.size:
+        return None
 
-        # Convert samples and clean data
-        processed_samples = []
-        for sample in analyzed_samples:
-            # First convert the entire sample to handle Decimal128 and datetime
-            processed_sample = convert_sample(sample)
-            
-            # Then process numeric values and filter negatives
-            final_sample = {}
-            for key, value in processed_sample.items():
-                try:
-                    if isinstance(value, (int, float)):
-                        # Keep negative values for now, we'll handle them in the analysis
-                        final_sample[key] = value
-                    else:
-                        final_sample[key] = value
-                except (ValueError, TypeError):
-                    final_sample[key] = value
-                    
-            if final_sample:
-                processed_samples.append(final_sample)
-
-        logger.info(f"Processed samples after conversion: {len(processed_samples)}")
-
-        # Filter out outliers for VOC measurements
-        voc_fields = [
-            '2-Butanone', 'Pentanal', 'Decanal', 
-            '2-hydroxy-acetaldehyde', '2-hydroxy-3-butanone',
-            '4-HHE', '4-HNE'
-        ]
-        voc_per_liter_fields = [f"{voc}_per_liter" for voc in voc_fields]
-        all_fields = voc_fields + voc_per_liter_fields + ['average_co2', 'final_volume']
-        
-        # Calculate statistics with outlier removal
-        stats = calculate_statistics(processed_samples, all_fields)
-        
-        # Filter samples based on outlier bounds, but only for extreme outliers
-        filtered_samples = []
-        for sample in processed_samples:
-            include_sample = True
-            extreme_outlier_count = 0
-            total_fields_checked = 0
-            
-            for field in all_fields:
-                if field in sample and stats[field]:
-                    try:
-                        value = float(sample[field])
-                        min_val = stats[field]['range']['min']
-                        max_val = stats[field]['range']['max']
-                        total_fields_checked += 1
-                        
-                        # Only exclude if it's an extreme outlier (more than 3 IQR from median)
-                        q1 = stats[field].get('q1', min_val)
-                        q3 = stats[field].get('q3', max_val)
-                        iqr = q3 - q1
-                        lower_bound = q1 - 3 * iqr
-                        upper_bound = q3 + 3 * iqr
-                        
-                        if value < lower_bound or value > upper_bound:
-                            extreme_outlier_count += 1
-                    except (ValueError, TypeError):
-                        continue
-            
-            # Only exclude if more than 50% of fields are extreme outliers
-            if total_fields_checked > 0 and extreme_outlier_count / total_fields_checked <= 0.5:
-                filtered_samples.append(sample)
+    logger.info(f"Total samples from database: {snapshot.size}")
 
-        logger.info(f"Final filtered samples: {len(filtered_samples)}")
+    # Filter out outliers for VOC measurements
+    voc_per_liter_fields = [f"{voc}_per_liter" for voc in ANALYSIS_VOC_FIELDS]
+    all_fields = ANALYSIS_VOC_FIELDS + voc_per_liter_fields + ['average_co2', 'final_volume']
+    
+    # Calculate statistics with outlier removal; missing fields count as 0
+    # there, as in /statistics_summary, but only present values are checked
+    values = snapshot.matrix(all_fields)
+    stats = calculate_statistics_matrix(snapshot.statistics_matrix(all_fields), all_fields)
+    
+    # Only exclude extreme outliers (more than 3 IQR outside the quartiles)
+    lower_bounds = np.full(len(all_fields), np.nan)
+    upper_bounds = np.full(len(all_fields), np.nan)
+    for i, field in enumerate(all_fields):
+        if stats[field]:
+            iqr = stats[field]['q3'] - stats[field]['q1']
+            lower_bounds[i] = stats[field]['q1'] - 3 * iqr
+            upper_bounds[i] = stats[field]['q3'] + 3 * iqr
 
-        # Use filtered samples for analysis
-        data_hash = generate_data_hash(json.dumps(filtered_samples, sort_keys=True))
-        
-        # Check cache
-        cached_result = get_cached_analysis(data_hash)
-        if cached_result:
-            return jsonify({
-                "success": True,
-                "insights": cached_result,
-                "cached": True
-            })
+    checked = ~np.isnan(values) & ~np.isnan(lower_bounds)
+    outliers = checked & ((values < lower_bounds) | (values > upper_bounds))
+    fields_checked = checked.sum(axis=1)
+
+    # Only exclude if more than 50% of fields are extreme outliers
+    keep = (fields_checked > 0) & (outliers.sum(axis=1) <= 0.5 * fields_checked)
+
+    logger.info(f"Final filtered samples: {int(np.count_nonzero(keep))}")
 
-        # Create prompt for OpenAI
-        system_prompt = """You are an expert data scientist specializing in lung cancer detection through VOC (Volatile Organic Compounds) analysis of breath samples. Your expertise includes advanced statistical analysis, pattern recognition, and medical diagnostics.
+    # The filtered set is derived from the snapshot, so its content fingerprint
+    # identifies the input; a corrected record gives a new key once the
+    # snapshot reloads (on the next analyzed version, see SnapshotManager)
+    cache_key = analysis_cache.key(snapshot.fingerprint, ANALYSIS_PROMPT_VERSION, ANALYSIS_MODEL)
+    return snapshot, keep, cache_key
+
+def analysis_messages(snapshot, keep):
+    """Chat messages for an analysis of the kept samples"""
+    sample_count = int(np.count_nonzero(keep))
+
+    # Create prompt for OpenAI
+    system_prompt = """You are an expert data scientist specializing in lung cancer detection through VOC (Volatile Organic Compounds) analysis of breath samples. Your expertise includes advanced statistical analysis, pattern recognition, and medical diagnostics.
 
 Important Context - Lung Cancer Classification:
 This study focuses exclusively on lung cancer detection using breath VOC analysis. Sample classification criteria:
@@ -1164,7 +1202,7 @@ Remember:
 - Use bullet points for statistical details
 - Provide comprehensive analysis paragraphs"""
 
-        user_prompt = f"""Analyze this dataset of {len(filtered_samples)} breath samples for lung cancer detection.
+    user_prompt = f"""Analyze this dataset of {sample_count} breath samples for lung cancer detection.
 
 Please structure your response exactly as follows:
 
@@ -1181,7 +1219,7 @@ Please structure your response exactly as follows:
      - Distribution of lung-RADS scores
      - Cancer histology and staging when available
 
-   * VOC Analysis for each compound ({', '.join(voc_fields)}):
+   * VOC Analysis for each compound ({', '.join(ANALYSIS_VOC_FIELDS)}):
      - Concentrations in positive vs negative cases
      - Raw and per-liter values
      - Statistical significance
@@ -1213,54 +1251,149 @@ Remember to:
 - Consider lung-RADS scores in analysis
 - Analyze cancer histology and staging when available"""
 
+    # Send a fixed-size statistical digest instead of the raw documents
+    data_message = digest_message(build_analysis_digest(snapshot, keep))
+    prompt_tokens = sum(count_tokens(text, ANALYSIS_MODEL)
+                        for text in (system_prompt, user_prompt, data_message))
+    logger.info(f"ai_analysis prompt: {prompt_tokens} input tokens for {sample_count} samples")
+
+    return [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": user_prompt},
+        {"role": "user", "content": data_message}
+    ]
+
+def store_analysis(cache_key, analysis_text):
+    """Cache an analysis with its parsed sections; returns the sections"""
+    sections = parse_insights(analysis_text)
+    analysis_cache.set(cache_key, analysis_text, sections=sections)
+    return sections
+
+def cached_analysis(cache_key):
+    """(text, sections) for a cached analysis, or None"""
+    entry = analysis_cache.get_entry(cache_key)
+    if entry is None:
+        return None
+    # Entries cached before sections were stored are parsed on read
+    return entry['content'], entry.get('sections') or parse_insights(entry['content'])
+
+def generate_analysis(cache_key, messages):
+    """Blocking analysis call with retries; returns (text, sections), both cached"""
+    from ..main import openai_client
+
+    # Make API call with retry logic
+    max_retries = 3
+    retry_count = 0
+    last_error = None
+    
+    while retry_count < max_retries:
         try:
-            # Initialize OpenAI client
-            if not openai_client:
-                raise Exception("OpenAI client not initialized")
-
-            # Make API call with retry logic
-            max_retries = 3
-            retry_count = 0
-            last_error = None
+            response = openai_client.chat.completions.create(
+                model=ANALYSIS_MODEL,
+                messages=messages,
+                temperature=0.2,
+                max_tokens=4000
+            )
+            if getattr(response, 'usage', None):
+                logger.info(f"ai_analysis usage: {response.usage.prompt_tokens} prompt tokens, "
+                            f"{response.usage.completion_tokens} completion tokens")
+            
+            analysis_text = response.choices[0].message.content
+            
+            # Cache the result
+            return analysis_text, store_analysis(cache_key, analysis_text)
             
-            while retry_count < max_retries:
-                try:
-                    response = openai_client.chat.completions.create(
-                        model="gpt-4o-2024-11-20",
-                        messages=[
-                            {"role": "system", "content": system_prompt},
-                            {"role": "user", "content": user_prompt},
-                            {"role": "user", "content": f"Data: {json.dumps(filtered_samples)}"}
-                        ],
-                        temperature=0.2,
-                        max_tokens=4000
-                    )
-                    
-                    analysis_text = response.choices[0].message.content
-                    
-                    # Cache the result
-                    cache_analysis(data_hash, analysis_text)
-                    
-                    return jsonify({
-                        "success": True,
-                        "insights": analysis_text,
-                        "cached": False
-                    })
-                    
-                except Exception as e:
-                    last_error = str(e)
-                    logger.error(f"OpenAI API Error (attempt {retry_count + 1}): {str(e)}")
-                    retry_count += 1
-                    if retry_count == max_retries:
-                        raise Exception(f"OpenAI API failed after {max_retries} attempts. Last error: {last_error}")
-                    time.sleep(2 ** retry_count)  # Exponential backoff
-                    
+        except Exception as e:
+            last_error = str(e)
+            logger.error(f"OpenAI API Error (attempt {retry_count + 1}): {str(e)}")
+            retry_count += 1
+            if retry_count == max_retries:
+                raise Exception(f"OpenAI API failed after {max_retries} attempts. Last error: {last_error}")
+            time.sleep(2 ** retry_count)  # Exponential backoff
+
+def analysis_job(job, progress):
+    """Job handler for background analyses (see tasks/jobs.py)"""
+    from ..main import analyzed_collection, openai_client
+
+    progress('preparing')
+    prepared = prepare_analysis(analyzed_collection)
+    if prepared is None:
+        raise ValueError("No analyzed samples available")
+    snapshot, keep, cache_key = prepared
+
+    cached_result = cached_analysis(cache_key)
+    if cached_result:
+        analysis_text, sections = cached_result
+        return {"insights": analysis_text, "sections": sections, "cached": True}
+    if not openai_client:
+        raise RuntimeError("OpenAI client not initialized")
+
+    progress('generating')
+    messages = analysis_messages(snapshot, keep)
+    (analysis_text, sections), shared = analysis_flight.do(cache_key, lambda: generate_analysis(cache_key, messages))
+    return {"insights": analysis_text, "sections": sections, "cached": shared}
+
+@api.route('/ai_analysis', methods=['GET'])
+@require_auth
+def ai_analysis():
+    try:
+        from ..main import analyzed_collection, openai_client
+        
+        prepared = prepare_analysis(analyzed_collection)
+        if prepared is None:
+            return jsonify({
+                "success": False,
+                "error": "No analyzed samples available"
+            }), 404
+        snapshot, keep, cache_key = prepared
+
+        # Check cache
+        cached_result = cached_analysis(cache_key)
+        if cached_result and wants_stream():
+            analysis_text, sections = cached_result
+            return sse_response(stream_cached('insights', analysis_text, sections=sections))
+        if cached_result:
+            analysis_text, sections = cached_result
+            return jsonify({
+                "success": True,
+                "insights": analysis_text,
+                "sections": sections,
+                "cached": True
+            })
+
+        if not openai_client:
+            return jsonify({
+                "success": False,
+                "error": "OpenAI client not initialized"
+            }), 500
+
+        messages = analysis_messages(snapshot, keep)
+
+        if wants_stream():
+            # Streamed analyses are not coalesced; the assembled text is cached
+            # like a blocking one, so later callers of either kind reuse it
+            return sse_response(stream_completion(
+                lambda: openai_client.chat.completions.create(
+                    model=ANALYSIS_MODEL, messages=messages, temperature=0.2, max_tokens=4000, stream=True),
+                'insights',
+                on_complete=lambda text: {"sections": store_analysis(cache_key, text)},
+                retries=3, label='ai_analysis'))
+
+        try:
+            # Concurrent identical requests wait for one upstream call
+            (analysis_text, sections), shared = analysis_flight.do(
+                cache_key, lambda: generate_analysis(cache_key, messages))
+            return jsonify({
+                "success": True,
+                "insights": analysis_text,
+                "sections": sections,
+                "cached": shared
+            })
         except Exception as e:
             logger.error(f"OpenAI API Error: {str(e)}")
             return jsonify({
                 "success": False,
-                "error": str(e),
-                "retry_count": retry_count
+                "error": str(e)
             }), 500
 
     except Exception as e:
@@ -1268,4 +1401,74 @@ Remember to:
         return jsonify({
             "success": False,
             "error": str(e)
-        }), 500
\ No newline at end of file
+        }), 500
+
+def current_analysis():
+    """(text, sections) of the cached analysis of the current data, or an error response"""
+    from ..main import analyzed_collection
+
+    prepared = prepare_analysis(analyzed_collection)
+    if prepared is None:
+        return None, (jsonify({"success": False, "error": "No analyzed samples available"}), 404)
+    cached_result = cached_analysis(prepared[2])
+    if cached_result is None:
+        return None, (jsonify({
+            "success": False,
+            "error": "No analysis of the current data yet; request one with POST /ai_analysis"
+        }), 404)
+    return cached_result, None
+
+@api.route('/ai_analysis/sections', methods=['GET'])
+@require_auth
+def ai_analysis_sections():
+    """Titles and key findings of the current analysis, without the section bodies"""
+    try:
+        cached_result, error = current_analysis()
+        if error:
+            return error
+        return json_response({"success": True, "sections": section_index(cached_result[1])})
+    except Exception as e:
+        logger.error(f"Error fetching analysis sections: {str(e)}")
+        return jsonify({"success": False, "error": str(e)}), 500
+
+@api.route('/ai_analysis/sections/<section>', methods=['GET'])
+@require_auth
+def ai_analysis_section(section):
+    """One section of the current analysis, by id, title or position"""
+    try:
+        cached_result, error = current_analysis()
+        if error:
+            return error
+        found = find_section(cached_result[1], section)
+        if found is None:
+            return jsonify({"success": False, "error": f"Section not found: {section}"}), 404
+        return json_response({"success": True, "section": found})
+    except Exception as e:
+        logger.error(f"Error fetching analysis section: {str(e)}")
+        return jsonify({"success": False, "error": str(e)}), 500
+
+@api.route('/ai_analysis', methods=['POST'])
+@require_auth
+def create_analysis_job():
+    """Queue an analysis and return at once; poll GET /jobs/<job_id> or wait for job_finished"""
+    from ..main import job_queue
+    try:
+        job = job_queue.submit('ai_analysis')
+        return json_response({"success": True, **job_view(job)}, 202)
+    except JobQueueFull as e:
+        return jsonify({"success": False, "error": str(e)}), 503
+    except Exception as e:
+        logger.error(f"Error queueing analysis job: {str(e)}")
+        return jsonify({"success": False, "error": str(e)}), 500
+
+@api.route('/jobs/<job_id>', methods=['GET'])
+@require_auth
+def get_job(job_id):
+    from ..main import job_queue
+    try:
+        job = job_queue.get(job_id)
+        if job is None:
+            return jsonify({"success": False, "error": "Job not found"}), 404
+        return json_response({"success": True, **job_view(job)})
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)}), 500
\ No newline at end of file
@@ -32,7 +32,7 @@ def init_socketio(app):
         ping_timeout=60,
         ping_interval=25,
         max_http_buffer_size=1024 * 1024,
-        message_queue='redis://localhost:6379/0' if not Config.PRODUCTION else Config.REDIS_URL,
+        message_queue=Config.SOCKETIO_MESSAGE_QUEUE,
         async_handlers=True,
         logger=True,
         engineio_logger=True
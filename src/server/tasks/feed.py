@@ -0,0 +1,202 @@
+import threading
+import logging
+import time
+import uuid
+from datetime import datetime, timezone
+from flask import request
+from flask_socketio import join_room, leave_room, emit
+from pymongo.errors import OperationFailure, PyMongoError
+from ..utils.helpers import convert_sample
+from ..utils.auth import verify_token
+from ..utils.backends import shared_backend
+from ..utils.conditional import dataset_versions
+from ..utils.mutations import UPDATED_AT
+
+logger = logging.getLogger(__name__)
+
+NAMESPACE = '/samples'
+LEASE_NAME = 'feed:leader'
+LEASE_TTL = 15
+
+def status_room(status):
+    return f"status:{status}"
+
+class SampleFeed:
+    """Publishes sample changes to Socket.IO rooms as small deltas keyed by chip_id.
+
+    Uses a Mongo change stream where available (replica sets / Atlas). On a
+    standalone server it falls back to polling the updated_at stamp that the
+    write paths set; deletes are only visible through the change stream.
+    With several workers sharing a Socket.IO message queue, only the worker
+    holding the feed lease publishes, so clients get each delta once.
+    Clients join one room per status and receive:
+
+        {"op": "insert" | "update" | "delete", "chip_id": ..., "status": ...,
+         "fields": {...changed fields...}, "previous_status": ...}
+    """
+
+    def __init__(self, collection, socketio, poll_interval=2.0, backend=None):
+        self.collection = collection
+        self.socketio = socketio
+        self.poll_interval = poll_interval
+        self.backend = backend or shared_backend
+        self.owner = uuid.uuid4().hex
+        self._lease_checked = 0
+        self.mode = None
+        self._leader = False
+        self.published = 0
+        self._index = {}
+        self._resume_token = None
+        self._thread = None
+
+    def _load_index(self):
+        """_id -> (chip_id, status), so updates and deletes can reach the rooms of the old status"""
+        self._index = {
+            doc['_id']: (doc.get('chip_id'), doc.get('status'))
+            for doc in self.collection.find({}, {'chip_id': 1, 'status': 1})
+        }
+
+    def is_leader(self, force=False):
+        """Acquire or renew the feed lease, at most once per poll interval unless forced"""
+        now = time.monotonic()
+        if force or now - self._lease_checked >= self.poll_interval:
+            self._leader = self.backend.acquire_lease(LEASE_NAME, self.owner, LEASE_TTL)
+            self._lease_checked = now
+        return self._leader
+
+    def publish(self, op, doc_id, fields):
+        chip_id, previous_status = self._index.get(doc_id, (None, None))
+        chip_id = fields.get('chip_id', chip_id)
+        status = fields.get('status', previous_status)
+        if op == 'delete':
+            self._index.pop(doc_id, None)
+        else:
+            self._index[doc_id] = (chip_id, status)
+
+        delta = {
+            'op': op,
+            'chip_id': chip_id,
+            'status': status,
+            'fields': convert_sample({k: v for k, v in fields.items() if k != '_id'}),
+        }
+        if previous_status and previous_status != status:
+            delta['previous_status'] = previous_status
+
+        rooms = {status_room(status)}
+        if previous_status:
+            rooms.add(status_room(previous_status))
+        for room in rooms:
+            self.socketio.emit('sample_delta', delta, to=room, namespace=NAMESPACE)
+        # Writes made outside this app only reach the ETags through here
+        dataset_versions.bump('samples')
+        self.published += 1
+
+    def _watch(self):
+        kwargs = {'full_document': 'updateLookup'}
+        if self._resume_token:
+            kwargs['resume_after'] = self._resume_token
+        with self.collection.watch(**kwargs) as stream:
+            self.mode = 'change_stream'
+            while stream.alive and self.is_leader():
+                change = stream.try_next()
+                if change is None:
+                    continue
+                self._resume_token = stream.resume_token
+                op = change['operationType']
+                doc_id = change['documentKey']['_id']
+                if op == 'insert' or op == 'replace':
+                    self.publish('insert' if op == 'insert' else 'update', doc_id, change['fullDocument'])
+                elif op == 'update':
+                    fields = dict(change['updateDescription']['updatedFields'])
+                    # Keep chip_id/status present so the delta always has its keys
+                    full = change.get('fullDocument') or {}
+                    for key in ('chip_id', 'status'):
+                        if key in full:
+                            fields.setdefault(key, full[key])
+                    self.publish('update', doc_id, fields)
+                elif op == 'delete':
+                    self.publish('delete', doc_id, {})
+
+    def _poll(self):
+        self.mode = 'polling'
+        since = datetime.now(timezone.utc)
+        seen_at_since = set()
+        while self.is_leader():
+            time.sleep(self.poll_interval)
+            changed = self.collection.find({UPDATED_AT: {'$gte': since}}).sort(UPDATED_AT, 1)
+            for doc in changed:
+                updated_at = doc[UPDATED_AT]
+                if updated_at.tzinfo is None:
+                    updated_at = updated_at.replace(tzinfo=timezone.utc)
+                if updated_at == since and doc['_id'] in seen_at_since:
+                    continue
+                if updated_at > since:
+                    since, seen_at_since = updated_at, set()
+                seen_at_since.add(doc['_id'])
+                self.publish('update' if doc['_id'] in self._index else 'insert', doc['_id'], doc)
+
+    def _run(self):
+        while True:
+            if not self.is_leader(force=True):
+                self.mode = 'standby'
+                time.sleep(self.poll_interval)
+                continue
+            try:
+                if self.mode == 'standby':
+                    # Another worker published while we waited; start from current state
+                    self._load_index()
+                    self._resume_token = None
+                self._watch()
+            except OperationFailure as e:
+                # Change streams need a replica set; standalone servers get the polling fallback
+                logger.info(f"Change streams unavailable ({e}), polling {UPDATED_AT} instead")
+                try:
+                    self._poll()
+                except Exception as e:
+                    logger.error(f"Sample feed polling failed: {e}")
+            except PyMongoError as e:
+                logger.error(f"Sample change stream interrupted: {e}")
+            except Exception as e:
+                logger.error(f"Sample feed error: {e}")
+            time.sleep(self.poll_interval)
+
+    def start(self):
+        if self._thread is None:
+            try:
+                self._load_index()
+            except Exception as e:
+                logger.error(f"Failed to load sample index for the feed: {e}")
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        return self
+
+    def register_handlers(self, socketio):
+        @socketio.on('connect', namespace=NAMESPACE)
+        def handle_connect(auth=None):
+            token = (auth or {}).get('token')
+            if not token:
+                header = request.headers.get('Authorization', '')
+                token = header.split('Bearer ')[1] if header.startswith('Bearer ') else None
+            try:
+                verify_token(token)
+            except Exception:
+                return False
+
+        @socketio.on('subscribe', namespace=NAMESPACE)
+        def handle_subscribe(data):
+            """Join the rooms for the requested statuses and send their current samples once"""
+            statuses = (data or {}).get('statuses') or []
+            for status in statuses:
+                join_room(status_room(status))
+            samples = self.collection.find({'status': {'$in': statuses}}, {'_id': 0})
+            emit('sample_snapshot', {
+                'statuses': statuses,
+                'samples': [convert_sample(sample) for sample in samples],
+            })
+
+        @socketio.on('unsubscribe', namespace=NAMESPACE)
+        def handle_unsubscribe(data):
+            for status in (data or {}).get('statuses') or []:
+                leave_room(status_room(status))
+
+        return self
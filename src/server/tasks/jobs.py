@@ -0,0 +1,214 @@
+import hashlib
+import json
+import logging
+import threading
+import uuid
+from datetime import datetime, timedelta
+import eventlet
+import pytz
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+logger = logging.getLogger(__name__)
+
+QUEUED = 'queued'
+RUNNING = 'running'
+COMPLETE = 'complete'
+FAILED = 'failed'
+ACTIVE = [QUEUED, RUNNING]
+# Set while a job is queued or running; unique (see utils/indexes.py), so
+# concurrent submits of the same work insert only one job
+ACTIVE_KEY = 'active_key'
+
+def active_key(kind, params):
+    return hashlib.md5(f"{kind}:{json.dumps(params, sort_keys=True, default=str)}".encode()).hexdigest()
+
+class JobQueueFull(Exception):
+    pass
+
+class JobQueue:
+    """Mongo-backed queue for long-running work such as AI analyses.
+
+    Requests only insert a job document and return its id. A dispatcher
+    green thread in every worker claims queued jobs up to the size of its
+    pool, so no worker runs more than `pool_size` at once and any worker can
+    serve a job's status or result from Mongo. Handlers report progress
+    stages; jobs left running by a worker that died are requeued after
+    `lease`, up to `max_attempts` runs. Finished jobs expire after `keep`.
+    """
+
+    def __init__(self, collection, emit=None, pool_size=2, max_queued=20,
+                 max_attempts=2, lease=timedelta(minutes=10), keep=timedelta(days=1), poll_interval=5):
+        self.collection = collection
+        self.emit = emit
+        self.pool = eventlet.GreenPool(pool_size)
+        self.max_queued = max_queued
+        self.max_attempts = max_attempts
+        self.lease = lease
+        self.keep = keep
+        self.poll_interval = poll_interval
+        self.handlers = {}
+        self.owner = uuid.uuid4().hex
+        self._wakeup = threading.Event()
+        self._thread = None
+
+    def register(self, kind, handler):
+        """handler(job, progress) returns the job's result; progress(stage) records how far it got"""
+        self.handlers[kind] = handler
+        return self
+
+    def submit(self, kind, params=None):
+        """Queue a job, or return the one of this kind already queued or running"""
+        if kind not in self.handlers:
+            raise ValueError(f"Unknown job kind: {kind}")
+        key = active_key(kind, params or {})
+        active = self.collection.find_one({ACTIVE_KEY: key})
+        if active is not None:
+            return active
+        if self.collection.count_documents({'status': QUEUED}) >= self.max_queued:
+            raise JobQueueFull("Too many queued jobs, try again later")
+
+        now = datetime.now(pytz.UTC)
+        job = {
+            '_id': uuid.uuid4().hex,
+            'kind': kind,
+            'params': params or {},
+            'status': QUEUED,
+            'stage': None,
+            'attempts': 0,
+            ACTIVE_KEY: key,
+            'created_at': now,
+            'updated_at': now,
+        }
+        try:
+            self.collection.insert_one(job)
+        except DuplicateKeyError:
+            # Another request queued the same job in the meantime
+            active = self.collection.find_one({ACTIVE_KEY: key})
+            return active if active is not None else self.submit(kind, params)
+        self._wakeup.set()
+        return job
+
+    def get(self, job_id):
+        return self.collection.find_one({'_id': job_id})
+
+    def _claim(self):
+        now = datetime.now(pytz.UTC)
+        return self.collection.find_one_and_update(
+            {'status': QUEUED},
+            {'$set': {'status': RUNNING, 'owner': self.owner, 'started_at': now, 'updated_at': now},
+             '$inc': {'attempts': 1}},
+            sort=[('created_at', 1)],
+            return_document=ReturnDocument.AFTER
+        )
+
+    def _release_stale(self):
+        """Requeue jobs whose worker stopped updating them; fail the ones out of attempts"""
+        cutoff = datetime.now(pytz.UTC) - self.lease
+        stale = {'status': RUNNING, 'updated_at': {'$lt': cutoff}}
+        for job in self.collection.find({**stale, 'attempts': {'$gte': self.max_attempts}},
+                                        {'_id': 1, 'kind': 1, 'owner': 1}):
+            self._finish(job, FAILED, error="Job was interrupted")
+        self.collection.update_many(stale, {'$set': {'status': QUEUED, 'owner': None}})
+
+    def _notify(self, event, job, **fields):
+        if not self.emit:
+            return
+        try:
+            self.emit(event, {'job_id': job['_id'], 'kind': job['kind'], **fields})
+        except Exception as e:
+            logger.error(f"Failed to emit {event}: {e}")
+
+    def _progress(self, job, stage):
+        self.collection.update_one(
+            {'_id': job['_id'], 'owner': self.owner},
+            {'$set': {'stage': stage, 'updated_at': datetime.now(pytz.UTC)}}
+        )
+        self._notify('job_progress', job, status=RUNNING, stage=stage)
+
+    def _heartbeat(self, job):
+        while True:
+            eventlet.sleep(self.lease.total_seconds() / 3)
+            self.collection.update_one({'_id': job['_id'], 'owner': self.owner},
+                                       {'$set': {'updated_at': datetime.now(pytz.UTC)}})
+
+    def _finish(self, job, status, result=None, error=None):
+        now = datetime.now(pytz.UTC)
+        # Only the run that claimed the job may finish it
+        self.collection.update_one(
+            {'_id': job['_id'], 'owner': job.get('owner')},
+            {'$set': {'status': status, 'result': result, 'error': error, 'finished_at': now,
+                      'updated_at': now, 'expires_at': now + self.keep},
+             '$unset': {ACTIVE_KEY: ''}}
+        )
+        self._notify('job_finished', job, status=status, error=error)
+
+    def _execute(self, job):
+        heartbeat = eventlet.spawn(self._heartbeat, job)
+        try:
+            result = self.handlers[job['kind']](job, lambda stage: self._progress(job, stage))
+            self._finish(job, COMPLETE, result=result)
+        except Exception as e:
+            logger.error(f"{job['kind']} job {job['_id']} failed: {e}")
+            self._finish(job, FAILED, error=str(e))
+        finally:
+            heartbeat.kill()
+            # A slot is free; pick up whatever queued meanwhile
+            self._wakeup.set()
+
+    def dispatch(self):
+        """Start queued jobs while the pool has room; returns the number started"""
+        started = 0
+        while self.pool.free() > 0:
+            job = self._claim()
+            if job is None:
+                break
+            if job['kind'] not in self.handlers:
+                self._finish(job, FAILED, error=f"Unknown job kind: {job['kind']}")
+                continue
+            self.pool.spawn_n(self._execute, job)
+            started += 1
+        return started
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.poll_interval)
+            self._wakeup.clear()
+            try:
+                self._release_stale()
+                self.dispatch()
+            except Exception as e:
+                logger.error(f"Job dispatcher error: {e}")
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        return self
+
+    def stats(self):
+        return {
+            'queued': self.collection.count_documents({'status': QUEUED}),
+            'running': self.collection.count_documents({'status': RUNNING}),
+            'running_here': self.pool.running(),
+        }
+
+def job_view(job):
+    """The job as returned by GET /jobs/<id>"""
+    view = {
+        'job_id': job['_id'],
+        'kind': job['kind'],
+        'status': job['status'],
+        'stage': job.get('stage'),
+        'attempts': job.get('attempts', 0),
+    }
+    for field in ('created_at', 'started_at', 'finished_at'):
+        value = job.get(field)
+        if value:
+            # Mongo hands datetimes back naive; they are stored as UTC
+            view[field] = (value if value.tzinfo else value.replace(tzinfo=pytz.UTC)).isoformat()
+    if job['status'] == COMPLETE:
+        view['result'] = job.get('result')
+    if job['status'] == FAILED:
+        view['error'] = job.get('error')
+    return view
@@ -1,32 +1,168 @@
 import threading
-import time
+import heapq
+import logging
 from datetime import datetime, timedelta
 import pytz
-from src.server.utils.helpers import send_email
-
-def check_and_update_samples(collection):
-    while True:
-        current_time = datetime.now(pytz.UTC)
-        samples_to_update = collection.find({
-            "status": "In Process",
-            "expected_completion_time": {"$lte": current_time}
-        })
-
-        for sample in samples_to_update:
-            update_sample_status(collection, sample['chip_id'], "Ready for Pickup")
-
-        time.sleep(60)
-
-def update_sample_status(collection, chip_id, new_status):
-    collection.update_one(
-        {"chip_id": chip_id},
-        {"$set": {"status": new_status}}
-    )
-
-def start_monitoring(collection):
-    monitor_thread = threading.Thread(
-        target=check_and_update_samples,
-        args=(collection,),
-        daemon=True
-    )
-    monitor_thread.start() 
\ No newline at end of file
+from ..utils.mutations import PROCESSING_TIME, sample_update
+from ..utils.conditional import dataset_versions
+
+logger = logging.getLogger(__name__)
+
+RETRY_DELAY = timedelta(seconds=30)
+
+def parse_due_time(value):
+    """expected_completion_time is stored as an ISO string by register_sample; older documents may hold datetimes"""
+    if isinstance(value, datetime):
+        due = value
+    elif isinstance(value, str):
+        try:
+            due = datetime.fromisoformat(value.replace('Z', '+00:00'))
+        except ValueError:
+            return None
+    else:
+        return None
+    return due if due.tzinfo else due.replace(tzinfo=pytz.UTC)
+
+class CompletionScheduler:
+    """Moves samples from "In Process" to "Ready for Pickup" when they are due.
+
+    Due times are kept in a heap and the worker sleeps until the earliest
+    one, so a sample changes status when it is due rather than on the next
+    poll. Each due sample is moved with its own conditional update, so a
+    worker only announces the samples it moved itself.
+    """
+
+    def __init__(self, collection, emit=None,
+                 from_status="In Process", to_status="Ready for Pickup"):
+        self.collection = collection
+        self.emit = emit
+        self.from_status = from_status
+        self.to_status = to_status
+        self._heap = []
+        self._due = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+
+    def schedule(self, chip_id, due):
+        """Schedule (or reschedule) a status change for `chip_id` at `due`"""
+        due = parse_due_time(due)
+        if due is None:
+            return
+        with self._lock:
+            if self._due.get(chip_id) == due:
+                return
+            self._due[chip_id] = due
+            heapq.heappush(self._heap, (due, chip_id))
+            earliest = self._heap[0][0] == due
+        if earliest:
+            self._wakeup.set()
+
+    def cancel(self, chip_id):
+        with self._lock:
+            self._due.pop(chip_id, None)
+
+    def recover(self):
+        """Load due times for every sample still in process, e.g. after a restart"""
+        samples = self.collection.find(
+            {"status": self.from_status},
+            {"_id": 0, "chip_id": 1, "expected_completion_time": 1, "timestamp": 1}
+        )
+        count = 0
+        for sample in samples:
+            due = parse_due_time(sample.get('expected_completion_time'))
+            if due is None:
+                started = parse_due_time(sample.get('timestamp'))
+                due = started + PROCESSING_TIME if started else None
+            if due is not None and sample.get('chip_id'):
+                self.schedule(sample['chip_id'], due)
+                count += 1
+        logger.info(f"Recovered {count} in-process samples into the completion scheduler")
+        return count
+
+    def pending(self):
+        with self._lock:
+            return len(self._due)
+
+    def _pop_due(self, now):
+        chip_ids = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                due, chip_id = heapq.heappop(self._heap)
+                # Skip entries superseded by a later schedule() or cancel()
+                if self._due.get(chip_id) == due:
+                    del self._due[chip_id]
+                    chip_ids.append(chip_id)
+        return chip_ids
+
+    def run_due(self, now=None):
+        """Apply every transition that is due; returns the number of samples updated"""
+        chip_ids = self._pop_due(now or datetime.now(pytz.UTC))
+        if not chip_ids:
+            return 0
+
+        # One conditional update per sample: every worker runs a scheduler,
+        # so only the samples this call moved out of from_status are announced
+        moved = []
+        for position, chip_id in enumerate(chip_ids):
+            try:
+                before = self.collection.find_one_and_update(
+                    {"chip_id": chip_id, "status": self.from_status},
+                    sample_update({"status": self.to_status}),
+                    projection={"_id": 1}
+                )
+            except Exception:
+                retry_at = datetime.now(pytz.UTC) + RETRY_DELAY
+                for pending in chip_ids[position:]:
+                    self.schedule(pending, retry_at)
+                self._announce(moved)
+                raise
+            if before is not None:
+                moved.append(chip_id)
+        self._announce(moved)
+        return len(moved)
+
+    def _announce(self, chip_ids):
+        if not chip_ids:
+            return
+        logger.info(f"Marked {len(chip_ids)} samples {self.to_status}")
+        dataset_versions.bump('samples')
+        if self.emit:
+            try:
+                self.emit('sample_status_update', {
+                    'chip_ids': chip_ids,
+                    'status': self.to_status,
+                    'timestamp': datetime.now(pytz.UTC).isoformat()
+                })
+            except Exception as e:
+                logger.error(f"Failed to emit status update: {e}")
+
+    def _seconds_until_next(self):
+        with self._lock:
+            if not self._heap:
+                return None
+            due = self._heap[0][0]
+        return max(0.0, (due - datetime.now(pytz.UTC)).total_seconds())
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self._seconds_until_next())
+            self._wakeup.clear()
+            try:
+                self.run_due()
+            except Exception as e:
+                logger.error(f"Completion scheduler error: {e}")
+
+    def start(self):
+        if self._thread is not None:
+            return self
+        try:
+            self.recover()
+        except Exception as e:
+            logger.error(f"Failed to recover in-process samples: {e}")
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+def start_monitoring(collection, emit=None):
+    return CompletionScheduler(collection, emit=emit).start()
@@ -0,0 +1,121 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+from flask import request, jsonify
+from firebase_admin import auth
+
+class TokenCache:
+    """Bounded LRU of verified Firebase ID tokens, each valid until its `exp` claim.
+
+    Keys are SHA-256 digests so raw bearer tokens are never held in memory.
+    A maxsize of 0 disables caching.
+    """
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def digest(token):
+        return hashlib.sha256(token.encode()).hexdigest()
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[1] <= now:
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, claims):
+        expires_at = claims.get('exp')
+        if not self.maxsize or not expires_at:
+            return
+        with self._lock:
+            self._entries[key] = (claims, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'size': len(self._entries),
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else None,
+        }
+
+token_cache = TokenCache()
+
+def verify_token(token):
+    """Verify a Firebase ID token, reusing the result of an earlier verification.
+
+    Both decorators go through here, so they share one cache and one Firebase
+    verifier (and with it the SDK's cached public keys).
+    """
+    key = TokenCache.digest(token)
+    claims = token_cache.get(key)
+    if claims is None:
+        claims = auth.verify_id_token(token)
+        token_cache.put(key, claims)
+    return claims
+
+def _bearer_token():
+    auth_header = request.headers.get('Authorization', '')
+    if not auth_header.startswith('Bearer '):
+        return None
+    return auth_header.split('Bearer ')[1]
+
+def require_auth(f):
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        # Skip auth check for OPTIONS requests
+        if request.method == 'OPTIONS':
+            return f(*args, **kwargs)
+
+        token = _bearer_token()
+        if token is None:
+            return jsonify({'error': 'No token provided'}), 401
+
+        try:
+            decoded_token = verify_token(token)
+        except Exception as e:
+            return jsonify({'error': 'Invalid token'}), 401
+        request.user = decoded_token
+        return f(*args, **kwargs)
+
+    return decorated_function
+
+def require_admin(f):
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        token = _bearer_token()
+        if token is None:
+            return jsonify({'error': 'No token provided'}), 401
+
+        try:
+            decoded_token = verify_token(token)
+        except Exception as e:
+            print(f"Auth error: {str(e)}")
+            return jsonify({'error': 'Invalid token'}), 401
+        if not decoded_token.get('admin', False):
+            return jsonify({'error': 'Unauthorized - Admin access required'}), 403
+        return f(*args, **kwargs)
+
+    return decorated_function
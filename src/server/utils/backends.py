@@ -0,0 +1,175 @@
+import threading
+import time
+import logging
+from collections import deque
+from bson import json_util
+from ..config import Config
+
+logger = logging.getLogger(__name__)
+
+def _counter(value):
+    """Counter hash values as both backends return them: int when whole, float otherwise.
+
+    Redis keeps one string per field whichever command incremented it, so a
+    float total that happens to be whole reads back as "3", not "3.0".
+    """
+    if isinstance(value, (bytes, str)):
+        try:
+            return int(value)
+        except ValueError:
+            value = float(value)
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+class InProcessBackend:
+    """Shared-state backend for a single worker: plain dicts and deques behind a lock"""
+
+    shared = False
+
+    def __init__(self):
+        self._values = {}
+        self._lists = {}
+        self._hashes = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at is not None and expires_at <= time.time():
+                del self._values[key]
+                return None
+            return value
+
+    def set(self, key, value, ttl=None):
+        expires_at = time.time() + ttl if ttl else None
+        with self._lock:
+            self._values[key] = (value, expires_at)
+
+    def delete_prefix(self, prefix):
+        with self._lock:
+            for key in [key for key in self._values if key.startswith(prefix)]:
+                del self._values[key]
+
+    def incr(self, key, amount=1):
+        with self._lock:
+            value = (self._values.get(key) or (0, None))[0] + amount
+            self._values[key] = (value, None)
+            return value
+
+    def push(self, key, value, maxlen):
+        with self._lock:
+            entries = self._lists.get(key)
+            if entries is None:
+                entries = self._lists[key] = deque(maxlen=maxlen)
+            entries.append(value)
+
+    def range(self, key):
+        with self._lock:
+            return list(self._lists.get(key, ()))
+
+    def hincr(self, key, amounts):
+        """Add each amount to its field of the counter hash `key`"""
+        with self._lock:
+            counters = self._hashes.setdefault(key, {})
+            for field, amount in amounts.items():
+                counters[field] = counters.get(field, 0) + amount
+
+    def hgetall(self, key):
+        with self._lock:
+            return {field: _counter(value) for field, value in self._hashes.get(key, {}).items()}
+
+    def acquire_lease(self, name, owner, ttl):
+        """True if `owner` holds the lease `name` after the call; renews it if it already did"""
+        now = time.time()
+        with self._lock:
+            entry = self._values.get(name)
+            if entry is None or entry[0] == owner or entry[1] <= now:
+                self._values[name] = (owner, now + ttl)
+                return True
+            return False
+
+class RedisBackend:
+    """Shared-state backend for several workers (or hosts) backed by Redis.
+
+    Values are stored as MongoDB extended JSON, so datetimes and ObjectIds
+    round-trip the same way they do through the in-process backend.
+    """
+
+    shared = True
+
+    def __init__(self, url, prefix='onebreath:'):
+        import redis
+        self.url = url
+        self.prefix = prefix
+        self.client = redis.Redis.from_url(url)
+
+    def _key(self, key):
+        return f"{self.prefix}{key}"
+
+    def get(self, key):
+        raw = self.client.get(self._key(key))
+        return None if raw is None else json_util.loads(raw)
+
+    def set(self, key, value, ttl=None):
+        self.client.set(self._key(key), json_util.dumps(value), px=int(ttl * 1000) if ttl else None)
+
+    def delete_prefix(self, prefix):
+        keys = list(self.client.scan_iter(match=f"{self._key(prefix)}*"))
+        if keys:
+            self.client.delete(*keys)
+
+    def incr(self, key, amount=1):
+        return self.client.incrby(self._key(key), amount)
+
+    def push(self, key, value, maxlen):
+        pipe = self.client.pipeline()
+        pipe.rpush(self._key(key), json_util.dumps(value))
+        pipe.ltrim(self._key(key), -maxlen, -1)
+        pipe.execute()
+
+    def range(self, key):
+        return [json_util.loads(raw) for raw in self.client.lrange(self._key(key), 0, -1)]
+
+    def hincr(self, key, amounts):
+        pipe = self.client.pipeline(transaction=False)
+        for field, amount in amounts.items():
+            if isinstance(amount, float):
+                pipe.hincrbyfloat(self._key(key), field, amount)
+            else:
+                pipe.hincrby(self._key(key), field, amount)
+        pipe.execute()
+
+    def hgetall(self, key):
+        return {field.decode(): _counter(value) for field, value in self.client.hgetall(self._key(key)).items()}
+
+    def acquire_lease(self, name, owner, ttl):
+        key = self._key(name)
+        if self.client.set(key, owner, nx=True, px=int(ttl * 1000)):
+            return True
+        current = self.client.get(key)
+        if current is not None and current.decode() == owner:
+            self.client.pexpire(key, int(ttl * 1000))
+            return True
+        return False
+
+def create_backend(url=None):
+    """Redis backend when a URL is configured, otherwise in-process.
+
+    A configured but unreachable Redis fails startup: falling back would give
+    each worker its own leases, ETag counters and caches.
+    """
+    if not url:
+        return InProcessBackend()
+    backend = RedisBackend(url)
+    try:
+        backend.client.ping()
+    except Exception as e:
+        raise ConnectionError(f"Redis backend unavailable at startup: {e}") from e
+    logger.info("Using Redis for shared caches and metrics")
+    return backend
+
+shared_backend = create_backend(Config.REDIS_URL)
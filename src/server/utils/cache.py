@@ -1,72 +1,210 @@
+from collections import OrderedDict
 from functools import lru_cache, wraps
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 import hashlib
 import json
+import logging
+import threading
+from .backends import shared_backend
+
+logger = logging.getLogger(__name__)
 
 class CacheManager:
-    def __init__(self):
-        self.sample_cache = {}
+    """Sample list cache kept in the shared backend, so every worker sees the same entries"""
+
+    def __init__(self, backend=None):
+        self.backend = backend or shared_backend
         self.cache_ttl = timedelta(minutes=1)
         
     def cache_key(self, prefix, *args, **kwargs):
         """Generate a unique cache key"""
         key_parts = [prefix, *args]
         key_parts.extend(f"{k}:{v}" for k, v in sorted(kwargs.items()))
-        return hashlib.md5(json.dumps(key_parts).encode()).hexdigest()
+        return f"samples:{hashlib.md5(json.dumps(key_parts).encode()).hexdigest()}"
     
     def invalidate_cache(self):
         """Clear all cached data"""
-        self.sample_cache.clear()
+        self.backend.delete_prefix('samples:')
     
     def cached_samples(self, status=None):
         def decorator(func):
             @wraps(func)
             def wrapper(*args, **kwargs):
                 key = self.cache_key('samples', status)
-                now = datetime.now()
-                
-                if key in self.sample_cache:
-                    cached_data, timestamp = self.sample_cache[key]
-                    if now - timestamp < self.cache_ttl:
-                        return cached_data
+                cached_data = self.backend.get(key)
+                if cached_data is not None:
+                    return cached_data
                 
                 result = func(*args, **kwargs)
-                self.sample_cache[key] = (result, now)
+                self.backend.set(key, result, ttl=self.cache_ttl.total_seconds())
                 return result
             return wrapper
         return decorator
 
-# Simple in-memory cache
-_cache = {}
+class SingleFlight:
+    """Coalesce concurrent calls for the same key into one execution.
+
+    The first caller runs the function; callers arriving while it is in
+    flight wait for and share its result (or exception).
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.shared = 0
+
+    def do(self, key, fn):
+        """Returns (result, shared) where shared is True for callers that waited"""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = {'event': threading.Event(), 'result': None, 'error': None}
+
+        if not leader:
+            self.shared += 1
+            call['event'].wait()
+            if call['error'] is not None:
+                raise call['error']
+            return call['result'], True
+
+        try:
+            call['result'] = fn()
+            return call['result'], False
+        except Exception as e:
+            call['error'] = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call['event'].set()
+
+class AnalysisCache:
+    """Analysis results keyed by dataset fingerprint, prompt version and model.
+
+    Entries are kept in a Mongo collection (with a TTL index on expires_at)
+    so they survive restarts and are shared between workers, plus a small
+    in-process LRU copy. The collection is capped at `max_entries` by
+    evicting the oldest entries. Without a bound collection it is
+    memory-only.
+    """
+
+    def __init__(self, ttl=timedelta(days=7), max_entries=500, memory_entries=32):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.memory_entries = memory_entries
+        self.collection = None
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def bind(self, collection):
+        # Its TTL and eviction indexes are created by the index registry (utils/indexes.py)
+        self.collection = collection
+        return self
+
+    @staticmethod
+    def key(fingerprint, prompt_version, model):
+        return hashlib.sha256(f"{fingerprint}:{prompt_version}:{model}".encode()).hexdigest()
+
+    def _remember(self, key, entry):
+        with self._lock:
+            self._memory[key] = entry
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_entries:
+                self._memory.popitem(last=False)
+
+    def _lookup(self, key):
+        now = datetime.now(timezone.utc)
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                self._memory.move_to_end(key)
+        if entry is None and self.collection is not None:
+            try:
+                entry = self.collection.find_one({'_id': key})
+            except Exception as e:
+                logger.error(f"Analysis cache read failed: {e}")
+            if entry is not None:
+                self._remember(key, entry)
+        if entry is None:
+            return None
+
+        expires_at = entry['expires_at']
+        if expires_at.tzinfo is None:
+            expires_at = expires_at.replace(tzinfo=timezone.utc)
+        if expires_at <= now:
+            with self._lock:
+                self._memory.pop(key, None)
+            return None
+        return entry
+
+    def get_entry(self, key):
+        entry = self._lookup(key)
+        if entry is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return entry
+
+    def get(self, key):
+        entry = self.get_entry(key)
+        return entry['content'] if entry else None
+
+    def set(self, key, content, **extra):
+        now = datetime.now(timezone.utc)
+        entry = {'_id': key, 'content': content, 'created_at': now,
+                 'expires_at': now + self.ttl, **extra}
+        self._remember(key, entry)
+        if self.collection is None:
+            return
+        try:
+            self.collection.replace_one({'_id': key}, entry, upsert=True)
+            overflow = self.collection.estimated_document_count() - self.max_entries
+            if overflow > 0:
+                oldest = self.collection.find({}, {'_id': 1}).sort('created_at', 1).limit(overflow)
+                self.collection.delete_many({'_id': {'$in': [doc['_id'] for doc in oldest]}})
+        except Exception as e:
+            logger.error(f"Analysis cache write failed: {e}")
+
+    def stats(self, flight=None):
+        total = self.hits + self.misses
+        stats = {
+            'memory_size': len(self._memory),
+            'memory_entries': self.memory_entries,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else None,
+        }
+        if flight is not None:
+            # Misses that waited on an identical in-flight call instead of going upstream
+            stats['coalesced'] = flight.shared
+        return stats
+
+analysis_cache = AnalysisCache()
+analysis_flight = SingleFlight()
+
+# /ai/chat answers: many analysts ask the same questions about the same sections
+chat_cache = AnalysisCache(ttl=timedelta(days=1), max_entries=5000, memory_entries=256)
+chat_flight = SingleFlight()
 
 def get_cached_analysis(key: str) -> str | None:
     """
     Get cached analysis result if it exists and is not expired
     """
-    if key not in _cache:
-        return None
-        
-    cached_item = _cache[key]
-    if datetime.now() - cached_item['timestamp'] > timedelta(minutes=5):
-        # Cache expired
-        del _cache[key]
-        return None
-        
-    return cached_item['content']
+    return analysis_cache.get(key)
 
 def cache_analysis(key: str, content: str) -> None:
     """
     Cache analysis result with timestamp
     """
-    _cache[key] = {
-        'content': content,
-        'timestamp': datetime.now()
-    }
+    analysis_cache.set(key, content)
 
-def generate_data_hash(data: list) -> str:
+def generate_data_hash(data) -> str:
     """
-    Generate a hash of the data to use as cache key
+    Generate a stable hash of the data to use as cache key
     """
-    return hash(json.dumps(data, sort_keys=True))
+    return hashlib.sha256(json.dumps(data, sort_keys=True, default=str).encode()).hexdigest()
 
 cache_manager = CacheManager() 
\ No newline at end of file
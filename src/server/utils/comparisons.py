@@ -0,0 +1,118 @@
+import logging
+import threading
+import warnings
+import numpy as np
+from scipy import stats
+from .statistics import VOC_FIELDS, VOC_PER_LITER_FIELDS
+from .snapshot import snapshot_manager
+
+logger = logging.getLogger(__name__)
+
+def compare_groups(values, group_a, group_b):
+    """Compare two groups of samples over every column of a samples x fields matrix.
+
+    NaN marks missing values. Returns a dict of per-field arrays with the
+    same definitions get_stat_details has always used: population standard
+    deviations, Cohen's d over the concatenated groups and a normal 95% CI
+    for group A.
+    """
+    a = values[group_a]
+    b = values[group_b]
+
+    with warnings.catch_warnings():
+        # Fields with no values in a group yield NaN rather than warnings
+        warnings.simplefilter('ignore')
+        mean_a, mean_b = np.nanmean(a, axis=0), np.nanmean(b, axis=0)
+        std_a, std_b = np.nanstd(a, axis=0), np.nanstd(b, axis=0)
+        combined_std = np.nanstd(np.concatenate([a, b]), axis=0)
+        t_stat, p_value = stats.ttest_ind(a, b, axis=0, nan_policy='omit')
+
+        return {
+            'n_a': (~np.isnan(a)).sum(axis=0),
+            'n_b': (~np.isnan(b)).sum(axis=0),
+            'mean_a': mean_a,
+            'mean_b': mean_b,
+            'median_a': np.nanmedian(a, axis=0),
+            'median_b': np.nanmedian(b, axis=0),
+            'std_a': std_a,
+            'std_b': std_b,
+            'min_a': np.nanmin(a, axis=0) if len(a) else np.full(values.shape[1], np.nan),
+            'max_a': np.nanmax(a, axis=0) if len(a) else np.full(values.shape[1], np.nan),
+            'min_b': np.nanmin(b, axis=0) if len(b) else np.full(values.shape[1], np.nan),
+            'max_b': np.nanmax(b, axis=0) if len(b) else np.full(values.shape[1], np.nan),
+            't_stat': np.asarray(t_stat, dtype=float),
+            'p_value': np.asarray(p_value, dtype=float),
+            'cohens_d': (mean_a - mean_b) / combined_std,
+            'ci_low_a': mean_a - 1.96 * std_a,
+            'ci_high_a': mean_a + 1.96 * std_a,
+        }
+
+class ComparisonTable:
+    """Positive vs negative comparison for every field, computed once per snapshot version"""
+
+    def __init__(self, snapshot, fields):
+        self.version = snapshot.version
+        self.fields = list(fields)
+        results = compare_groups(snapshot.matrix(self.fields), snapshot.positive, snapshot.negative)
+        self.rows = {
+            field: {name: float(column[i]) for name, column in results.items()}
+            for i, field in enumerate(self.fields)
+        }
+
+    def lookup(self, field):
+        return self.rows.get(field)
+
+def compare_field(snapshot, field):
+    """Comparison row for a field that is not in the precomputed table.
+
+    The field name comes from the client, so its column is not kept on the snapshot.
+    """
+    results = compare_groups(snapshot.column(field, keep=False)[:, None], snapshot.positive, snapshot.negative)
+    return {name: float(column[0]) for name, column in results.items()}
+
+class ComparisonStore:
+    """Serves the comparison table for the current snapshot and rebuilds it in the background.
+
+    Subscribed to the snapshot manager, so a new table starts building as
+    soon as the analyzed collection changes. Until it is ready, lookups for
+    the new version are computed on demand.
+    """
+
+    def __init__(self, fields):
+        self.fields = list(fields)
+        self.table = None
+        self._building = None
+        self._lock = threading.Lock()
+
+    def rebuild(self, snapshot):
+        with self._lock:
+            if self._building == snapshot.version or (self.table and self.table.version == snapshot.version):
+                return
+            self._building = snapshot.version
+        threading.Thread(target=self._build, args=(snapshot,), daemon=True).start()
+
+    def _build(self, snapshot):
+        try:
+            table = ComparisonTable(snapshot, self.fields)
+            with self._lock:
+                if self._building == snapshot.version:
+                    self.table = table
+                    self._building = None
+            logger.info(f"Rebuilt VOC comparison table for version {snapshot.version}")
+        except Exception as e:
+            logger.error(f"Failed to rebuild VOC comparison table: {e}")
+            with self._lock:
+                self._building = None
+
+    def lookup(self, snapshot, field):
+        table = self.table
+        if table is not None and table.version == snapshot.version:
+            row = table.lookup(field)
+            if row is not None:
+                return row
+        else:
+            self.rebuild(snapshot)
+        return compare_field(snapshot, field)
+
+comparison_store = ComparisonStore(VOC_FIELDS + VOC_PER_LITER_FIELDS)
+snapshot_manager.subscribe(comparison_store.rebuild)
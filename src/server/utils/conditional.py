@@ -0,0 +1,157 @@
+import gzip
+import hashlib
+import logging
+import time
+from functools import wraps
+from flask import make_response, request
+from .backends import shared_backend
+from .statistics import collection_version, refresh_epoch
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - gzip only
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+MIN_COMPRESS_SIZE = 1024
+COMPRESSIBLE_TYPES = ('application/json', 'application/x-ndjson', 'text/')
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 4
+ENCODINGS = ('br', 'gzip') if brotli else ('gzip',)
+
+class DatasetVersions:
+    """Cheap version numbers for the datasets behind the polled read endpoints.
+
+    Each dataset has a generation counter in the shared backend, bumped by
+    every write this app makes and by the sample feed for writes made
+    elsewhere. Reading it is one backend lookup, so a matching ETag is
+    answered without Mongo. Datasets written only by other systems can be
+    probed instead: the collection's collection_version marker (which moves
+    on inserts, deletes and stamped edits) is cached for `ttl` seconds and
+    folded into the version. With `max_age` the current refresh_epoch is
+    folded in too, so unstamped edits show up when readers such as the
+    statistics engine rebuild.
+    """
+
+    def __init__(self, backend=None):
+        self.backend = backend or shared_backend
+        self.probes = {}
+
+    def _key(self, name):
+        return f"dataset:{name}"
+
+    def probe(self, name, collection, ttl=10, max_age=None):
+        self.probes[name] = (collection, ttl, max_age)
+        return self
+
+    def bump(self, name):
+        try:
+            self.backend.incr(self._key(name))
+        except Exception as e:
+            # A missed bump only means clients refetch on the next one
+            logger.error(f"Failed to bump {name} version: {e}")
+
+    def generation(self, name):
+        generation = self.backend.get(self._key(name))
+        if generation is None:
+            # Seed from the clock so a restarted in-process backend never
+            # reissues ETags from before the restart
+            generation = self.backend.incr(self._key(name), int(time.time() * 1000))
+        return generation
+
+    def current(self, name):
+        version = str(self.generation(name))
+        if name in self.probes:
+            collection, ttl, max_age = self.probes[name]
+            marker = self.backend.get(f"{self._key(name)}:probe")
+            if marker is None:
+                marker = hashlib.md5(str(collection_version(collection)).encode()).hexdigest()[:12]
+                self.backend.set(f"{self._key(name)}:probe", marker, ttl=ttl)
+            version = f"{version}.{marker}"
+            if max_age:
+                version = f"{version}.{refresh_epoch(max_age)}"
+        return version
+
+def etag_for(dataset, version):
+    """Strong ETag for this representation: dataset version plus endpoint and query string"""
+    variant = hashlib.md5(request.full_path.encode()).hexdigest()[:12]
+    return f"{dataset}-{version}-{variant}"
+
+def _requested_etags():
+    # Compressed representations carry an -<encoding> suffix; they share the base ETag
+    tags = set()
+    for tag in request.if_none_match.as_set(include_weak=True):
+        base, _, encoding = tag.rpartition('-')
+        tags.add(base if encoding in ENCODINGS else tag)
+    return tags
+
+def conditional(dataset):
+    """Answer GETs whose If-None-Match holds the current ETag with 304 before the view runs"""
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            if request.method != 'GET':
+                return f(*args, **kwargs)
+
+            try:
+                etag = etag_for(dataset, dataset_versions.current(dataset))
+            except Exception as e:
+                logger.error(f"Failed to read {dataset} version: {e}")
+                return f(*args, **kwargs)
+
+            if request.if_none_match.star_tag or etag in _requested_etags():
+                response = make_response('', 304)
+                response.vary.add('Accept-Encoding')
+            else:
+                response = make_response(f(*args, **kwargs))
+                if response.status_code != 200 or 'no-store' in response.headers.get('Cache-Control', ''):
+                    return response
+            response.set_etag(etag)
+            response.headers['Cache-Control'] = 'no-cache'
+            return response
+        return decorated_function
+    return decorator
+
+def negotiate_encoding(accept_encoding):
+    """Best supported encoding in an Accept-Encoding header, or None"""
+    offered = {}
+    for part in accept_encoding.split(','):
+        name, _, params = part.strip().partition(';')
+        quality = 1.0
+        if params.strip().startswith('q='):
+            try:
+                quality = float(params.strip()[2:])
+            except ValueError:
+                continue
+        offered[name.strip().lower()] = quality
+    for encoding in ENCODINGS:
+        if offered.get(encoding, offered.get('*', 0)) > 0:
+            return encoding
+    return None
+
+def compress_response(response):
+    """Compress large buffered text responses; streamed and already encoded bodies pass through"""
+    if (response.status_code != 200 or response.direct_passthrough or response.is_streamed
+            or 'Content-Encoding' in response.headers
+            or not (response.mimetype or '').startswith(COMPRESSIBLE_TYPES)):
+        return response
+
+    response.vary.add('Accept-Encoding')
+    encoding = negotiate_encoding(request.headers.get('Accept-Encoding', ''))
+    body = response.get_data()
+    if encoding is None or len(body) < MIN_COMPRESS_SIZE:
+        return response
+
+    if encoding == 'br':
+        response.set_data(brotli.compress(body, quality=BROTLI_QUALITY))
+    else:
+        response.set_data(gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0))
+    response.headers['Content-Encoding'] = encoding
+
+    etag, weak = response.get_etag()
+    if etag:
+        response.set_etag(f"{etag}-{encoding}", weak=weak)
+    return response
+
+dataset_versions = DatasetVersions()
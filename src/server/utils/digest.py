@@ -0,0 +1,107 @@
+import json
+import logging
+import numpy as np
+from .comparisons import compare_groups
+from .helpers import calculate_statistics_matrix
+from .statistics import VOC_FIELDS, VOC_PER_LITER_FIELDS
+
+logger = logging.getLogger(__name__)
+
+CO2_OPTIMAL_RANGE = (2.0, 5.0)
+
+def _round(value, digits=4):
+    """Round to significant digits; NaN/inf become None so the digest stays valid JSON"""
+    value = float(value)
+    if not np.isfinite(value):
+        return None
+    return float(f"{value:.{digits}g}")
+
+def _group_summary(stats):
+    if not stats:
+        return None
+    return {
+        'n': stats['sample_count'],
+        'mean': _round(stats['mean']),
+        'median': _round(stats['median']),
+        'q1': _round(stats['q1']),
+        'q3': _round(stats['q3']),
+        'min': _round(stats['range']['min']),
+        'max': _round(stats['range']['max']),
+    }
+
+def build_analysis_digest(snapshot, keep):
+    """Fixed-size statistical digest of the analyzed samples selected by `keep`.
+
+    Its size depends on the number of fields and categories, not on the
+    number of samples, so the ai_analysis prompt stays roughly constant as
+    the study grows.
+    """
+    positive = snapshot.positive & keep
+    negative = snapshot.negative & keep
+    fields = VOC_FIELDS + VOC_PER_LITER_FIELDS
+    values = snapshot.matrix(fields)
+
+    # Missing fields count as 0 in the group statistics, as in /statistics_summary
+    statistics_values = snapshot.statistics_matrix(fields)
+    positive_stats = calculate_statistics_matrix(statistics_values[positive], fields)
+    negative_stats = calculate_statistics_matrix(statistics_values[negative], fields)
+    comparison = compare_groups(values, positive, negative)
+
+    voc_profiles = {}
+    for i, field in enumerate(fields):
+        voc_profiles[field] = {
+            'positive': _group_summary(positive_stats[field]),
+            'negative': _group_summary(negative_stats[field]),
+            't_stat': _round(comparison['t_stat'][i]),
+            'p_value': _round(comparison['p_value'][i]),
+            'cohens_d': _round(comparison['cohens_d'][i]),
+        }
+
+    lung_rads = snapshot.lung_rads[keep]
+    co2 = snapshot.column('average_co2')[keep]
+    measured_co2 = co2[~np.isnan(co2)]
+    low, high = CO2_OPTIMAL_RANGE
+    volume_fields = ['average_co2', 'final_volume']
+    volume_stats = calculate_statistics_matrix(snapshot.statistics_matrix(volume_fields)[keep], volume_fields)
+
+    return {
+        'samples': {
+            'total': int(keep.sum()),
+            'excluded_as_outliers': int(snapshot.size - keep.sum()),
+            'positive': int(positive.sum()),
+            'negative': int(negative.sum()),
+            'labelled_positive': int((snapshot.labelled_positive & keep).sum()),
+            'labelled_negative': int((snapshot.labelled_negative & keep).sum()),
+            'collection_period': [str(snapshot.period[0]), str(snapshot.period[1])],
+        },
+        'lung_rads': {str(score): int((lung_rads == score).sum()) for score in (0, 1, 2, 3, 4)},
+        'histology_positive': snapshot.category_counts(snapshot.histology, snapshot.histology_categories, positive),
+        'stage_positive': snapshot.category_counts(snapshot.stage, snapshot.stage_categories, positive),
+        'voc_profiles': voc_profiles,
+        'co2_quality': {
+            'optimal_range_percent': list(CO2_OPTIMAL_RANGE),
+            'below_range': int((measured_co2 < low).sum()),
+            'within_range': int(((measured_co2 >= low) & (measured_co2 <= high)).sum()),
+            'above_range': int((measured_co2 > high).sum()),
+            'missing': int(len(co2) - len(measured_co2)),
+        },
+        'collection': {
+            'average_co2': _group_summary(volume_stats['average_co2']),
+            'final_volume': _group_summary(volume_stats['final_volume']),
+        },
+    }
+
+def count_tokens(text, model="gpt-4o"):
+    """Token count via tiktoken when installed, otherwise the ~4 characters per token estimate"""
+    try:
+        import tiktoken
+        try:
+            encoding = tiktoken.encoding_for_model(model)
+        except KeyError:
+            encoding = tiktoken.get_encoding("o200k_base")
+        return len(encoding.encode(text))
+    except ImportError:
+        return len(text) // 4
+
+def digest_message(digest):
+    return f"Data summary (pre-aggregated statistics): {json.dumps(digest, separators=(',', ':'))}"
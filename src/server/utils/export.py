@@ -0,0 +1,99 @@
+import csv
+import logging
+import os
+import tempfile
+import zlib
+from datetime import datetime
+from io import StringIO
+
+logger = logging.getLogger(__name__)
+
+EXPORT_HEADERS = ['Date', 'Chip ID', 'Patient ID', 'Sample Type',
+                  'Batch', 'Mfg. Date', 'Final Volume (mL)',
+                  'Avg. CO2 (%)', 'Error Code']
+EXPORT_PROJECTION = {"_id": 0, "timestamp": 1, "chip_id": 1, "patient_id": 1,
+                     "sample_type": 1, "batch_number": 1, "mfg_date": 1,
+                     "final_volume": 1, "average_co2": 1, "error": 1}
+BATCH_SIZE = 1000
+
+def format_date(value):
+    """Format a stored date as MM/DD/YY without a full ISO parse in the common case"""
+    if isinstance(value, datetime):
+        return value.strftime('%m/%d/%y')
+    value = str(value)
+    if len(value) >= 10 and value[4] == '-' and value[7] == '-' and value[:4].isdigit():
+        return f"{value[5:7]}/{value[8:10]}/{value[2:4]}"
+    return datetime.fromisoformat(value.replace('Z', '+00:00')).strftime('%m/%d/%y')
+
+def export_rows(samples):
+    """Yield one export row per sample, skipping samples that cannot be formatted"""
+    for sample in samples:
+        try:
+            mfg_date = sample.get('mfg_date')
+            yield [
+                format_date(sample['timestamp']),
+                sample.get('chip_id', 'N/A'),
+                sample.get('patient_id', 'N/A'),
+                sample.get('sample_type', 'N/A'),
+                sample.get('batch_number', 'N/A'),
+                format_date(mfg_date) if mfg_date else 'N/A',
+                f"{sample.get('final_volume', 'N/A')}",
+                f"{sample.get('average_co2', 'N/A')}",
+                sample.get('error', 'N/A')
+            ]
+        except Exception as e:
+            logger.error(f"Error processing sample {sample.get('chip_id')}: {str(e)}")
+            continue
+
+def stream_csv(rows, batch_size=BATCH_SIZE, compress=False):
+    """Yield the CSV export in chunks of `batch_size` rows, optionally as a gzip stream"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None
+    buffer = StringIO()
+    writer = csv.writer(buffer)
+
+    def flush():
+        chunk = buffer.getvalue().encode('utf-8')
+        buffer.seek(0)
+        buffer.truncate()
+        return compressor.compress(chunk) if compressor else chunk
+
+    writer.writerow(EXPORT_HEADERS)
+    for count, row in enumerate(rows, 1):
+        writer.writerow(row)
+        if count % batch_size == 0:
+            chunk = flush()
+            if chunk:
+                yield chunk
+
+    chunk = flush()
+    if compressor:
+        chunk += compressor.flush()
+    if chunk:
+        yield chunk
+
+def stream_xlsx(rows, chunk_size=64 * 1024):
+    """Yield an XLSX export built with a write-only worksheet.
+
+    Write-only worksheets spool rows to a temporary file instead of keeping
+    cells in memory; the finished workbook is then streamed from disk.
+    """
+    from openpyxl import Workbook
+
+    workbook = Workbook(write_only=True)
+    worksheet = workbook.create_sheet('Completed Samples')
+    worksheet.append(EXPORT_HEADERS)
+    for row in rows:
+        worksheet.append(row)
+
+    fd, path = tempfile.mkstemp(suffix='.xlsx')
+    os.close(fd)
+    try:
+        workbook.save(path)
+        with open(path, 'rb') as f:
+            while True:
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+    finally:
+        os.remove(path)
@@ -7,6 +7,8 @@ import gzip
 from src.server.config import Config
 from flask import current_app
 import numpy as np
+import warnings
+from functools import lru_cache
 
 def send_email(subject, body):
     with current_app.app_context():
@@ -20,8 +22,13 @@ def send_email(subject, body):
         except Exception as e:
             print(f"Failed to send email: {e}")
 
+@lru_cache(maxsize=1)
+def get_twilio_client():
+    """Shared Twilio client so its HTTP session is reused across messages"""
+    return Client(Config.TWILIO_ACCOUNT_SID, Config.TWILIO_AUTH_TOKEN)
+
 def send_sms(to_numbers, message_body):
-    twilio_client = Client(Config.TWILIO_ACCOUNT_SID, Config.TWILIO_AUTH_TOKEN)
+    twilio_client = get_twilio_client()
     for number in to_numbers:
         try:
             message = twilio_client.messages.create(
@@ -66,53 +73,66 @@ def backup_database(collection, bucket):
         print(f"Database backup failed: {str(e)}")
         return False 
 
-def calculate_statistics(samples, fields):
-    """Calculate mean, median, and range for specified fields, excluding outliers and negative values"""
-    
+def calculate_statistics_matrix(values, fields):
+    """Batch version of calculate_statistics over a samples x fields matrix.
+
+    NaN values are skipped, so callers following calculate_statistics pass
+    missing fields as 0 and unparseable ones as NaN. Negative values are
+    excluded, then outliers outside 1.5 * IQR are removed per field, all
+    fields in one pass.
+    """
+    values = np.array(values, dtype=float, ndmin=2)
+    if values.shape[0] == 0:
+        return {field: None for field in fields}
+    values[values < 0] = np.nan
+    present = ~np.isnan(values)
+    original_counts = present.sum(axis=0)
+
+    with warnings.catch_warnings():
+        # Fields without any usable value produce all-NaN columns
+        warnings.simplefilter('ignore', RuntimeWarning)
+        q1, q3 = np.nanpercentile(values, [25, 75], axis=0)
+        iqr = q3 - q1
+        keep = (values >= q1 - 1.5 * iqr) & (values <= q3 + 1.5 * iqr)
+        filtered = np.where(keep, values, np.nan)
+
+        counts = keep.sum(axis=0)
+        means = np.nanmean(filtered, axis=0)
+        medians = np.nanmedian(filtered, axis=0)
+        minimums = np.nanmin(filtered, axis=0)
+        maximums = np.nanmax(filtered, axis=0)
+
     stats = {}
-    for field in fields:
-        # Convert values to float and filter out negative values
-        values = []
-        for sample in samples:
-            try:
-                value = float(sample.get(field, 0))
-                if value >= 0:  # Exclude negative values
-                    values.append(value)
-            except (ValueError, TypeError):
-                continue
-                
-        if values:
-            # Calculate quartiles for outlier detection
-            values = np.array(values)
-            q1 = np.percentile(values, 25)
-            q3 = np.percentile(values, 75)
-            iqr = q3 - q1
-            
-            # Define outlier bounds (1.5 * IQR method)
-            lower_bound = q1 - 1.5 * iqr
-            upper_bound = q3 + 1.5 * iqr
-            
-            # Filter out outliers
-            filtered_values = values[(values >= lower_bound) & (values <= upper_bound)]
-            
-            if len(filtered_values) > 0:
-                stats[field] = {
-                    'mean': float(np.mean(filtered_values)),
-                    'median': float(np.median(filtered_values)),
-                    'range': {
-                        'min': float(min(filtered_values)),
-                        'max': float(max(filtered_values))
-                    },
-                    'sample_count': int(len(filtered_values)),
-                    'original_count': int(len(values)),
-                    'outliers_removed': int(len(values) - len(filtered_values))
-                }
-            else:
-                stats[field] = None
-        else:
+    for i, field in enumerate(fields):
+        if counts[i] == 0:
             stats[field] = None
-            
-    return stats 
+            continue
+        stats[field] = {
+            'mean': float(means[i]),
+            'median': float(medians[i]),
+            'range': {
+                'min': float(minimums[i]),
+                'max': float(maximums[i])
+            },
+            'q1': float(q1[i]),
+            'q3': float(q3[i]),
+            'sample_count': int(counts[i]),
+            'original_count': int(original_counts[i]),
+            'outliers_removed': int(original_counts[i] - counts[i])
+        }
+    return stats
+
+def _statistic_value(sample, field):
+    try:
+        return float(sample.get(field, 0))
+    except (ValueError, TypeError):
+        return np.nan
+
+def calculate_statistics(samples, fields):
+    """Calculate mean, median, and range for specified fields, excluding outliers and negative values"""
+    values = np.array([[_statistic_value(sample, field) for field in fields] for sample in samples],
+                      dtype=float).reshape(len(samples), len(fields))
+    return calculate_statistics_matrix(values, fields)
 
 def convert_sample(sample):
     """Convert sample data to appropriate types and handle special MongoDB types."""
@@ -138,5 +158,5 @@ def convert_sample(sample):
     elif isinstance(sample, Decimal128):
         return float(sample.to_decimal())
     elif isinstance(sample, datetime):
-        return value.isoformat()
+        return sample.isoformat()
     return sample
\ No newline at end of file
@@ -0,0 +1,141 @@
+import logging
+from pymongo import IndexModel
+from pymongo.errors import PyMongoError
+
+logger = logging.getLogger(__name__)
+
+# AnalysisCache collections (AI analyses and chat answers); names are the
+# ones create_index gave these indexes before they were declared here
+CACHE_INDEXES = [
+    {'name': 'expires_at_1', 'keys': [('expires_at', 1)], 'expireAfterSeconds': 0},
+    # Oldest entries are evicted past max_entries
+    {'name': 'created_at_1', 'keys': [('created_at', 1)]},
+]
+
+# Indexes the application relies on, by collection role. Collection names
+# come from Config, so roles are mapped to live collections at startup.
+INDEXES = {
+    'samples': [
+        # update_sample, update_patient_info, upload_document_metadata, update_sample_pickup
+        {'name': 'chip_id_unique', 'keys': [('chip_id', 1)], 'unique': True},
+        # get_samples / get_completed_samples: status filter, newest-first keyset order
+        {'name': 'status_timestamp', 'keys': [('status', 1), ('timestamp', -1), ('chip_id', -1)]},
+        # Completion scheduler recovery and update_expired_samples
+        {'name': 'status_expected_completion', 'keys': [('status', 1), ('expected_completion_time', 1)]},
+        # Sample feed polling fallback
+        {'name': 'updated_at', 'keys': [('updated_at', 1)]},
+    ],
+    'analyzed': [
+        {'name': 'timestamp', 'keys': [('timestamp', 1)]},
+        # Newest edit stamp for collection_version
+        {'name': 'updated_at', 'keys': [('updated_at', 1)]},
+    ],
+    'notification_outbox': [
+        {'name': 'status_next_attempt', 'keys': [('status', 1), ('next_attempt_at', 1)]},
+    ],
+    'jobs': [
+        # Dispatcher claims, stale-job recovery and queue depth
+        {'name': 'status_created', 'keys': [('status', 1), ('created_at', 1)]},
+        # One queued or running job per kind and params; finished jobs drop the key
+        {'name': 'active_key_unique', 'keys': [('active_key', 1)], 'unique': True, 'sparse': True},
+        # Finished jobs are removed once their result has been kept long enough
+        {'name': 'expires_at_ttl', 'keys': [('expires_at', 1)], 'expireAfterSeconds': 0},
+    ],
+    'analysis_cache': CACHE_INDEXES,
+    'chat_cache': CACHE_INDEXES,
+}
+
+def _options(spec):
+    return {key: value for key, value in spec.items() if key not in ('name', 'keys')}
+
+def index_drift(collection, specs):
+    """Compare declared indexes with the live collection.
+
+    missing: declared but absent; different: same name, other keys or
+    options; extra: present but not declared (apart from _id_).
+    """
+    live = collection.index_information()
+    declared = {spec['name'] for spec in specs}
+    drift = {'missing': [], 'different': [], 'extra': []}
+
+    for spec in specs:
+        actual = live.get(spec['name'])
+        if actual is None:
+            drift['missing'].append(spec['name'])
+            continue
+        expected_keys = [tuple(key) for key in spec['keys']]
+        actual_keys = [(field, int(direction)) for field, direction in actual['key']]
+        mismatched = {option: actual.get(option, False) for option, value in _options(spec).items()
+                      if actual.get(option, False) != value}
+        if actual_keys != expected_keys or mismatched:
+            drift['different'].append({
+                'name': spec['name'],
+                'expected': {'keys': expected_keys, **_options(spec)},
+                'actual': {'keys': actual_keys, **mismatched},
+            })
+
+    drift['extra'] = sorted(name for name in live if name != '_id_' and name not in declared)
+    return drift
+
+class IndexRegistry:
+    """Creates the declared indexes at startup and reports drift against the live collections.
+
+    Missing indexes are created; indexes whose definition differs are only
+    reported, since replacing them means dropping an index in production.
+    """
+
+    def __init__(self, specs=INDEXES):
+        self.specs = specs
+        self.collections = {}
+        self.created = {}
+        self.errors = {}
+
+    def ensure(self, collections):
+        """collections maps a role in `specs` to its live collection.
+
+        Each missing index is created on its own, so one that cannot be
+        built (e.g. chip_id_unique over duplicate chip_ids) does not keep
+        the others from being created. Failures are kept per index name.
+        """
+        self.collections = dict(collections)
+        for role, collection in self.collections.items():
+            specs = self.specs.get(role, [])
+            created, errors = [], {}
+            try:
+                missing = set(index_drift(collection, specs)['missing'])
+            except PyMongoError as e:
+                self.errors[role] = {'*': str(e)}
+                logger.error(f"Failed to read indexes on {collection.name}: {e}")
+                continue
+            for spec in specs:
+                if spec['name'] not in missing:
+                    continue
+                model = IndexModel(spec['keys'], name=spec['name'], **_options(spec))
+                try:
+                    created += collection.create_indexes([model])
+                except PyMongoError as e:
+                    errors[spec['name']] = str(e)
+                    logger.error(f"Failed to create index {spec['name']} on {collection.name}: {e}")
+            self.created[role] = created
+            if errors:
+                self.errors[role] = errors
+            if created:
+                logger.info(f"Created indexes on {collection.name}: {', '.join(created)}")
+        return self
+
+    def report(self):
+        report = {}
+        for role, collection in self.collections.items():
+            try:
+                drift = index_drift(collection, self.specs.get(role, []))
+            except PyMongoError as e:
+                drift = {'error': str(e)}
+            report[role] = {
+                'collection': collection.name,
+                'created': self.created.get(role, []),
+                'errors': self.errors.get(role, {}),
+                **drift,
+            }
+        return report
+
+index_registry = IndexRegistry()
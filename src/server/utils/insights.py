@@ -0,0 +1,81 @@
+import re
+
+KEY_FINDING = '**Key Finding:**'
+STATISTICAL_DETAILS = '**Statistical Details:**'
+ANALYSIS = '**Analysis:**'
+
+def section_id(title):
+    """URL-safe id for a section title, e.g. "VOC Profile Analysis" -> "voc-profile-analysis" """
+    return re.sub(r'[^a-z0-9]+', '-', title.lower()).strip('-')
+
+def _strip_markup(text):
+    return re.sub(r'\*\*(.+?)\*\*', r'\1', text).strip()
+
+def _new_section(title):
+    return {'id': section_id(title), 'title': title, 'keyFinding': '', 'stats': [], 'analysis': '', 'content': []}
+
+def parse_insights(text):
+    """Split an ai_analysis completion into sections.
+
+    Follows the format the system prompt asks for: a `###` heading, then
+    `**Key Finding:**`, `**Statistical Details:**` with `- label: value`
+    bullets, and `**Analysis:**` paragraphs. Each section has the same
+    fields the insights modal builds client-side (title, keyFinding,
+    stats, analysis, content) plus an `id` for per-section requests.
+    Text before the first heading is dropped, as the client does.
+    """
+    sections = []
+    current = None
+    block = None
+
+    for raw_line in (text or '').splitlines():
+        line = raw_line.strip()
+        if not line:
+            continue
+        if line.startswith('###'):
+            current = _new_section(line.lstrip('#').strip())
+            sections.append(current)
+            block = None
+            continue
+        if current is None:
+            continue
+
+        if line.startswith(KEY_FINDING):
+            current['keyFinding'] = line[len(KEY_FINDING):].strip()
+            block = 'keyFinding'
+        elif line.startswith(STATISTICAL_DETAILS):
+            block = 'stats'
+        elif line.startswith(ANALYSIS):
+            block = 'analysis'
+            rest = line[len(ANALYSIS):].strip()
+            if rest:
+                current['analysis'] = rest
+                current['content'].append(rest)
+        elif line.startswith(('-', '*')) and block == 'stats':
+            # "- label: value", with the label often bold ("**label**:" or "**label:**")
+            label, _, value = _strip_markup(line[1:]).partition(':')
+            if label.strip() and value.strip():
+                current['stats'].append({'label': label.strip(), 'value': value.strip()})
+        elif not line.startswith('**'):
+            if block == 'keyFinding' and not current['analysis']:
+                # A key finding that wraps onto the next line
+                current['keyFinding'] = f"{current['keyFinding']} {line}".strip()
+                continue
+            current['analysis'] = f"{current['analysis']} {line}".strip()
+            current['content'].append(line)
+
+    return sections
+
+def find_section(sections, wanted):
+    """Section by id, title (case-insensitive) or position"""
+    for section in sections:
+        if section['id'] == wanted or section['title'].lower() == wanted.lower():
+            return section
+    if wanted.isdigit() and int(wanted) < len(sections):
+        return sections[int(wanted)]
+    return None
+
+def section_index(sections):
+    """What a client needs to list the sections without their bodies"""
+    return [{'id': section['id'], 'title': section['title'], 'keyFinding': section['keyFinding']}
+            for section in sections]
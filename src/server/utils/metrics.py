@@ -0,0 +1,159 @@
+import bisect
+import time
+from flask import g, has_request_context
+from pymongo import monitoring
+
+# Fixed log-spaced bucket upper bounds in ms: 0.25ms to ~2 minutes, each sqrt(2)
+# wider than the last, so quantiles are within ~20% at any scale
+LATENCY_BUCKETS = [round(0.25 * 2 ** (i / 2), 3) for i in range(38)]
+
+def bucket_index(value_ms):
+    """Index of the bucket holding value_ms; len(LATENCY_BUCKETS) is the overflow bucket"""
+    return bisect.bisect_left(LATENCY_BUCKETS, value_ms)
+
+def histogram_quantile(counts, q):
+    """Estimate a quantile from bucket counts, interpolating linearly within the bucket"""
+    total = sum(counts)
+    if not total:
+        return None
+    rank = q * total
+    seen = 0
+    for i, count in enumerate(counts):
+        if count and seen + count >= rank:
+            lower = LATENCY_BUCKETS[i - 1] if i > 0 else 0.0
+            upper = LATENCY_BUCKETS[i] if i < len(LATENCY_BUCKETS) else LATENCY_BUCKETS[-1]
+            return lower + (upper - lower) * (rank - seen) / count
+        seen += count
+    return LATENCY_BUCKETS[-1]
+
+class MongoTimer(monitoring.CommandListener):
+    """Adds the duration of every Mongo command run inside a request to g.mongo_ms"""
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        self._add(event)
+
+    def failed(self, event):
+        self._add(event)
+
+    def _add(self, event):
+        if has_request_context():
+            g.mongo_ms = g.get('mongo_ms', 0.0) + event.duration_micros / 1000
+            g.mongo_commands = g.get('mongo_commands', 0) + 1
+
+mongo_timer = MongoTimer()
+
+class RouteMetrics:
+    """Per-route request counters and latency histograms in one backend counter hash.
+
+    Fields are "<METHOD> <rule>|<name>", so a request costs a single hincr
+    and all workers sharing a backend add up to one set of histograms.
+    """
+
+    KEY = 'metrics:routes'
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    def record(self, route, status, duration_ms, mongo_ms, bytes_out):
+        self.backend.hincr(self.KEY, {
+            f"{route}|requests": 1,
+            f"{route}|status:{status}": 1,
+            f"{route}|bytes": int(bytes_out),
+            f"{route}|duration_ms": float(duration_ms),
+            f"{route}|mongo_ms": float(mongo_ms),
+            f"{route}|latency:{bucket_index(duration_ms)}": 1,
+            f"{route}|mongo:{bucket_index(mongo_ms)}": 1,
+        })
+
+    def _routes(self):
+        routes = {}
+        for field, value in self.backend.hgetall(self.KEY).items():
+            route, name = field.rsplit('|', 1)
+            entry = routes.setdefault(route, {
+                'status': {},
+                'latency': [0] * (len(LATENCY_BUCKETS) + 1),
+                'mongo': [0] * (len(LATENCY_BUCKETS) + 1),
+            })
+            if ':' in name:
+                kind, label = name.split(':', 1)
+                if kind == 'status':
+                    entry['status'][label] = int(value)
+                else:
+                    entry[kind][int(label)] = int(value)
+            else:
+                entry[name] = value
+        return routes
+
+    def summary(self):
+        """p50/p95/p99 latency, status counts, bytes out and Mongo vs handler time per route"""
+        summary = {}
+        for route, entry in sorted(self._routes().items()):
+            requests = int(entry.get('requests', 0))
+            if not requests:
+                continue
+            duration_ms = entry.get('duration_ms', 0.0)
+            mongo_ms = entry.get('mongo_ms', 0.0)
+            summary[route] = {
+                'requests': requests,
+                'status': entry['status'],
+                'bytes_out': int(entry.get('bytes', 0)),
+                'latency_ms': {
+                    'mean': duration_ms / requests,
+                    'p50': histogram_quantile(entry['latency'], 0.50),
+                    'p95': histogram_quantile(entry['latency'], 0.95),
+                    'p99': histogram_quantile(entry['latency'], 0.99),
+                },
+                'mongo_ms': {
+                    'mean': mongo_ms / requests,
+                    'p95': histogram_quantile(entry['mongo'], 0.95),
+                },
+                'handler_ms': {'mean': (duration_ms - mongo_ms) / requests},
+                'total_time_ms': duration_ms,
+            }
+        return summary
+
+    def prometheus(self, prefix='onebreath'):
+        """Prometheus text exposition format (version 0.0.4)"""
+        lines = [
+            f"# HELP {prefix}_http_requests_total Requests by route and status code.",
+            f"# TYPE {prefix}_http_requests_total counter",
+        ]
+        routes = sorted(self._routes().items())
+        labels = {}
+        for route, entry in routes:
+            method, rule = route.split(' ', 1)
+            labels[route] = f'method="{method}",route="{rule}"'
+            for status, count in sorted(entry['status'].items()):
+                lines.append(f'{prefix}_http_requests_total{{{labels[route]},status="{status}"}} {count}')
+
+        lines += [
+            f"# HELP {prefix}_http_request_duration_seconds Request latency by route.",
+            f"# TYPE {prefix}_http_request_duration_seconds histogram",
+        ]
+        for route, entry in routes:
+            cumulative = 0
+            for bound, count in zip(LATENCY_BUCKETS + ['+Inf'], entry['latency']):
+                cumulative += count
+                le = bound if bound == '+Inf' else f"{bound / 1000:g}"
+                lines.append(f'{prefix}_http_request_duration_seconds_bucket{{{labels[route]},le="{le}"}} {cumulative}')
+            lines.append(f'{prefix}_http_request_duration_seconds_sum{{{labels[route]}}} {entry.get("duration_ms", 0.0) / 1000:g}')
+            lines.append(f'{prefix}_http_request_duration_seconds_count{{{labels[route]}}} {int(entry.get("requests", 0))}')
+
+        for name, field, help_text in (
+            ('http_mongo_seconds_total', 'mongo_ms', 'Time spent in Mongo commands by route.'),
+            ('http_response_bytes_total', 'bytes', 'Response bytes sent by route.'),
+        ):
+            lines += [f"# HELP {prefix}_{name} {help_text}", f"# TYPE {prefix}_{name} counter"]
+            for route, entry in routes:
+                value = entry.get(field, 0)
+                value = value / 1000 if field == 'mongo_ms' else int(value)
+                lines.append(f'{prefix}_{name}{{{labels[route]}}} {value:g}')
+        return '\n'.join(lines) + '\n'
+
+def request_timer_start():
+    g.request_started = time.perf_counter()
+    g.mongo_ms = 0.0
+    g.mongo_commands = 0
@@ -2,6 +2,8 @@ from pymongo import MongoClient, ReadPreference
 from pymongo.errors import ConnectionFailure
 import logging
 from functools import lru_cache
+from .metrics import mongo_timer
+from .profiler import query_profiler
 
 logger = logging.getLogger(__name__)
 
@@ -19,7 +21,8 @@ def create_mongo_client(uri):
         retryWrites=True,
         read_preference=ReadPreference.PRIMARY,
         w='majority',
-        journal=True
+        journal=True,
+        event_listeners=[mongo_timer, *query_profiler.listeners()]
     )
 
 @lru_cache(maxsize=1)
@@ -0,0 +1,89 @@
+from datetime import datetime, timedelta, timezone
+from flask import request
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+from .conditional import dataset_versions
+
+VERSION = 'version'
+UPDATED_AT = 'updated_at'
+PRE_IMAGE_PROJECTION = {'_id': 0, 'status': 1, VERSION: 1}
+# Time from registration until a sample is due to be "Ready for Pickup"
+PROCESSING_TIME = timedelta(hours=2)
+
+class VersionConflict(Exception):
+    """The document exists but its version is not the one the client edited"""
+
+    def __init__(self, current_version):
+        super().__init__(f"Sample was modified concurrently (current version {current_version})")
+        self.current_version = current_version
+
+def stamp(fields):
+    """Add the updated_at stamp the sample feed's polling fallback uses to find changed samples"""
+    fields[UPDATED_AT] = datetime.now(timezone.utc)
+    return fields
+
+def sample_update(fields):
+    """Update document for a sample write: $set the fields, stamp updated_at and bump the version"""
+    fields = {key: value for key, value in fields.items() if key != VERSION}
+    return {'$set': stamp(fields), '$inc': {VERSION: 1}}
+
+def version_filter(expected_version):
+    # Documents written before versioning have no field, which counts as version 0
+    if int(expected_version) == 0:
+        return {VERSION: {'$in': [0, None]}}
+    return {VERSION: int(expected_version)}
+
+def mutate(collection, query, fields, expected_version=None, projection=None, upsert=False):
+    """Apply `fields` to the document matching `query` in one round trip and return its pre-image.
+
+    The pre-image holds only `projection` (status and version by default)
+    and is None when nothing matched, or when `upsert` inserted a new
+    document. With `expected_version` the write only applies to that
+    version; a mismatch on an existing document raises VersionConflict.
+    A missing document counts as version 0, so `upsert` still inserts for
+    version 0 but not for a later one. The new version is always the
+    pre-image's version + 1.
+    """
+    match = dict(query)
+    if expected_version is not None:
+        match.update(version_filter(expected_version))
+        upsert = upsert and int(expected_version) == 0
+
+    try:
+        before = collection.find_one_and_update(
+            match,
+            sample_update(fields),
+            projection=projection or PRE_IMAGE_PROJECTION,
+            return_document=ReturnDocument.BEFORE,
+            upsert=upsert
+        )
+    except DuplicateKeyError:
+        # A version 0 upsert that missed an existing document of a later version
+        if expected_version is None:
+            raise
+        before, upsert = None, False
+    # The $inc always modifies a matched document; an unmatched upsert inserted one
+    written = before is not None or upsert
+    if written:
+        dataset_versions.bump('samples')
+    elif expected_version is not None:
+        # Only the failure path pays for a second read, to tell "gone" from "stale"
+        current = collection.find_one(query, {'_id': 0, VERSION: 1})
+        if current is not None:
+            raise VersionConflict(current.get(VERSION, 0))
+    return before
+
+def next_version(before):
+    return (before or {}).get(VERSION, 0) + 1
+
+def expected_version(data):
+    """Client-supplied version from the JSON body or an If-Match header; None when absent"""
+    value = (data or {}).get(VERSION) if isinstance(data, dict) else None
+    if value is None:
+        value = request.headers.get('If-Match', '').strip('"') or None
+    if value is None:
+        return None
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"Invalid version: {value}")
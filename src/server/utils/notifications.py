@@ -0,0 +1,222 @@
+import logging
+import threading
+import time
+from collections import deque
+from datetime import datetime, timedelta
+import eventlet
+import pytz
+from flask_mail import Message
+from pymongo import ReturnDocument
+from src.server.config import Config
+
+logger = logging.getLogger(__name__)
+
+PENDING = 'pending'
+SENDING = 'sending'
+SENT = 'sent'
+FAILED = 'failed'
+
+class SMTPSession:
+    """Keeps one SMTP connection open between sends and reconnects when it drops"""
+
+    def __init__(self, mail, idle_timeout=60):
+        self.mail = mail
+        self.idle_timeout = idle_timeout
+        self.connection = None
+        self.last_used = 0
+
+    def _open(self):
+        self.connection = self.mail.connect()
+        self.connection.__enter__()
+
+    def close(self):
+        if self.connection is not None:
+            try:
+                self.connection.__exit__(None, None, None)
+            except Exception:
+                pass
+            self.connection = None
+
+    def send(self, message):
+        if self.connection is not None and time.monotonic() - self.last_used > self.idle_timeout:
+            self.close()
+        if self.connection is None:
+            self._open()
+        try:
+            self.connection.send(message)
+        except Exception:
+            # The server may have closed an idle connection; retry once on a fresh one
+            self.close()
+            self._open()
+            self.connection.send(message)
+        self.last_used = time.monotonic()
+
+class NotificationOutbox:
+    """Mongo-backed queue for email notifications.
+
+    Request handlers only insert into the outbox. A dispatcher green thread
+    claims due notifications, folds emails that arrived together into one
+    digest, sends through a reused SMTP connection on a green pool and
+    retries failures with exponential backoff.
+    """
+
+    def __init__(self, collection, app, mail, pool_size=4, batch_window=2.0,
+                 max_batch=50, max_attempts=5, retry_base=30, poll_interval=30):
+        self.collection = collection
+        self.app = app
+        self.smtp = SMTPSession(mail)
+        self.pool = eventlet.GreenPool(pool_size)
+        self.batch_window = batch_window
+        self.max_batch = max_batch
+        self.max_attempts = max_attempts
+        self.retry_base = retry_base
+        self.poll_interval = poll_interval
+        self._wakeup = threading.Event()
+        self._smtp_lock = threading.Lock()
+        self._latencies = deque(maxlen=500)
+        self._counts = {SENT: 0, FAILED: 0, 'retried': 0}
+        self._thread = None
+
+    def _enqueue(self, kind, body, **fields):
+        now = datetime.now(pytz.UTC)
+        try:
+            self.collection.insert_one({
+                'kind': kind,
+                'body': body,
+                'status': PENDING,
+                'attempts': 0,
+                'created_at': now,
+                'next_attempt_at': now,
+                **fields
+            })
+        except Exception as e:
+            # Notifications are best effort and must never fail the request
+            logger.error(f"Failed to queue {kind} notification: {e}")
+            return
+        self._wakeup.set()
+
+    def enqueue_email(self, subject, body, recipients=None):
+        self._enqueue('email', body, subject=subject,
+                      recipients=recipients or Config.RECIPIENT_EMAILS)
+
+    def _claim(self):
+        """Atomically claim due notifications so several workers never send the same one"""
+        claimed = []
+        now = datetime.now(pytz.UTC)
+        while len(claimed) < self.max_batch:
+            doc = self.collection.find_one_and_update(
+                {'status': PENDING, 'next_attempt_at': {'$lte': now}},
+                {'$set': {'status': SENDING, 'claimed_at': now}},
+                sort=[('created_at', 1)],
+                return_document=ReturnDocument.AFTER
+            )
+            if doc is None:
+                break
+            claimed.append(doc)
+        return claimed
+
+    def _release_stale(self, older_than=timedelta(minutes=5)):
+        """Return notifications left in `sending` by a worker that died"""
+        self.collection.update_many(
+            {'status': SENDING, 'claimed_at': {'$lt': datetime.now(pytz.UTC) - older_than}},
+            {'$set': {'status': PENDING}}
+        )
+
+    def _digest(self, emails):
+        if len(emails) == 1:
+            return emails[0]['subject'], emails[0]['body']
+        subject = f"{len(emails)} OneBreath notifications"
+        sections = [f"{email['subject']}\n{'-' * len(email['subject'])}\n{email['body']}" for email in emails]
+        return subject, "\n\n".join(sections)
+
+    def _send_emails(self, emails):
+        by_recipients = {}
+        for email in emails:
+            by_recipients.setdefault(tuple(email['recipients']), []).append(email)
+
+        for recipients, group in by_recipients.items():
+            subject, body = self._digest(group)
+            message = Message(subject, sender=Config.MAIL_FROM_ADDRESS, recipients=list(recipients))
+            message.body = body
+            try:
+                with self.app.app_context(), self._smtp_lock:
+                    self.smtp.send(message)
+                self._mark_sent(group)
+            except Exception as e:
+                self._mark_failed(group, e)
+
+    def _mark_sent(self, docs):
+        now = datetime.now(pytz.UTC)
+        self.collection.update_many(
+            {'_id': {'$in': [doc['_id'] for doc in docs]}},
+            {'$set': {'status': SENT, 'sent_at': now}}
+        )
+        for doc in docs:
+            created_at = doc['created_at']
+            if created_at.tzinfo is None:
+                created_at = created_at.replace(tzinfo=pytz.UTC)
+            self._latencies.append((now - created_at).total_seconds())
+        self._counts[SENT] += len(docs)
+
+    def _mark_failed(self, docs, error):
+        logger.error(f"Failed to send {len(docs)} notification(s): {error}")
+        for doc in docs:
+            attempts = doc['attempts'] + 1
+            update = {'attempts': attempts, 'last_error': str(error)}
+            if attempts >= self.max_attempts:
+                update['status'] = FAILED
+                self._counts[FAILED] += 1
+            else:
+                update['status'] = PENDING
+                update['next_attempt_at'] = datetime.now(pytz.UTC) + timedelta(
+                    seconds=self.retry_base * 2 ** (attempts - 1))
+                self._counts['retried'] += 1
+            self.collection.update_one({'_id': doc['_id']}, {'$set': update})
+
+    def dispatch(self):
+        """Send everything that is due; returns the number of notifications claimed"""
+        claimed = self._claim()
+        emails = [doc for doc in claimed if doc['kind'] == 'email']
+        if emails:
+            self.pool.spawn_n(self._send_emails, emails)
+        self.pool.waitall()
+        return len(claimed)
+
+    def _run(self):
+        while True:
+            woken = self._wakeup.wait(self.poll_interval)
+            self._wakeup.clear()
+            if woken:
+                # Give a burst of notifications a moment to arrive so they share one email
+                eventlet.sleep(self.batch_window)
+            try:
+                self._release_stale()
+                while self.dispatch() == self.max_batch:
+                    pass
+            except Exception as e:
+                logger.error(f"Notification dispatcher error: {e}")
+
+    def start(self):
+        if self._thread is None:
+            try:
+                self._release_stale()
+            except Exception as e:
+                logger.error(f"Failed to release stale notifications: {e}")
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        return self
+
+    def stats(self):
+        latencies = sorted(self._latencies)
+        return {
+            'queue_depth': self.collection.count_documents({'status': PENDING}),
+            'in_flight': self.collection.count_documents({'status': SENDING}),
+            'sent': self._counts[SENT],
+            'failed': self._counts[FAILED],
+            'retried': self._counts['retried'],
+            'latency_seconds': {
+                'p50': latencies[len(latencies) // 2] if latencies else None,
+                'p95': latencies[int(len(latencies) * 0.95)] if latencies else None,
+                'max': latencies[-1] if latencies else None,
+            },
+        }
@@ -0,0 +1,112 @@
+import base64
+from bson import json_util
+from flask import Response, jsonify, request, stream_with_context
+from .serialization import dumps, for_json, json_response
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 500
+CURSOR_FIELDS = ('timestamp', 'chip_id')
+
+class PaginationError(ValueError):
+    pass
+
+def encode_cursor(doc):
+    """Opaque cursor pointing just past `doc` in (timestamp, chip_id) order"""
+    key = [doc.get(field) for field in CURSOR_FIELDS]
+    return base64.urlsafe_b64encode(json_util.dumps(key).encode()).decode()
+
+def decode_cursor(cursor):
+    try:
+        timestamp, chip_id = json_util.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except Exception:
+        raise PaginationError("Invalid cursor")
+    return timestamp, chip_id
+
+def keyset_filter(cursor):
+    """Match documents after the cursor for a descending (timestamp, chip_id) sort"""
+    timestamp, chip_id = decode_cursor(cursor)
+    return {"$or": [
+        {"timestamp": {"$lt": timestamp}},
+        {"timestamp": timestamp, "chip_id": {"$lt": chip_id}}
+    ]}
+
+def parse_fields(fields):
+    """Turn `fields=a,b,c` into a Mongo projection"""
+    names = [name.strip() for name in fields.split(',') if name.strip()]
+    if not names or any(name.startswith('$') for name in names):
+        raise PaginationError("Invalid fields parameter")
+    projection = {"_id": 0}
+    projection.update({name: 1 for name in names})
+    return projection
+
+def parse_limit(limit):
+    try:
+        limit = int(limit)
+    except (TypeError, ValueError):
+        raise PaginationError("limit must be an integer")
+    if limit < 1:
+        raise PaginationError("limit must be positive")
+    return min(limit, MAX_PAGE_SIZE)
+
+def is_paginated(args):
+    return any(key in args for key in ('limit', 'cursor', 'fields', 'format'))
+
+def query_samples(collection, match, sort=True):
+    """Run a sample query shaped by the request's pagination arguments.
+
+    Supported query parameters:
+      limit   page size (keyset pagination on timestamp/chip_id, newest first)
+      cursor  value of `next_cursor` from the previous page
+      fields  comma separated projection, passed down to $project
+      format  `ndjson` to stream one document per line as the cursor yields them
+
+    JSON pages come back as {"items": [...], "next_cursor": ...}. NDJSON
+    streams end with a {"next_cursor": ...} line when another page exists.
+    """
+    args = request.args
+    try:
+        projection = parse_fields(args['fields']) if 'fields' in args else {"_id": 0}
+        limit = parse_limit(args.get('limit', DEFAULT_PAGE_SIZE)) if 'limit' in args or 'cursor' in args else None
+
+        if 'cursor' in args:
+            match = {"$and": [match, keyset_filter(args['cursor'])]}
+    except PaginationError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+
+    pipeline = [{"$match": match}]
+    if sort or limit:
+        pipeline.append({"$sort": {"timestamp": -1, "chip_id": -1}})
+    if limit:
+        # One extra document tells us whether there is a next page
+        pipeline.append({"$limit": limit + 1})
+        if len(projection) > 1:
+            projection.update({field: 1 for field in CURSOR_FIELDS})
+    pipeline.append({"$project": projection})
+
+    cursor = for_json(collection).aggregate(pipeline, batchSize=limit + 1 if limit else DEFAULT_PAGE_SIZE)
+
+    if args.get('format') == 'ndjson':
+        def generate():
+            last = None
+            try:
+                for count, doc in enumerate(cursor):
+                    if limit and count == limit:
+                        yield dumps({"next_cursor": encode_cursor(last)}) + b"\n"
+                        break
+                    last = doc
+                    yield dumps(doc) + b"\n"
+            finally:
+                # Also on client disconnect (GeneratorExit), so the server-side cursor is not left open
+                cursor.close()
+
+        return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+    items = list(cursor)
+    if limit is None:
+        return json_response(items)
+
+    next_cursor = None
+    if len(items) > limit:
+        items = items[:limit]
+        next_cursor = encode_cursor(items[-1])
+    return json_response({"items": items, "next_cursor": next_cursor})
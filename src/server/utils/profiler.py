@@ -0,0 +1,283 @@
+import json
+import logging
+import os
+import threading
+from datetime import datetime, timezone
+from pymongo import monitoring
+from .backends import shared_backend
+from .metrics import LATENCY_BUCKETS, bucket_index, histogram_quantile
+
+logger = logging.getLogger(__name__)
+
+# Where each command keeps the filter that decides whether an index can be used
+FILTER_FIELDS = {
+    'find': 'filter',
+    'count': 'query',
+    'distinct': 'query',
+    'findAndModify': 'query',
+}
+IGNORED_COMMANDS = {'listIndexes', 'ping', 'hello', 'isMaster', 'ismaster', 'buildInfo',
+                    'endSessions', 'saslStart', 'saslContinue', 'getMore', 'killCursors'}
+
+def query_shape(value):
+    """The filter with every literal replaced by '?', so queries differing only in values group together"""
+    if isinstance(value, dict):
+        return {key: query_shape(item) for key, item in value.items()}
+    if isinstance(value, list) and value and all(isinstance(item, dict) for item in value):
+        return [query_shape(item) for item in value]
+    return '?'
+
+def command_filter(command):
+    name = next(iter(command))
+    if name in FILTER_FIELDS:
+        return command.get(FILTER_FIELDS[name]) or {}
+    if name == 'aggregate':
+        pipeline = command.get('pipeline') or []
+        return pipeline[0].get('$match', {}) if pipeline else {}
+    if name in ('update', 'delete'):
+        statements = command.get('updates') or command.get('deletes') or []
+        return statements[0].get('q', {}) if statements else {}
+    return None
+
+def returned_count(command_name, reply):
+    cursor = reply.get('cursor')
+    if cursor is not None:
+        return len(cursor.get('firstBatch', ()))
+    if command_name in ('count', 'update', 'delete', 'insert'):
+        return reply.get('n', 0)
+    if command_name == 'findAndModify':
+        return 1 if reply.get('value') else 0
+    return 0
+
+class QueryProfiler(monitoring.CommandListener):
+    """Per query-shape latency, returned documents and index coverage for every Mongo command.
+
+    Shapes are aggregated in this worker. Commands slower than `slow_ms`, and
+    the first command of each shape filtering on fields that no index of the
+    collection starts with, go to a shared slow-query log and are emitted to
+    the /admin Socket.IO namespace. Index lists are refreshed in the
+    background, never from inside the listener.
+    """
+
+    def __init__(self, slow_ms=100, max_shapes=500, slow_log_size=200, index_refresh=300, backend=None):
+        self.slow_ms = slow_ms
+        self.max_shapes = max_shapes
+        self.slow_log_size = slow_log_size
+        self.index_refresh = index_refresh
+        self.backend = backend or shared_backend
+        self.pool = PoolMonitor()
+        self.emit = None
+        self.client = None
+        self.indexes = {}
+        self._shapes = {}
+        self._inflight = {}
+        self._namespaces = set()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+
+    def listeners(self):
+        return [self, self.pool]
+
+    def started(self, event):
+        if event.command_name in IGNORED_COMMANDS:
+            return
+        collection = event.command.get(event.command_name)
+        query = command_filter(event.command)
+        with self._lock:
+            self._inflight[(event.connection_id, event.request_id)] = (
+                f"{event.database_name}.{collection}" if isinstance(collection, str) else event.database_name,
+                query,
+            )
+
+    def succeeded(self, event):
+        self._finish(event, returned_count(event.command_name, event.reply))
+
+    def failed(self, event):
+        self._finish(event, 0, failed=True)
+
+    def unindexed(self, namespace, query):
+        """True/False once the collection's indexes are known, None before that"""
+        if not query:
+            return None
+        fields = {key for key in query if not key.startswith('$')}
+        if not fields or '_id' in fields:
+            return False
+        leading = self.indexes.get(namespace)
+        if leading is None:
+            return None
+        return not (fields & leading)
+
+    def _finish(self, event, returned, failed=False):
+        with self._lock:
+            started = self._inflight.pop((event.connection_id, event.request_id), None)
+        if started is None:
+            return
+        namespace, query = started
+        duration_ms = event.duration_micros / 1000
+        shape = json.dumps(query_shape(query), sort_keys=True) if query is not None else None
+        key = (namespace, event.command_name, shape)
+        unindexed = self.unindexed(namespace, query)
+
+        with self._lock:
+            if namespace not in self._namespaces:
+                self._namespaces.add(namespace)
+                self._wake.set()
+            stats = self._shapes.get(key)
+            if stats is None:
+                if len(self._shapes) >= self.max_shapes:
+                    key = (namespace, event.command_name, '<other>')
+                    stats = self._shapes.get(key)
+                if stats is None:
+                    stats = self._shapes[key] = {
+                        'count': 0, 'failed': 0, 'slow': 0, 'total_ms': 0.0, 'max_ms': 0.0,
+                        'returned': 0, 'latency': [0] * (len(LATENCY_BUCKETS) + 1),
+                    }
+            stats['count'] += 1
+            stats['failed'] += failed
+            stats['total_ms'] += duration_ms
+            stats['max_ms'] = max(stats['max_ms'], duration_ms)
+            stats['returned'] += returned
+            stats['latency'][bucket_index(duration_ms)] += 1
+            slow = duration_ms >= self.slow_ms
+            stats['slow'] += slow
+            # Unindexed shapes are reported once; slow executions every time
+            report = slow or (unindexed and not stats.get('flagged'))
+            if unindexed:
+                stats['flagged'] = True
+
+        if report:
+            self._report_slow({
+                'timestamp': datetime.now(timezone.utc).isoformat(),
+                'namespace': namespace,
+                'command': event.command_name,
+                'shape': shape,
+                'duration_ms': round(duration_ms, 3),
+                'returned': returned,
+                'unindexed': unindexed,
+                'worker': os.getpid(),
+            })
+
+    def _report_slow(self, entry):
+        try:
+            self.backend.push('metrics:slow_queries', entry, self.slow_log_size)
+            if self.emit:
+                self.emit('slow_query', entry, namespace='/admin')
+        except Exception as e:
+            logger.error(f"Failed to report slow query: {e}")
+
+    def refresh_indexes(self):
+        with self._lock:
+            namespaces = list(self._namespaces)
+        for namespace in namespaces:
+            database, _, collection = namespace.partition('.')
+            if not collection:
+                continue
+            try:
+                info = self.client[database][collection].index_information()
+                self.indexes[namespace] = {index['key'][0][0] for index in info.values()}
+            except Exception as e:
+                logger.error(f"Failed to list indexes for {namespace}: {e}")
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.index_refresh)
+            self._wake.clear()
+            self.refresh_indexes()
+
+    def start(self, client, emit=None):
+        self.client = client
+        self.emit = emit
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        return self
+
+    def report(self, limit=50):
+        with self._lock:
+            shapes = [(key, dict(stats)) for key, stats in self._shapes.items()]
+        shapes.sort(key=lambda item: item[1]['total_ms'], reverse=True)
+        return {
+            'worker': os.getpid(),
+            'slow_ms': self.slow_ms,
+            'queries': [{
+                'namespace': namespace,
+                'command': command,
+                'shape': shape,
+                'count': stats['count'],
+                'failed': stats['failed'],
+                'slow': stats['slow'],
+                'returned': stats['returned'],
+                'total_ms': stats['total_ms'],
+                'mean_ms': stats['total_ms'] / stats['count'],
+                'max_ms': stats['max_ms'],
+                'p95_ms': histogram_quantile(stats['latency'], 0.95),
+                'unindexed': self.unindexed(namespace, json.loads(shape)) if shape and shape != '<other>' else None,
+            } for (namespace, command, shape), stats in shapes[:limit]],
+            'slow_queries': self.backend.range('metrics:slow_queries')[-self.slow_log_size:],
+            'pool': self.pool.report(),
+        }
+
+class PoolMonitor(monitoring.ConnectionPoolListener):
+    """Connection pool checkout waits and failures for this worker"""
+
+    def __init__(self):
+        self.checkouts = 0
+        self.failed = {}
+        self.wait = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.max_wait_ms = 0.0
+        self.open_connections = 0
+        self.checked_out = 0
+
+    def connection_checked_out(self, event):
+        wait_ms = (getattr(event, 'duration', None) or 0.0) * 1000
+        self.checkouts += 1
+        self.checked_out += 1
+        self.wait[bucket_index(wait_ms)] += 1
+        self.max_wait_ms = max(self.max_wait_ms, wait_ms)
+
+    def connection_check_out_failed(self, event):
+        self.failed[event.reason] = self.failed.get(event.reason, 0) + 1
+
+    def connection_checked_in(self, event):
+        self.checked_out -= 1
+
+    def connection_created(self, event):
+        self.open_connections += 1
+
+    def connection_closed(self, event):
+        self.open_connections -= 1
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def report(self):
+        return {
+            'checkouts': self.checkouts,
+            'checked_out': self.checked_out,
+            'open_connections': self.open_connections,
+            'failed': self.failed,
+            'wait_ms': {
+                'p50': histogram_quantile(self.wait, 0.50),
+                'p95': histogram_quantile(self.wait, 0.95),
+                'p99': histogram_quantile(self.wait, 0.99),
+                'max': self.max_wait_ms,
+            },
+        }
+
+query_profiler = QueryProfiler()
@@ -0,0 +1,102 @@
+from datetime import datetime, timezone
+import pytz
+from .mutations import PROCESSING_TIME, VERSION
+
+REQUIRED_FIELDS = ['chip_id', 'patient_id', 'sample_type', 'status']
+UPDATABLE_FIELDS = ['status', 'sample_type', 'patient_id', 'timestamp', 'notes']
+MAX_BULK_ITEMS = 500
+NOT_ATTEMPTED = "Not attempted after an earlier failure"
+DUPLICATE_SAMPLE = "Sample already exists"
+
+class SampleValidationError(ValueError):
+    """Raised for request data that cannot become a sample document; the message is returned to the client"""
+
+def build_registration(data):
+    """Validate a registration and build its document.
+
+    Returns (document, registered_at) where registered_at is the parsed
+    timestamp; raises SampleValidationError with the same messages
+    register_sample has always returned.
+    """
+    if not isinstance(data, dict) or not all(field in data for field in REQUIRED_FIELDS):
+        raise SampleValidationError(f"Missing required fields. Required: {', '.join(REQUIRED_FIELDS)}")
+
+    # Parse timestamp just for expected_completion_time calculation
+    try:
+        registered_at = datetime.strptime(data.get('timestamp') or '', '%Y-%m-%dT%H:%M:%S.%fZ')
+        registered_at = registered_at.replace(tzinfo=timezone.utc)
+    except (TypeError, ValueError) as e:
+        raise SampleValidationError(f"Invalid timestamp format. Use ISO format. Error: {str(e)}")
+
+    document = {
+        "chip_id": data['chip_id'],
+        "patient_id": data['patient_id'],
+        "sample_type": data['sample_type'],
+        "status": data['status'],
+        "timestamp": data['timestamp'],
+        "expected_completion_time": (registered_at + PROCESSING_TIME).isoformat(),
+        "batch_number": data.get('batch_number'),
+        "mfg_date": data.get('mfg_date'),
+        "notes": data.get('notes'),
+        VERSION: 1
+    }
+
+    # Remove None values to keep the document clean
+    return {k: v for k, v in document.items() if v is not None}, registered_at
+
+def build_update(data):
+    """Validate a sample edit; returns (chip_id, fields to $set)"""
+    if not isinstance(data, dict) or not data.get('chip_id'):
+        raise SampleValidationError("Chip ID is required")
+    return data['chip_id'], {field: data[field] for field in UPDATABLE_FIELDS if field in data}
+
+def registration_email(document, registered_at):
+    subject = f"New Sample Registered: {document['chip_id']}"
+    body = (f"A new sample has been registered:\n\n"
+           f"Chip ID: {document['chip_id']}\n"
+           f"Patient ID: {document['patient_id']}\n"
+           f"Sample Type: {document['sample_type']}\n"
+           f"Status: {document['status']}\n"
+           f"Registration Time: {registered_at.strftime('%Y-%m-%d %H:%M:%S UTC')}\n"
+           f"Expected Completion: {document['expected_completion_time']}")
+
+    if document.get('notes'):
+        body += f"\n\nNotes: {document['notes']}"
+
+    body += "\n\nThe sample will be ready for pickup in 2 hours."
+    return subject, body
+
+def status_change_email(chip_id, previous, update_data):
+    subject = f"Sample Status Updated: {chip_id}"
+    body = (f"Sample status has been updated:\n\n"
+           f"Chip ID: {chip_id}\n"
+           f"Previous Status: {previous.get('status', 'N/A')}\n"
+           f"New Status: {update_data.get('status')}\n"
+           f"Sample Type: {update_data.get('sample_type', previous.get('sample_type', 'N/A'))}\n"
+           f"Patient ID: {update_data.get('patient_id', previous.get('patient_id', 'N/A'))}\n"
+           f"Update Time: {update_data.get('timestamp', datetime.now(pytz.UTC).strftime('%Y-%m-%d %H:%M:%S UTC'))}")
+    return subject, body
+
+def bulk_items(payload, key):
+    """Items of a bulk request: a bare list or {key: [...]}; returns (items, ordered)"""
+    if isinstance(payload, list):
+        items, ordered = payload, False
+    elif isinstance(payload, dict) and isinstance(payload.get(key), list):
+        items, ordered = payload[key], bool(payload.get('ordered', False))
+    else:
+        raise SampleValidationError(f"Expected a list of {key} or {{\"{key}\": [...]}}")
+    if not items:
+        raise SampleValidationError(f"No {key} provided")
+    if len(items) > MAX_BULK_ITEMS:
+        raise SampleValidationError(f"At most {MAX_BULK_ITEMS} {key} per request")
+    return items, ordered
+
+def bulk_write_errors(error):
+    """Map a BulkWriteError to {operation index: message}"""
+    messages = {}
+    for write_error in error.details.get('writeErrors', []):
+        if write_error.get('code') == 11000:
+            messages[write_error['index']] = DUPLICATE_SAMPLE
+        else:
+            messages[write_error['index']] = write_error.get('errmsg', 'Write failed')
+    return messages
@@ -0,0 +1,66 @@
+import json
+from datetime import date, datetime
+from bson.codec_options import CodecOptions, TypeDecoder, TypeRegistry
+from bson.decimal128 import Decimal128
+from flask import Response
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional speedup
+    orjson = None
+
+_EXPONENT_BIAS = 6176
+
+def decimal128_to_float(value):
+    """float(value.to_decimal()) without building a Decimal.
+
+    Reads the IEEE 754-2008 BID encoding directly. Integer true division
+    rounds correctly, so the result is identical; infinities, NaN and
+    positive exponents (rare for measurements) take the Decimal route.
+    """
+    bid = value.bid
+    high = int.from_bytes(bid[8:], 'little')
+    exponent = (high >> 49 & 0x3FFF) - _EXPONENT_BIAS
+    if exponent > 0 or high >> 61 & 0b11 == 0b11:
+        return float(value.to_decimal())
+    coefficient = (high & 0x1FFFFFFFFFFFF) << 64 | int.from_bytes(bid[:8], 'little')
+    result = coefficient / 10 ** -exponent
+    return -result if high >> 63 else result
+
+class DecimalAsFloat(TypeDecoder):
+    """Decode Decimal128 straight to float while the driver builds the document"""
+    bson_type = Decimal128
+
+    def transform_bson(self, value):
+        return decimal128_to_float(value)
+
+# Codec options for read paths whose documents only go out as JSON. The
+# driver's C decoder applies them per value, so responses no longer need a
+# second recursive pass over every document. Datetimes are native BSON types
+# that cannot be given a decoder; the encoder below writes them as ISO 8601.
+JSON_CODEC_OPTIONS = CodecOptions(type_registry=TypeRegistry([DecimalAsFloat()]))
+
+def for_json(collection):
+    """The same collection, decoding documents into JSON-ready values"""
+    return collection.with_options(codec_options=JSON_CODEC_OPTIONS)
+
+def _default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Decimal128):
+        return decimal128_to_float(value)
+    # ObjectId and anything else unexpected
+    return str(value)
+
+if orjson is not None:
+    def dumps(data):
+        """Serialize to JSON bytes"""
+        return orjson.dumps(data, default=_default, option=orjson.OPT_NON_STR_KEYS)
+else:
+    def dumps(data):
+        """Serialize to JSON bytes"""
+        return json.dumps(data, default=_default, separators=(',', ':')).encode()
+
+def json_response(data, status=200):
+    """Drop-in for jsonify() on large payloads"""
+    return Response(dumps(data), status=status, mimetype='application/json')
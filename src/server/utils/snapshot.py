@@ -0,0 +1,197 @@
+import threading
+import logging
+import time
+from datetime import datetime, timedelta
+import numpy as np
+from bson.decimal128 import Decimal128
+from .statistics import SUMMARY_FIELDS, collection_version, read_marker
+from .cache import generate_data_hash
+
+logger = logging.getLogger(__name__)
+
+def _to_float(value):
+    if isinstance(value, Decimal128):
+        value = value.to_decimal()
+    try:
+        return float(value)
+    except (ValueError, TypeError):
+        return np.nan
+
+def _encode(values):
+    """Encode a categorical column as integer codes; -1 marks missing values"""
+    present = [v for v in values if v]
+    categories = sorted(set(map(str, present)))
+    lookup = {category: code for code, category in enumerate(categories)}
+    codes = np.array([lookup[str(v)] if v else -1 for v in values], dtype=np.int32)
+    return codes, categories
+
+def _convert(sample):
+    """Convert MongoDB types to JSON-serializable formats"""
+    converted = {}
+    for key, value in sample.items():
+        if isinstance(value, Decimal128):
+            converted[key] = float(value.to_decimal())
+        elif isinstance(value, datetime):
+            converted[key] = value.isoformat()
+        else:
+            converted[key] = value
+    return converted
+
+class AnalyzedSnapshot:
+    """Column-oriented view of the analyzed collection at one version.
+
+    Numeric fields are float arrays with NaN for missing or unparseable
+    values, categorical fields are integer codes with -1 for missing.
+    """
+
+    def __init__(self, samples, version=None):
+        self.version = version
+        self.loaded_at = time.monotonic()
+        self.records = [_convert(sample) for sample in samples]
+        self.size = len(self.records)
+        self._columns = {}
+        self._fingerprint = None
+        self.lock = threading.Lock()
+
+        for field in SUMMARY_FIELDS:
+            self.column(field)
+
+        sample_type = np.array([s.get('sample_type') for s in self.records], dtype=object)
+        self.has_lung_rads = self.present('lung_RADS')
+        self.has_sample_type = self.present('sample_type')
+
+        # Missing lung-RADS scores count as 0, matching the classification
+        # rules given to the model in ai_analysis
+        self.lung_rads = np.where(self.has_lung_rads, self.column('lung_RADS'), 0)
+        self.labelled_positive = sample_type == 'LC Positive'
+        self.labelled_negative = sample_type == 'LC Negative'
+        self.positive = self.labelled_positive | (self.lung_rads >= 3)
+        self.negative = self.labelled_negative | (self.lung_rads < 3)
+
+        self.stage, self.stage_categories = _encode([s.get('cancer_stage') for s in self.records])
+        self.histology, self.histology_categories = _encode([s.get('cancer_histology') for s in self.records])
+
+        timestamps = [s.get('timestamp', 'N/A') for s in self.records]
+        self.period = (min(timestamps), max(timestamps)) if timestamps else ('N/A', 'N/A')
+
+        self.key_counts = {}
+        for record in self.records:
+            for key in {k.lower() for k in record.keys()}:
+                self.key_counts[key] = self.key_counts.get(key, 0) + 1
+
+    @property
+    def fingerprint(self):
+        """Content hash of the records, computed once per snapshot"""
+        if self._fingerprint is None:
+            self._fingerprint = generate_data_hash(self.records)
+        return self._fingerprint
+
+    def present(self, field):
+        return np.array([field in s for s in self.records], dtype=bool)
+
+    def column(self, field, keep=True):
+        """Float column for `field`, built on first use and kept for this version.
+
+        With keep=False a column that is not already kept is built without
+        being stored, for fields named by clients rather than by the code.
+        """
+        column = self._columns.get(field)
+        if column is None and not keep:
+            return self._build_column(field)
+        if column is None:
+            with self.lock:
+                column = self._columns.get(field)
+                if column is None:
+                    column = self._columns[field] = self._build_column(field)
+        return column
+
+    def _build_column(self, field):
+        column = np.array([_to_float(s[field]) if field in s else np.nan
+                           for s in self.records], dtype=float)
+        column.flags.writeable = False
+        return column
+
+    def matrix(self, fields):
+        """samples x fields matrix with NaN for missing values"""
+        if not fields:
+            return np.empty((self.size, 0))
+        return np.column_stack([self.column(field) for field in fields])
+
+    def statistics_matrix(self, fields):
+        """matrix() with missing fields as 0, the rule calculate_statistics and
+        the statistics engine use; unparseable values stay NaN and are skipped"""
+        values = self.matrix(fields).copy()
+        for i, field in enumerate(fields):
+            values[~self.present(field), i] = 0
+        return values
+
+    def category_counts(self, codes, categories, mask=None):
+        """{category: count} over the rows selected by `mask`"""
+        selected = codes if mask is None else codes[mask]
+        counts = np.bincount(selected[selected >= 0], minlength=len(categories))
+        return {category: int(counts[i]) for i, category in enumerate(categories) if counts[i]}
+
+class SnapshotManager:
+    """Shares one snapshot of the analyzed collection between the analytics endpoints.
+
+    The snapshot is reloaded when collection_version changes, and after
+    `max_age` in any case, since edits that are not stamped with updated_at
+    do not change the version. With a watched marker (see watch) the
+    version is only read when the marker moves.
+    """
+
+    def __init__(self, max_age=timedelta(minutes=10)):
+        self.max_age = max_age
+        self.snapshot = None
+        self.loads = 0
+        self.marker = None
+        self.seen_marker = None
+        self.lock = threading.Lock()
+        self._subscribers = []
+
+    def watch(self, marker):
+        """Skip the collection_version queries while `marker()` returns the value it did last time"""
+        self.marker = marker
+        return self
+
+    def subscribe(self, callback):
+        """Call `callback(snapshot)` whenever a new snapshot is loaded"""
+        self._subscribers.append(callback)
+
+    def _current(self, snapshot, version, max_age):
+        # Snapshot versions are (collection_version, load count), so a reload
+        # forced by age is a new version to subscribers too
+        return (snapshot is not None and snapshot.version[0] == version
+                and time.monotonic() - snapshot.loaded_at <= max_age.total_seconds())
+
+    def get(self, collection, max_age=None):
+        """Snapshot at the collection's current version, no older than `max_age` (default self.max_age)"""
+        max_age = max_age or self.max_age
+        snapshot = self.snapshot
+        marker = read_marker(self.marker)
+        if (marker is not None and marker == self.seen_marker and snapshot is not None
+                and self._current(snapshot, snapshot.version[0], max_age)):
+            return snapshot
+
+        version = collection_version(collection)
+        self.seen_marker = marker
+        if self._current(self.snapshot, version, max_age):
+            return self.snapshot
+
+        with self.lock:
+            if not self._current(self.snapshot, version, max_age):
+                logger.info(f"Loading analyzed snapshot at version {version}")
+                self.loads += 1
+                self.snapshot = AnalyzedSnapshot(collection.find({}, {'_id': 0}), (version, self.loads))
+                for callback in self._subscribers:
+                    try:
+                        callback(self.snapshot)
+                    except Exception as e:
+                        logger.error(f"Snapshot subscriber failed: {e}")
+            return self.snapshot
+
+    def invalidate(self):
+        with self.lock:
+            self.snapshot = None
+
+snapshot_manager = SnapshotManager()
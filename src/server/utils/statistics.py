@@ -0,0 +1,250 @@
+import threading
+import logging
+import time
+from datetime import datetime, timedelta
+import numpy as np
+from bson.decimal128 import Decimal128
+
+logger = logging.getLogger(__name__)
+
+VOC_FIELDS = [
+    '2-Butanone', 'Pentanal', '2-hydroxy-acetaldehyde',
+    '2-hydroxy-3-butanone', '4-HHE', '4-HNE', 'Decanal'
+]
+VOC_PER_LITER_FIELDS = [f"{voc}_per_liter" for voc in VOC_FIELDS]
+ADDITIONAL_FIELDS = ['average_co2', 'final_volume']
+SUMMARY_FIELDS = VOC_FIELDS + VOC_PER_LITER_FIELDS + ADDITIONAL_FIELDS
+
+UPDATED_AT = 'updated_at'
+
+def collection_version(collection):
+    """Cheap change marker: (document count, newest _id, newest updated_at stamp).
+
+    Inserts and deletes move the first two. Documents edited in place only
+    move it if the writer stamps updated_at, so readers of this marker also
+    reload after a maximum age.
+    """
+    count = collection.estimated_document_count()
+    newest = collection.find_one({}, {'_id': 1}, sort=[('_id', -1)])
+    stamped = collection.find_one({}, {UPDATED_AT: 1}, sort=[(UPDATED_AT, -1)])
+    return (count, newest['_id'] if newest else None, stamped.get(UPDATED_AT) if stamped else None)
+
+def read_marker(marker):
+    """Value of a watched change marker, or None (check the collection) if there is none or it fails"""
+    if marker is None:
+        return None
+    try:
+        return marker()
+    except Exception as e:
+        logger.error(f"Failed to read change marker: {e}")
+        return None
+
+def refresh_epoch(max_age):
+    """Number of the current `max_age` period; readers that reload after
+    `max_age` do so when it changes, so their reloads line up across workers"""
+    return int(time.time() // max_age.total_seconds())
+
+def _field_value(doc, field):
+    """Mirror calculate_statistics: missing fields count as 0, unparseable or negative values are skipped"""
+    value = doc.get(field, 0)
+    if isinstance(value, Decimal128):
+        value = value.to_decimal()
+    try:
+        value = float(value)
+    except (ValueError, TypeError):
+        return None
+    if np.isnan(value) or value < 0:
+        return None
+    return value
+
+class FieldState:
+    """Sorted values for one field, kept sorted as documents are added or removed"""
+
+    def __init__(self):
+        self.values = np.empty(0, dtype=float)
+
+    def add(self, values):
+        if not values:
+            return
+        incoming = np.sort(np.asarray(values, dtype=float))
+        positions = np.searchsorted(self.values, incoming)
+        self.values = np.insert(self.values, positions, incoming)
+
+    def remove(self, value):
+        index = np.searchsorted(self.values, value)
+        if index < len(self.values) and self.values[index] == value:
+            self.values = np.delete(self.values, index)
+
+    def summarize(self):
+        """Same statistics as calculate_statistics, read off the sorted array"""
+        values = self.values
+        if len(values) == 0:
+            return None
+
+        q1, q3 = np.percentile(values, [25, 75])
+        iqr = q3 - q1
+        lo = np.searchsorted(values, q1 - 1.5 * iqr, side='left')
+        hi = np.searchsorted(values, q3 + 1.5 * iqr, side='right')
+        filtered = values[lo:hi]
+        if len(filtered) == 0:
+            return None
+
+        return {
+            'mean': float(filtered.mean()),
+            'median': float(np.median(filtered)),
+            'range': {
+                'min': float(filtered[0]),
+                'max': float(filtered[-1])
+            },
+            'q1': float(q1),
+            'q3': float(q3),
+            'sample_count': int(len(filtered)),
+            'original_count': int(len(values)),
+            'outliers_removed': int(len(values) - len(filtered))
+        }
+
+class StatisticsEngine:
+    """Per-field statistics over a collection, updated from new documents only.
+
+    New documents are found through the `_id` high-water mark. If the document
+    count does not line up with what has been applied (deletes or replaced
+    documents) or a newer updated_at stamp shows an edit, the state is rebuilt
+    from scratch. A rebuild is also forced each `max_age` period (see
+    refresh_epoch) to pick up edits that were not stamped. With a watched
+    marker (see watch) the collection is only checked when the marker moves.
+    """
+
+    def __init__(self, fields, max_age=timedelta(minutes=10)):
+        self.fields = list(fields)
+        self.max_age = max_age
+        self.lock = threading.Lock()
+        self.marker = None
+        self.seen_marker = None
+        self._reset()
+
+    def watch(self, marker):
+        """Skip the collection_version queries while `marker()` returns the value it did last time"""
+        self.marker = marker
+        return self
+
+    def _reset(self):
+        self.states = {field: FieldState() for field in self.fields}
+        self.doc_values = {}
+        self.last_id = None
+        self.version = None
+        self.built_at = None
+        self.built_epoch = None
+        self._stats = None
+
+    @property
+    def count(self):
+        return len(self.doc_values)
+
+    def _apply(self, docs):
+        pending = {field: [] for field in self.fields}
+        for doc in docs:
+            doc_id = doc['_id']
+            previous = self.doc_values.pop(doc_id, None)
+            if previous:
+                for field, value in previous.items():
+                    self.states[field].remove(value)
+
+            values = {}
+            for field in self.fields:
+                value = _field_value(doc, field)
+                if value is not None:
+                    values[field] = value
+                    pending[field].append(value)
+            self.doc_values[doc_id] = values
+
+            if self.last_id is None or doc_id > self.last_id:
+                self.last_id = doc_id
+
+        for field, values in pending.items():
+            self.states[field].add(values)
+        self._stats = None
+
+    def refresh(self, collection):
+        """Bring the engine up to date with the collection; returns True if anything changed"""
+        with self.lock:
+            marker = read_marker(self.marker)
+            expired = self.built_epoch != refresh_epoch(self.max_age)
+            if marker is not None and marker == self.seen_marker and not expired:
+                return False
+
+            version = collection_version(collection)
+            self.seen_marker = marker
+            if version == self.version and not expired:
+                return False
+
+            projection = {field: 1 for field in self.fields}
+            edited = self.version is not None and version[2] != self.version[2]
+            if expired or edited or self.last_id is None:
+                self._reset()
+                self._apply(collection.find({}, projection))
+                self.built_at = datetime.now()
+                self.built_epoch = refresh_epoch(self.max_age)
+            else:
+                self._apply(collection.find({'_id': {'$gt': self.last_id}}, projection))
+                if self.count != version[0]:
+                    logger.info("Statistics engine out of step with collection, rebuilding")
+                    self._reset()
+                    self._apply(collection.find({}, projection))
+                    self.built_at = datetime.now()
+                    self.built_epoch = refresh_epoch(self.max_age)
+
+            self.version = version
+            return True
+
+    def statistics(self):
+        """Statistics for every field, recomputed only after the state has changed"""
+        if self._stats is None:
+            self._stats = {field: self.states[field].summarize() for field in self.fields}
+        return self._stats
+
+def format_statistics_summary(stats):
+    """Render the plain-text summary returned by /statistics_summary"""
+    def field_block(label, field_stats):
+        return (f"\n{label}:\n"
+                f"Mean: {field_stats['mean']:.2f}\n"
+                f"Median: {field_stats['median']:.2f}\n"
+                f"Range: {field_stats['range']['min']:.2f} - {field_stats['range']['max']:.2f}\n"
+                f"Sample Count: {field_stats['sample_count']}\n")
+
+    summary = "Statistical Analysis Summary:\n\n"
+
+    summary += "VOC Measurements (nanomoles):\n"
+    for voc in VOC_FIELDS:
+        if stats[voc]:
+            summary += field_block(voc, stats[voc])
+
+    summary += "\nVOC Measurements (nanomoles/liter of breath):\n"
+    for voc in VOC_PER_LITER_FIELDS:
+        if stats[voc]:
+            summary += field_block(voc.replace('_per_liter', ''), stats[voc])
+
+    summary += "\nAdditional Measurements:\n"
+    for field in ADDITIONAL_FIELDS:
+        if stats[field]:
+            summary += field_block(field, stats[field])
+
+    return summary
+
+class SummaryCache:
+    """Holds the rendered summary for the engine version it was built from"""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.version = None
+        self.summary = None
+
+    def get(self, collection):
+        changed = self.engine.refresh(collection)
+        cached = not changed and self.summary is not None
+        if not cached:
+            self.summary = format_statistics_summary(self.engine.statistics())
+            self.version = self.engine.version
+        return self.summary, cached
+
+statistics_engine = StatisticsEngine(SUMMARY_FIELDS)
+summary_cache = SummaryCache(statistics_engine)
@@ -0,0 +1,83 @@
+import json
+import logging
+import time
+from flask import Response, request, stream_with_context
+
+logger = logging.getLogger(__name__)
+
+def wants_stream():
+    """Clients opt in with ?stream=1 or by accepting only text/event-stream"""
+    if request.args.get('stream', '').lower() in ('1', 'true'):
+        return True
+    return request.accept_mimetypes.best == 'text/event-stream'
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def sse_response(events):
+    return Response(
+        stream_with_context(events),
+        mimetype='text/event-stream',
+        # Proxies must not buffer the stream or the first token waits for the last
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+def _open_with_retries(open_stream, retries):
+    for attempt in range(retries):
+        try:
+            return open_stream()
+        except Exception as e:
+            logger.error(f"OpenAI stream failed to open (attempt {attempt + 1}): {e}")
+            if attempt + 1 == retries:
+                raise
+            time.sleep(2 ** (attempt + 1))
+
+def stream_completion(open_stream, result_key, on_complete=None, retries=1, label='completion'):
+    """Forward a streaming chat completion as Server-Sent Events.
+
+    Emits `delta` events ({"text": ...}) as chunks arrive, then one `done`
+    event with the assembled text under `result_key`, shaped like the
+    endpoint's JSON response. `on_complete(text)` runs before `done`, so the
+    text can be cached; a dict it returns is merged into `done`. Opening
+    the stream is retried; once text has been sent a failure ends the
+    stream with an `error` event. If the client disconnects the upstream
+    stream is closed, which cancels the request, and nothing is cached.
+    """
+    started = time.perf_counter()
+    # An immediate comment commits the headers so the browser sees the stream open
+    yield ": stream open\n\n"
+
+    stream = None
+    parts = []
+    first_token_ms = None
+    try:
+        stream = _open_with_retries(open_stream, retries)
+        for chunk in stream:
+            if not chunk.choices:
+                continue
+            text = chunk.choices[0].delta.content
+            if text:
+                if first_token_ms is None:
+                    first_token_ms = (time.perf_counter() - started) * 1000
+                parts.append(text)
+                yield sse_event('delta', {'text': text})
+
+        content = ''.join(parts)
+        extra = (on_complete(content) if on_complete else None) or {}
+        logger.info(f"{label} streamed {len(content)} chars, first token after "
+                    f"{first_token_ms or 0:.0f}ms, total {(time.perf_counter() - started) * 1000:.0f}ms")
+        yield sse_event('done', {'success': True, result_key: content, 'cached': False, **extra})
+    except GeneratorExit:
+        logger.info(f"{label} stream closed by client after {len(parts)} chunks")
+        raise
+    except Exception as e:
+        logger.error(f"{label} stream error: {e}")
+        yield sse_event('error', {'success': False, 'error': str(e)})
+    finally:
+        if stream is not None:
+            # Closes the upstream HTTP response; mid-stream this cancels the generation
+            stream.close()
+
+def stream_cached(result_key, content, **extra):
+    """A cache hit in the same event shape as a streamed completion"""
+    yield sse_event('done', {'success': True, result_key: content, 'cached': True, **extra})
@@ -0,0 +1,159 @@
+import io
+from datetime import timedelta
+from werkzeug.sansio.multipart import Data, Epilogue, Field, File, MultipartDecoder, NeedData
+
+DEFAULT_CONTENT_TYPE = 'application/octet-stream'
+MAX_UPLOAD_SIZE = 50 * 1024 * 1024
+UPLOAD_URL_TTL = timedelta(minutes=15)
+# Resumable chunks must be a multiple of 256 KiB; one chunk is all a streamed upload holds in memory
+UPLOAD_CHUNK_SIZE = 4 * 1024 * 1024
+READ_SIZE = 64 * 1024
+SINGLE_REQUEST_SIZE = 1024 * 1024
+
+class UploadError(ValueError):
+    """Raised for an upload request that cannot be stored; the message is returned to the client"""
+
+def blob_name(name):
+    """Validate a client-chosen object name; folders are allowed, traversal is not"""
+    if not isinstance(name, str) or not name.strip('/'):
+        raise UploadError("Missing destination_blob_name")
+    # No empty, "." or ".." segments: "a//b", "a/./b" and "a/" are rejected
+    segments = name.split('/')
+    if any(segment in ('', '.', '..') for segment in segments) or '\\' in name or len(name.encode()) > 1024:
+        raise UploadError(f"Invalid destination_blob_name: {name}")
+    return name
+
+def signed_upload(blob, content_type=None, size=None, resumable=False, origin=None):
+    """How the browser uploads straight to the bucket.
+
+    By default a V4 signed PUT URL for a single request, which GCS rejects
+    past MAX_UPLOAD_SIZE. With `resumable` a resumable session URL instead,
+    which the client PUTs to in chunks (Content-Range) and can resume after
+    a dropped connection; `size` is required and fixed in the session, so
+    GCS rejects anything larger. `origin` is echoed for CORS. Either way the
+    file never passes through this server.
+    """
+    content_type = content_type or DEFAULT_CONTENT_TYPE
+    if size is not None and (not isinstance(size, int) or isinstance(size, bool) or size < 0):
+        raise UploadError("size must be a non-negative integer")
+    if size is not None and size > MAX_UPLOAD_SIZE:
+        raise UploadError(f"File too large; the limit is {MAX_UPLOAD_SIZE} bytes")
+
+    if resumable:
+        if size is None:
+            raise UploadError("size is required for a resumable upload")
+        url = blob.create_resumable_upload_session(content_type=content_type, size=size, origin=origin)
+        return {'method': 'PUT', 'url': url, 'headers': {'Content-Type': content_type}, 'resumable': True}
+
+    # Signed headers must be sent exactly as signed
+    headers = {'Content-Type': content_type, 'x-goog-content-length-range': f"0,{MAX_UPLOAD_SIZE}"}
+    url = blob.generate_signed_url(version='v4', expiration=UPLOAD_URL_TTL, method='PUT',
+                                   content_type=content_type,
+                                   headers={'x-goog-content-length-range': headers['x-goog-content-length-range']})
+    return {'method': 'PUT', 'url': url, 'headers': headers, 'resumable': False,
+            'expires_in': int(UPLOAD_URL_TTL.total_seconds())}
+
+class MultipartFile:
+    """Readable view of the first file in a multipart/form-data body.
+
+    The body is decoded as it is read, so a file can be handed to the GCS
+    client without buffering it. Other fields and files are skipped.
+    """
+
+    def __init__(self, stream, boundary):
+        self.stream = stream
+        self.decoder = MultipartDecoder(boundary)
+        self.part = None
+        self.content_type = None
+        self._in_file = False
+        self._file_done = False
+        self._exhausted = False
+        self._buffer = bytearray()
+        self._position = 0
+
+    def _pump(self):
+        """Decode one more read of the body; False once the body is used up"""
+        if self._exhausted:
+            return False
+        data = self.stream.read(READ_SIZE)
+        if not data:
+            self._exhausted = True
+        self.decoder.receive_data(data or None)
+        try:
+            self._handle_events()
+        except ValueError as e:
+            # Raised by the decoder for malformed or truncated bodies
+            raise UploadError(f"Invalid multipart body: {e}")
+        return True
+
+    def _handle_events(self):
+        event = self.decoder.next_event()
+        while not isinstance(event, (NeedData, Epilogue)):
+            if isinstance(event, File) and self.part is None:
+                self.part = event
+                self.content_type = event.headers.get('content-type') or DEFAULT_CONTENT_TYPE
+                self._in_file = True
+            elif isinstance(event, (File, Field)):
+                self._in_file = False
+            elif isinstance(event, Data) and self._in_file:
+                self._buffer += event.data
+                if not event.more_data:
+                    self._in_file = False
+                    self._file_done = True
+            event = self.decoder.next_event()
+
+    def start(self):
+        """Read up to the file's headers; raises UploadError if there is no file"""
+        while self.part is None:
+            if not self._pump():
+                raise UploadError("No file in upload")
+        return self
+
+    def read(self, size=-1):
+        # The GCS client treats a short read as the end of the file, so fill the request
+        while not self._file_done and (size < 0 or len(self._buffer) < size):
+            if not self._pump():
+                raise UploadError("Upload ended before the file did")
+        if self._position + len(self._buffer) > MAX_UPLOAD_SIZE:
+            raise UploadError(f"File too large; the limit is {MAX_UPLOAD_SIZE} bytes")
+        size = len(self._buffer) if size < 0 else min(size, len(self._buffer))
+        chunk = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        self._position += size
+        return chunk
+
+    def tell(self):
+        return self._position
+
+def stream_upload(bucket, name, request):
+    """Pipe a request body into the bucket a chunk at a time; returns the bytes stored.
+
+    Accepts the raw file as the body (its Content-Type becomes the object's)
+    or a multipart/form-data body with one file. A body that ends early
+    raises before the upload is finalized, so no partial object is created.
+    """
+    name = blob_name(name)
+    if request.content_length is not None and request.content_length > MAX_UPLOAD_SIZE:
+        raise UploadError(f"File too large; the limit is {MAX_UPLOAD_SIZE} bytes")
+
+    blob = bucket.blob(name)
+    blob.chunk_size = UPLOAD_CHUNK_SIZE
+    if request.mimetype == 'multipart/form-data':
+        boundary = request.mimetype_params.get('boundary')
+        if not boundary:
+            raise UploadError("Missing multipart boundary")
+        source = MultipartFile(request.stream, boundary.encode()).start()
+        # Size unknown up front: a resumable upload, one chunk at a time
+        blob.upload_from_file(source, content_type=source.content_type)
+        return source.tell()
+
+    if request.content_length is None:
+        raise UploadError("Content-Length is required for a raw upload")
+    # Reads must return whole chunks (see MultipartFile.read); a body cut
+    # short raises ClientDisconnected rather than ending the file early
+    source = io.BufferedReader(request.stream, READ_SIZE)
+    # Small files go up in a single request, which the client builds in
+    # memory (several copies up to 8 MiB); the rest as resumable chunks
+    size = request.content_length if request.content_length <= SINGLE_REQUEST_SIZE else None
+    blob.upload_from_file(source, size=size, content_type=request.mimetype or DEFAULT_CONTENT_TYPE)
+    return request.content_length
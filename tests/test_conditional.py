@@ -0,0 +1,83 @@
+"""ETags of probed datasets must change when documents are edited in place.
+
+Run with: python -m pytest tests
+"""
+import os
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+os.environ.setdefault('MONGO_URI', 'mongodb://localhost:27017')
+
+import pytest
+from flask import Flask, jsonify
+
+from src.server.utils import conditional as conditional_module
+from src.server.utils.backends import InProcessBackend
+from src.server.utils.conditional import DatasetVersions, conditional
+
+class FakeCollection:
+    """The calls collection_version makes, over a list of dicts"""
+
+    def __init__(self, docs):
+        self.docs = docs
+
+    def estimated_document_count(self):
+        return len(self.docs)
+
+    def find_one(self, filter, projection, sort):
+        field, direction = sort[0]
+        present = [doc for doc in self.docs if field in doc]
+        if not present:
+            return self.docs[0] if self.docs else None
+        return sorted(present, key=lambda doc: doc[field], reverse=direction < 0)[0]
+
+@pytest.fixture
+def analyzed():
+    return FakeCollection([{'_id': i, 'Pentanal': float(i)} for i in range(1, 4)])
+
+def make_client(monkeypatch, collection, max_age=None):
+    versions = DatasetVersions(InProcessBackend()).probe('analyzed', collection, ttl=0.01, max_age=max_age)
+    monkeypatch.setattr(conditional_module, 'dataset_versions', versions)
+
+    app = Flask(__name__)
+
+    @app.route('/analyzed')
+    @conditional('analyzed')
+    def get_analyzed():
+        return jsonify(collection.docs)
+
+    return app.test_client()
+
+def revalidate(client, etag):
+    # Let the cached probe marker expire
+    time.sleep(0.02)
+    return client.get('/analyzed', headers={'If-None-Match': etag})
+
+def test_unchanged_dataset_revalidates(monkeypatch, analyzed):
+    client = make_client(monkeypatch, analyzed)
+    etag = client.get('/analyzed').headers['ETag']
+    assert revalidate(client, etag).status_code == 304
+
+def test_stamped_edit_changes_etag(monkeypatch, analyzed):
+    client = make_client(monkeypatch, analyzed)
+    etag = client.get('/analyzed').headers['ETag']
+
+    analyzed.docs[0].update({'Pentanal': 100.0, 'updated_at': datetime.now(timezone.utc)})
+
+    response = revalidate(client, etag)
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+
+def test_unstamped_edit_changes_etag_after_max_age(monkeypatch, analyzed):
+    max_age = timedelta(seconds=0.2)
+    client = make_client(monkeypatch, analyzed, max_age=max_age)
+    etag = client.get('/analyzed').headers['ETag']
+
+    analyzed.docs[0]['Pentanal'] = 100.0
+    time.sleep(max_age.total_seconds())
+
+    response = revalidate(client, etag)
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag